@@ -1,91 +1,92 @@
-import requests
-import time
-from urllib.parse import quote
+import os
+import sys
+from pathlib import Path
 
-def search_wb_positions(queries, seller_name, seller_id=None, max_pages=5):
+# Общий клиент поиска WB из приложения stock (модули stock.regions и stock.wb_search
+# не зависят от Django): лимит скорости, пауза по хосту с учетом Retry-After, кэш и регионы
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'wb_stock_manager_dj'))
+from stock.regions import DEFAULT_REGION, REGIONS
+from stock.search_cache import SearchPageCache
+from stock.wb_search import PAGE_SIZE, SearchMatcher, WBSearchClient
+
+_page_cache = None
+
+
+def get_page_cache():
+    """Кэш страниц выдачи на весь процесс; файл SEARCH_CACHE_PATH - общий с check_positions"""
+    global _page_cache
+    if _page_cache is None:
+        _page_cache = SearchPageCache(ttl=60 * 30, path=os.environ.get('SEARCH_CACHE_PATH') or None)
+    return _page_cache
+
+
+def search_wb_positions(queries, seller_name, seller_id=None, max_pages=5, rate=5, concurrency=8,
+                        target_articles=None, region=DEFAULT_REGION, cache=None):
     """
     Парсер позиций на Wildberries
     :param queries: список поисковых запросов
     :param seller_name: название продавца (строка)
     :param seller_id: ID продавца (необязательно, если есть название)
     :param max_pages: сколько страниц выдачи проверять (обычно 5 = 500 товаров)
-    :return: словарь {запрос: [(позиция, название товара, артикул, ссылка)]}
+    :param rate: лимит запросов в секунду (общий для всех запросов)
+    :param concurrency: сколько запросов выполнять одновременно
+    :param target_articles: артикулы, которые отслеживаем; если заданы, обход
+                            запроса прекращается, как только все они найдены
+    :param region: город выдачи (ключ REGIONS), например 'Москва'
+    :param cache: SearchPageCache; по умолчанию общий кэш процесса (get_page_cache)
+    :return: словарь {запрос: [(позиция, название товара, артикул, ссылка)]};
+             None - выдача по запросу не загрузилась
     """
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36',
-        'Accept': 'application/json',
-        'Origin': 'https://www.wildberries.ru',
-        'Referer': 'https://www.wildberries.ru/'
-    }
+    stop = None
+    if target_articles:
+        targets = {str(article) for article in target_articles}
+        seen = {query: set() for query in queries}
+
+        def all_found(query, page, items):
+            seen[query].update(str(item.id) for item in items)
+            return targets <= seen[query]
+        stop = all_found
+
+    # Продавец сопоставляется со страницей за один проход: ID - по хэш-таблице,
+    # название (подстрока без учета регистра) - автоматом Ахо-Корасик
+    matcher = SearchMatcher()
+    matcher.track_supplier_name(seller_name)
+    if seller_id:
+        matcher.track_supplier(seller_id)
+    matcher.compile()
+
+    client = WBSearchClient(rate=rate, concurrency=concurrency,
+                            cache=cache if cache is not None else get_page_cache())
+    pages_by_query = client.search_many(queries, max_pages, REGIONS[region], stop=stop)
 
     results = {}
 
     for query in queries:
-        print(f"\n🔍 Ищем по запросу: '{query}'")
+        print(f"\n🔍 Результаты по запросу: '{query}'")
+        if pages_by_query[query] is None:
+            print("  ❌ Выдача не загрузилась")
+            results[query] = None
+            continue
+
         found_items = []
-        position = 0
-        page = 1
-
-        while page <= max_pages:
-            url = f"https://search.wb.ru/exactmatch/ru/common/v4/search"
-            params = {
-                'appType': '1',
-                'curr': 'rub',
-                'dest': '-1257786',
-                'query': query,
-                'resultset': 'catalog',
-                'sort': 'popular',
-                'spp': '24',
-                'suppressSpellcheck': 'false',
-                'page': str(page)
-            }
-
-            try:
-                response = requests.get(url, params=params, headers=headers, timeout=10)
-                if response.status_code != 200:
-                    print(f"  ❌ Ошибка {response.status_code} на странице {page}")
-                    break
-
-                data = response.json()
-                products = data.get('data', {}).get('products', [])
-
-                if not products:
-                    print(f"  ℹ️  Страница {page} пуста. Останавливаемся.")
-                    break
-
-                for product in products:
-                    position += 1
-                    name = product.get('name', '')
-                    nm_id = product.get('id')
-                    brand = product.get('brand', '')
-                    supplier = product.get('supplier', '')  # Название продавца
-                    supplier_id = product.get('supplierId')
-
-                    # Проверяем совпадение по названию или ID
-                    seller_match = False
-                    if seller_id and str(supplier_id) == str(seller_id):
-                        seller_match = True
-                    elif seller_name.lower() in supplier.lower():
-                        seller_match = True
-
-                    if seller_match:
-                        link = f"https://www.wildberries.ru/catalog/{nm_id}/detail.aspx"
-                        found_items.append({
-                            'position': position,
-                            'name': name,
-                            'nm_id': nm_id,
-                            'brand': brand,
-                            'seller': supplier,
-                            'link': link
-                        })
-                        print(f"  ✅ Найдено на позиции {position}: {name[:50]}...")
-
-                page += 1
-                time	del.sleep(0.5)  # защита от бана
-
-            except Exception as e:
-                print(f"  ⚠️ Ошибка при запросе: {e}")
-                break
+        for page, items in pages_by_query[query]:
+            offset = (page - 1) * PAGE_SIZE
+            # Товар, совпавший и по названию, и по ID продавца, учитываем один раз
+            for position in sorted({hit.position for hit in matcher.match(items, page)}):
+                item = items[position - offset - 1]
+                supplier = item.supplier or ''  # Название продавца
+                name = item.name or ''
+                nm_id = item.id
+                link = f"https://www.wildberries.ru/catalog/{nm_id}/detail.aspx"
+                found_items.append({
+                    'position': position,
+                    'name': name,
+                    'nm_id': nm_id,
+                    'brand': item.brand,
+                    'seller': supplier,
+                    'link': link
+                })
+                print(f"  ✅ Найдено на позиции {position}: {name[:50]}...")
 
         results[query] = found_items
 
@@ -116,5 +117,7 @@ if __name__ == "__main__":
                 print(f"  Позиция {item['position']}: {item['name'][:60]}...")
                 print(f"  Артикул: {item['nm_id']} | Продавец: {item['seller']}")
                 print(f"  Ссылка: {item['link']}\n")
+        elif items is None:
+            print("  Выдача не загрузилась.")
         else:
-            print("  Товары этого продавца не найдены в топе.")
\ No newline at end of file
+            print("  Товары этого продавца не найдены в топе.")
@@ -1,11 +1,11 @@
 import pandas as pd
 import datetime
 import time
-import requests
 import logging
 import os
-import random
+import sys
 import hashlib
+from pathlib import Path
 from typing import List, Dict, Optional
 import matplotlib
 matplotlib.use('Agg')
@@ -15,6 +15,13 @@ import io
 import numpy as np
 from collections import defaultdict
 
+# Общий клиент поиска WB (модули stock.regions и stock.wb_search не зависят от Django):
+# лимит скорости, пауза по хосту с учетом Retry-After, кэш выдачи и таблица регионов - одни на все скрипты
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from stock.regions import REGIONS
+from stock.search_cache import SearchPageCache
+from stock.wb_search import PAGE_SIZE, WBSearchClient
+
 # Конфигурация
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -35,40 +42,35 @@ CONFIG = {
     'MAX_PAGE_sellers': 3,
     'BRANDS': ['YalowShop'],
     'SUPPLIERS': ['YalowShop'],
-    'REQUEST_DELAY': 1,
+    'REQUESTS_PER_SECOND': 5,
+    'CONCURRENCY': 8,
+    'MAX_RETRIES': 3,
+    # Кэш страниц выдачи: повторная проверка в пределах TTL не загружает страницы заново.
+    # Тот же файл, что у команды check_positions (SEARCH_CACHE_PATH), - общий кэш; None - только память
+    'SEARCH_CACHE_TTL': 60 * 30,
+    'SEARCH_CACHE_FILE': os.environ.get('SEARCH_CACHE_PATH') or None,
     'DATA_FILE': os.path.join(DATA_DIR, 'positions_data.csv'),
     'CATEGORY_HISTORY_FILE': os.path.join(DATA_DIR, 'category_history.csv'),
     'AVG_POSITIONS_FILE': os.path.join(DATA_DIR, 'avg_positions_data.csv'),
     'GLOBAL_AVG_FILE': os.path.join(DATA_DIR, 'global_avg_positions.csv')
 }
 
-# Свежие User-Agents и прокси подход
-USER_AGENTS = [
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/119.0",
-    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-]
-
 class WBParser:
     def __init__(self):
-        self.session = requests.Session()
-        self._update_headers()
-        
-    def _update_headers(self):
-        """Обновление заголовков со случайным User-Agent"""
-        user_agent = random.choice(USER_AGENTS)
-        self.session.headers.update({
-            'User-Agent': user_agent,
-            'Accept': '*/*',
-            'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive',
-            'Referer': 'https://www.wildberries.ru/',
-            'Sec-Fetch-Dest': 'empty',
-            'Sec-Fetch-Mode': 'cors',
-            'Sec-Fetch-Site': 'same-site',
-        })
+        self.client = WBSearchClient(
+            rate=CONFIG['REQUESTS_PER_SECOND'],
+            concurrency=CONFIG['CONCURRENCY'],
+            max_retries=CONFIG['MAX_RETRIES'],
+            cache=SearchPageCache(ttl=CONFIG['SEARCH_CACHE_TTL'], path=CONFIG['SEARCH_CACHE_FILE'])
+        )
+        # Бренды и поставщики приводятся к виду для сравнения один раз, а не на каждый товар
+        self.target_brands = {brand.strip().lower() for brand in CONFIG['BRANDS']}
+        self.target_suppliers = set(CONFIG['SUPPLIERS'])
+        # Каждый город - отдельная выдача со своим dest, позиции не смешиваются
+        unknown = [city for city in CONFIG['CITIES'] if city not in REGIONS]
+        if unknown:
+            raise ValueError(f"Неизвестные города {unknown}, доступны: {', '.join(REGIONS)}")
+        self.cities = {REGIONS[city]: city for city in CONFIG['CITIES']}
 
     def load_queries(self):
         """Загрузка запросов из файла"""
@@ -84,122 +86,61 @@ class WBParser:
         return queries
 
     def parse_products(self, query):
-        """Быстрый парсинг через API с обходом блокировок"""
-        results = []
-        print(f"🔍 Быстрый парсинг: '{query}'")
-        
-        for page in range(1, CONFIG['MAX_PAGE'] + 1):
-            try:
-                # Случайная задержка
-                time.sleep(CONFIG['REQUEST_DELAY'] + random.uniform(0.1, 0.3))
-                
-                # Обновляем заголовки для каждого запроса
-                self._update_headers()
-                
-                # Используем разные dest_id для обхода блокировок
-                dest_ids = [-1257786, -1029256, -102269, -2162196, -1257786]
-                dest_id = random.choice(dest_ids)
-                
-                # Основные параметры
-                params = {
-                    'ab_testing': 'false',
-                    'appType': 1,
-                    'curr': 'rub',
-                    'dest': dest_id,
-                    'query': query,
-                    'resultset': 'catalog',
-                    'sort': 'popular',
-                    'spp': 30,
-                    'uclusters': 1,
-                    'page': page,
-                    'lang': 'ru',
-                    'locale': 'ru',
-                    'timestamp': int(time.time() * 1000)
-                }
-                
-                # Пробуем разные эндпоинты
-                endpoints = [
-                    'https://search.wb.ru/exactmatch/ru/common/v4/search',
-                    'https://search.wb.ru/exactmatch/sng/common/v4/search',
-                ]
-                
-                response = None
-                for endpoint in endpoints:
-                    try:
-                        response = self.session.get(
-                            endpoint,
-                            params=params,
-                            timeout=10
-                        )
-                        
-                        if response.status_code == 200:
-                            # Проверяем что ответ содержит данные
-                            data = response.json()
-                            if data and 'data' in data and 'products' in data['data']:
-                                break
-                    except:
-                        continue
-                
-                if not response or response.status_code != 200:
-                    print(f"⚠️ Пропускаем страницу {page} для '{query}'")
+        """Парсинг одного запроса через API"""
+        return self.parse_products_many([query])[query]
+
+    def parse_products_many(self, queries):
+        """Параллельный парсинг нескольких запросов во всех городах с общим лимитом скорости"""
+        print(f"🔍 Быстрый парсинг: {len(queries)} запросов, городов: {len(self.cities)}")
+        # Ранней остановки нет: целевые товары заданы брендами и поставщиками, а не
+        # списком артикулов, поэтому условия "все найдены" не существует - товар бренда
+        # может оказаться на любой странице. Обход идет до конца выдачи или MAX_PAGE
+        pages_by_dest = self.client.search_regions(queries, list(self.cities), max_pages=CONFIG['MAX_PAGE'])
+
+        results = {query: [] for query in queries}
+        for dest, pages_by_query in pages_by_dest.items():
+            city = self.cities[dest]
+            for query, pages in pages_by_query.items():
+                if pages is None:
+                    print(f"❌ [{city}] Запрос '{query}': выдача не загрузилась")
                     continue
-                    
-                data = response.json()
-                
-                # Извлекаем товары
-                products = data.get('data', {}).get('products', [])
-                
-                if not products:
-                    break
-                    
-                # Обрабатываем товары
-                page_target_count = 0
-                for idx, product in enumerate(products):
-                    if self.is_target_product(product):
-                        global_idx = (page - 1) * 100 + idx + 1
-                        results.append(self.process_product(product, query, page, idx, global_idx))
-                        page_target_count += 1
-                
-                print(f"📄 Страница {page}: {len(products)} товаров, {page_target_count} целевых")
-                
-                # Если товаров меньше 100, значит это последняя страница
-                if len(products) < 100:
-                    break
-                    
-            except Exception as e:
-                print(f"❌ Ошибка на странице {page}: {e}")
-                continue
-        
-        print(f"✅ Запрос '{query}': {len(results)} целевых товаров")
+                query_results = results[query]
+                city_count = 0
+                for page, items in pages:
+                    page_target_count = 0
+                    for idx, item in enumerate(items):
+                        if self.is_target_product(item):
+                            global_idx = (page - 1) * PAGE_SIZE + idx + 1
+                            query_results.append(self.process_product(item, query, page, idx, global_idx, city))
+                            page_target_count += 1
+                    city_count += page_target_count
+                    print(f"📄 [{city}] '{query}' страница {page}: {len(items)} товаров, {page_target_count} целевых")
+                print(f"✅ [{city}] Запрос '{query}': {city_count} целевых товаров")
+
         return results
 
-    def is_target_product(self, product):
+    def is_target_product(self, item):
         """Проверка, является ли товар целевым"""
-        if not isinstance(product, dict):
-            return False
-            
-        brand = product.get('brand', '').strip().lower()
-        supplier = product.get('supplier', '').strip()
-        return brand in [b.lower() for b in CONFIG['BRANDS']] or supplier in CONFIG['SUPPLIERS']
+        brand = (item.brand or '').strip().lower()
+        supplier = (item.supplier or '').strip()
+        return brand in self.target_brands or supplier in self.target_suppliers
 
-    def process_product(self, product, query, page, idx, global_idx):
-        """Обработка данных товара"""
-        log_data = product.get('log', {})
-        
+    def process_product(self, item, query, page, idx, global_idx, city):
+        """Обработка данных товара (SearchItem из общего клиента поиска)"""
         return {
-            'Название': product.get('name', ''),
+            'Название': item.name,
             'Позиция': global_idx,
-            'Промо позиция': log_data.get('promoPosition'),
-            'Орг. позиция': log_data.get('position', idx + 1),
+            'Промо позиция': item.promo_position,
+            'Орг. позиция': item.organic_position if item.organic_position is not None else idx + 1,
             'Запрос': query,
             'Дата': datetime.datetime.now(MOSCOW_TZ),
-            'Промо': 'Да' if log_data.get('promoPosition') is not None else 'Нет',
-            'Город': 'Москва',
-            'Артикул': product.get('id', ''),
-            'Бренд': product.get('brand', ''),
-            'Поставщик': product.get('supplier', ''),
-            'Категория': product.get('subjectName', product.get('entity', '')),
-            'Цена': product.get('salePriceU', '') // 100 if product.get('salePriceU') else ''
+            'Промо': 'Да' if item.promo_position is not None else 'Нет',
+            'Город': city,
+            'Артикул': item.id or '',
+            'Бренд': item.brand,
+            'Поставщик': item.supplier,
+            'Категория': item.subject,
+            'Цена': item.price or ''
         }
 
 class WBAnalytics:
@@ -412,21 +353,12 @@ class WBParserService:
             queries = self.parser.load_queries()
             print(f"✅ Загружено запросов: {len(queries)}")
             
-            # Собираем новые данные
+            # Собираем новые данные: все запросы параллельно
+            started = time.monotonic()
             data = []
-            
-            for i, query in enumerate(queries, 1):
-                print(f"\n{'='*40}")
-                print(f"📋 ЗАПРОС {i}/{len(queries)}: '{query}'")
-                print(f"{'='*40}")
-                
-                products = self.parser.parse_products(query)
+            for query, products in self.parser.parse_products_many(queries).items():
                 data.extend(products)
-                print(f"📦 Итого: {len(products)} целевых товаров")
-                
-                # Минимальная задержка между запросами
-                if i < len(queries):
-                    time.sleep(0.5)
+                print(f"📦 '{query}': {len(products)} целевых товаров")
             
             print(f"\n{'='*60}")
             print("📊 СВОДКА")
@@ -450,7 +382,7 @@ class WBParserService:
             analytics.update_global_avg_positions(self.current_data)
             print("✅ Аналитика обновлена")
             
-            print(f"\n🎉 ПРОВЕРКА ЗАВЕРШЕНА ЗА {len(queries) * CONFIG['MAX_PAGE'] * CONFIG['REQUEST_DELAY']} СЕКУНД!")
+            print(f"\n🎉 ПРОВЕРКА ЗАВЕРШЕНА ЗА {time.monotonic() - started:.0f} СЕКУНД!")
             return True
             
         except Exception as e:
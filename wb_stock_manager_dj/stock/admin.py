@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Product, StockMovement
+from .models import Product, StockMovement, PositionAlertRule
 
 class StockMovementInline(admin.TabularInline):
     """Движения товара прямо в карточке товара"""
@@ -40,4 +40,9 @@ class StockMovementAdmin(admin.ModelAdmin):
     
     def movement_type_display(self, obj):
         return obj.get_movement_type_display()
-    movement_type_display.short_description = 'Тип операции'
\ No newline at end of file
+    movement_type_display.short_description = 'Тип операции'
+
+@admin.register(PositionAlertRule)
+class PositionAlertRuleAdmin(admin.ModelAdmin):
+    list_display = ('user', 'rule_type', 'threshold', 'is_active', 'created_at')
+    list_filter = ('rule_type', 'is_active')
@@ -3,7 +3,7 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User  # Импортируем стандартного User
 from django.utils import timezone
-from .models import UserProfile, Product, StockMovement, CampaignDailyStats, AdvertisingCampaign, GoalNote, CampaignGoal, ProductKeyword, ProductPosition
+from .models import UserProfile, Product, StockMovement, CampaignDailyStats, AdvertisingCampaign, GoalNote, CampaignGoal, ProductKeyword, ProductPosition, REGION_CHOICES, DEFAULT_REGION
 
 
 class CustomUserCreationForm(UserCreationForm):
@@ -373,6 +373,13 @@ class AddPositionForm(forms.Form):
         help_text="0 = товар не найден в поиске"
     )
     
+    region = forms.ChoiceField(
+        choices=REGION_CHOICES,
+        initial=DEFAULT_REGION,
+        widget=forms.Select(attrs={'class': 'form-select'}),
+        label="Регион"
+    )
+    
     def __init__(self, *args, **kwargs):
         user = kwargs.pop('user', None)
         # Получаем product_id из initial если есть
@@ -387,9 +394,9 @@ class AddPositionForm(forms.Form):
                 self.fields['keyword'].queryset = ProductKeyword.objects.filter(
                     product_id=self.product_id,
                     product__user=user
-                ).order_by('keyword')
+                ).select_related('product').order_by('keyword')  # product - для подписи в списке
             else:
                 # Иначе показываем все ключевые слова
                 self.fields['keyword'].queryset = ProductKeyword.objects.filter(
                     product__user=user
-                ).order_by('keyword')
\ No newline at end of file
+                ).select_related('product').order_by('keyword')
\ No newline at end of file
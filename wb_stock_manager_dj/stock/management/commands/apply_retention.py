@@ -0,0 +1,72 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from stock.retention import rollup_positions, rollup_campaign_stats
+
+
+class Command(BaseCommand):
+    help = 'Свертка старой истории позиций (по дням) и статистики рекламы (по месяцам)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--positions-days',
+            type=int,
+            default=settings.POSITION_RAW_RETENTION_DAYS,
+            help='Сколько дней хранить серии позиций без свертки'
+        )
+        parser.add_argument(
+            '--campaign-days',
+            type=int,
+            default=settings.CAMPAIGN_DAILY_RETENTION_DAYS,
+            help='Сколько дней хранить дневную статистику рекламы без свертки'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=settings.RETENTION_CHUNK_SIZE,
+            help='Сколько ключевых слов / кампаний обрабатывать в одной транзакции'
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0.2,
+            help='Пауза между порциями (сек), чтобы не блокировать запись в базу'
+        )
+        parser.add_argument(
+            '--max-seconds',
+            type=int,
+            default=0,
+            help='Остановиться после N секунд (следующий запуск продолжит с места остановки)'
+        )
+
+    def handle(self, *args, **options):
+        deadline = time.monotonic() + options['max_seconds'] if options['max_seconds'] else None
+        pause = options['pause']
+
+        positions_cutoff = timezone.now() - timedelta(days=options['positions_days'])
+        # Сворачиваем только полные месяцы
+        campaign_before = (timezone.localdate() - timedelta(days=options['campaign_days'])).replace(day=1)
+
+        jobs = [
+            ('📉 Позиции до ' + timezone.localtime(positions_cutoff).strftime('%d.%m.%Y'), 'серий', 'дней',
+             rollup_positions(positions_cutoff, options['chunk_size'])),
+            ('📢 Реклама до ' + campaign_before.strftime('%d.%m.%Y'), 'дней', 'месяцев',
+             rollup_campaign_stats(campaign_before, options['chunk_size'])),
+        ]
+        for title, source_name, target_name, chunks in jobs:
+            self.stdout.write(title)
+            removed = written = 0
+            for chunk_removed, chunk_written in chunks:
+                removed += chunk_removed
+                written += chunk_written
+                if chunk_removed:
+                    self.stdout.write(f"   свернуто {source_name}: {chunk_removed} -> {target_name}: {chunk_written}")
+                if deadline and time.monotonic() > deadline:
+                    self.stdout.write(self.style.WARNING('⏳ Лимит времени исчерпан, следующий запуск продолжит с этого места'))
+                    return
+                time.sleep(pause)
+            self.stdout.write(self.style.SUCCESS(f"✅ Свернуто {source_name}: {removed}, записано {target_name}: {written}"))
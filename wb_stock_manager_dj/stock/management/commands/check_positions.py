@@ -0,0 +1,99 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from stock.positions import get_query_subscriptions, get_regional_positions, record_positions
+from stock.regions import REGIONS
+from stock.search_cache import SearchPageCache
+from stock.wb_search import WBSearchClient, SearchMatcher, page_budget
+
+
+class Command(BaseCommand):
+    help = 'Автоматическая проверка позиций всех отслеживаемых ключевых слов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-pages',
+            type=int,
+            default=settings.POSITION_CHECK_MAX_PAGES,
+            help='Сколько страниц выдачи проверять по каждому запросу'
+        )
+        parser.add_argument(
+            '--regions',
+            default=','.join(settings.POSITION_REGIONS),
+            help='Регионы через запятую, например "Москва,Казань"'
+        )
+
+    def handle(self, *args, **options):
+        max_pages = options['max_pages']
+        regions = [region.strip() for region in options['regions'].split(',') if region.strip()]
+        unknown = [region for region in regions if region not in REGIONS]
+        if unknown:
+            raise CommandError(f"Неизвестные регионы: {', '.join(unknown)}. Доступны: {', '.join(REGIONS)}")
+        subscriptions = get_query_subscriptions()
+        if not subscriptions:
+            self.stdout.write('ℹ️ Нет ключевых слов для проверки')
+            return
+
+        self.stdout.write(f"🔍 Запросов к проверке: {len(subscriptions)}, регионов: {len(regions)}")
+        client = WBSearchClient(
+            rate=settings.POSITION_CHECK_RATE,
+            concurrency=settings.POSITION_CHECK_CONCURRENCY,
+            cache=SearchPageCache(
+                ttl=settings.SEARCH_CACHE_TTL,
+                max_pages=settings.SEARCH_CACHE_MAX_PAGES,
+                path=settings.SEARCH_CACHE_PATH
+            )
+        )
+
+        # Каждый уникальный запрос загружаем один раз для всех подписчиков,
+        # все пары (запрос, регион) - параллельно в пределах общего лимита скорости
+        matchers = {}
+        for query, keywords in subscriptions.items():
+            matcher = matchers[query] = SearchMatcher()
+            for keyword_id, user_id, article in keywords:
+                matcher.track_article(article, user=user_id, keyword=keyword_id)
+
+        # Лимит страниц по каждому запросу в каждом регионе - по глубине прошлых находок
+        previous = get_regional_positions(
+            [keyword_id for keywords in subscriptions.values() for keyword_id, _, _ in keywords],
+            regions
+        )
+        budgets = {
+            (query, REGIONS[region]): page_budget(
+                [previous.get((keyword_id, region)) for keyword_id, _, _ in keywords],
+                max_pages,
+                slack=settings.POSITION_CHECK_PAGE_SLACK
+            )
+            for query, keywords in subscriptions.items()
+            for region in regions
+        }
+        # Не найденные в урезанном лимите артикулы дочитываются до max_pages:
+        # 0 пишется, только если товара нет во всех max_pages страницах
+        results = client.match_regions(
+            matchers, [REGIONS[region] for region in regions], max_pages=budgets, widen_to=max_pages
+        )
+
+        new_positions = []
+        failed = 0
+        for region in regions:
+            for query, keywords in subscriptions.items():
+                hits = results[REGIONS[region]][query]
+                if hits is None:
+                    # Выдача не загрузилась: позиции неизвестны - не пишем нули и не шлем уведомления
+                    failed += 1
+                    self.stdout.write(self.style.WARNING(f"⚠️ [{region}] '{query}': выдача не загрузилась, пропускаем"))
+                    continue
+                found = {}
+                for hit in hits:
+                    found.setdefault(hit.keyword, hit.position)
+                for keyword_id, _, _ in keywords:
+                    # 0 = не найден на всех max_pages страницах
+                    new_positions.append((keyword_id, found.get(keyword_id, 0), region))
+                self.stdout.write(f"📋 [{region}] '{query}': найдено {len(found)} из {len(keywords)} ключевых слов")
+
+        # Предыдущие позиции, уведомления и сброс кэшей - внутри record_positions
+        record_positions(new_positions)
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Сохранено позиций: {len(new_positions)}"))
+        if failed:
+            self.stdout.write(self.style.WARNING(f"⚠️ Не загружено выдач: {failed} - проверятся при следующем запуске"))
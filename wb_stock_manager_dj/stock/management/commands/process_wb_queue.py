@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from stock.models import UserProfile, WBRetryTask
+from stock.wb_circuit import due_probes
+from stock.wb_parser import get_wb_simple_service
+from stock.wb_sync import sync_or_schedule, WBSyncError
+
+
+class Command(BaseCommand):
+    help = 'Фоновый воркер WB: проверка отключенных эндпоинтов и повтор неудавшихся синхронизаций (запускать по расписанию, например раз в минуту)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=20,
+            help='Сколько повторов синхронизации выполнять за один запуск'
+        )
+
+    def handle(self, *args, **options):
+        self.probe_circuits()
+        self.run_retries(options['limit'])
+
+    def probe_circuits(self):
+        """Пробные запросы к эндпоинтам, отключенным предохранителем"""
+        pending = {}
+        for token, endpoint in due_probes():
+            pending.setdefault(token, []).append(endpoint)
+        if not pending:
+            return
+
+        # В базе только хэши токенов - находим владельцев перебором профилей с токеном
+        for profile in UserProfile.objects.filter(wb_api_token_encrypted=True).select_related('user'):
+            service = get_wb_simple_service(profile.user)
+            if service is None or service.token_key not in pending:
+                continue
+            for endpoint in pending.pop(service.token_key):
+                result = service.probe(endpoint)
+                if result:
+                    self.stdout.write(self.style.SUCCESS(f"🔌 {profile.user.username} {endpoint}: снова работает"))
+                elif result is not None:
+                    self.stdout.write(self.style.WARNING(f"🔌 {profile.user.username} {endpoint}: все еще недоступен"))
+            if not pending:
+                break
+
+    def run_retries(self, limit):
+        """Повторить синхронизации, время которых подошло"""
+        tasks = (
+            WBRetryTask.objects.filter(job='sync', next_attempt_at__lte=timezone.now())
+            .select_related('user').order_by('next_attempt_at')[:limit]
+        )
+        for task in tasks:
+            service = get_wb_simple_service(task.user)
+            if service is None:
+                # Токен удален - повторять нечего
+                task.delete()
+                continue
+            try:
+                saved = sync_or_schedule(service, task.user)
+            except WBSyncError as e:
+                self.stdout.write(self.style.WARNING(f"🕒 {task.user.username}: {e}, попытка {task.attempts + 1} не удалась"))
+                continue
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ {task.user.username}: заказов {saved['orders']}, продаж {saved['sales']}"
+            ))
@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from stock.models import UserProfile
+from stock.wb_parser import get_wb_simple_service
+
+
+class Command(BaseCommand):
+    help = 'Заранее обновить аналитику за сегодня активных пользователей (запускать по расписанию, например раз в 5 минут)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--active-hours',
+            type=int,
+            default=settings.WB_REWARM_ACTIVE_HOURS,
+            help='Прогревать пользователей, открывавших аналитику за последние N часов'
+        )
+        parser.add_argument(
+            '--ahead',
+            type=int,
+            default=settings.WB_REWARM_AHEAD,
+            help='Обновлять данные, которые устареют в ближайшие N секунд'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Сколько пользователей обновлять параллельно'
+        )
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(hours=options['active_hours'])
+        profiles = list(
+            UserProfile.objects.filter(analytics_viewed_at__gte=since, wb_api_token_encrypted=True)
+            .select_related('user')
+        )
+        if not profiles:
+            self.stdout.write('ℹ️ Нет активных пользователей аналитики')
+            return
+
+        self.stdout.write(f"🔥 Активных пользователей: {len(profiles)}")
+        ahead = options['ahead']
+
+        def rewarm(profile):
+            try:
+                service = get_wb_simple_service(profile.user)
+                return service is not None and service.rewarm_today_data(profile.user_id, ahead)
+            finally:
+                connections.close_all()
+
+        refreshed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(rewarm, profile): profile for profile in profiles}
+            for future in as_completed(futures):
+                profile = futures[future]
+                try:
+                    if future.result():
+                        refreshed += 1
+                        self.stdout.write(f"   обновлено: {profile.user.username}")
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f"❌ {profile.user.username}: {e}"))
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Обновлено: {refreshed}, пропущено: {len(profiles) - refreshed}"))
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from stock.models import UserProfile
+from stock.wb_parser import get_wb_simple_service
+from stock.wb_sync import sync_or_schedule, WBSyncError
+
+
+class Command(BaseCommand):
+    help = 'Загрузить новые и измененные заказы и продажи WB всех пользователей с токеном'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help='Синхронизировать только этого пользователя (username)'
+        )
+        parser.add_argument(
+            '--initial-days',
+            type=int,
+            default=settings.WB_SYNC_INITIAL_DAYS,
+            help='Сколько дней истории забирать при первой синхронизации'
+        )
+
+    def handle(self, *args, **options):
+        profiles = UserProfile.objects.filter(wb_api_token_encrypted=True).select_related('user')
+        if options['user']:
+            profiles = profiles.filter(user__username=options['user'])
+        if not profiles:
+            self.stdout.write('ℹ️ Нет пользователей с API токеном')
+            return
+
+        for profile in profiles:
+            service = get_wb_simple_service(profile.user)
+            if service is None:
+                continue
+            self.stdout.write(f"🔄 {profile.user.username}")
+            try:
+                saved = sync_or_schedule(service, profile.user, options['initial_days'])
+            except WBSyncError as e:
+                self.stdout.write(self.style.ERROR(f"❌ {e} - повтор поставлен в очередь"))
+                continue
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ Заказов: {saved['orders']}, продаж: {saved['sales']}"
+            ))
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0011_alter_productposition_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productposition',
+            index=models.Index(fields=['keyword', '-created_at'], name='position_keyword_date_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def link_keywords_to_queries(apps, schema_editor):
+    """Привязываем существующие ключевые слова к общим поисковым запросам"""
+    SearchQuery = apps.get_model('stock', 'SearchQuery')
+    ProductKeyword = apps.get_model('stock', 'ProductKeyword')
+
+    queries = {}
+    for keyword in ProductKeyword.objects.filter(search_query__isnull=True):
+        text = ' '.join(keyword.keyword.split()).casefold()
+        if text not in queries:
+            queries[text], _ = SearchQuery.objects.get_or_create(text=text)
+        keyword.search_query = queries[text]
+        keyword.save(update_fields=['search_query'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0012_productposition_keyword_date_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.CharField(max_length=255, unique=True, verbose_name='Нормализованный запрос')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Поисковый запрос',
+                'verbose_name_plural': 'Поисковые запросы',
+                'ordering': ['text'],
+            },
+        ),
+        migrations.AddField(
+            model_name='productkeyword',
+            name='search_query',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='keywords', to='stock.searchquery', verbose_name='Поисковый запрос'),
+        ),
+        migrations.RunPython(link_keywords_to_queries, migrations.RunPython.noop),
+    ]
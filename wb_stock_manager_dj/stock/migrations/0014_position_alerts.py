@@ -0,0 +1,80 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_last_positions(apps, schema_editor):
+    """Заполняем последнюю позицию ключевых слов по истории"""
+    ProductKeyword = apps.get_model('stock', 'ProductKeyword')
+    ProductPosition = apps.get_model('stock', 'ProductPosition')
+
+    for keyword in ProductKeyword.objects.all():
+        latest = ProductPosition.objects.filter(keyword=keyword).order_by('-created_at').first()
+        if latest:
+            keyword.last_position = latest.position
+            keyword.last_checked_at = latest.created_at
+            keyword.save(update_fields=['last_position', 'last_checked_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0013_searchquery'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productkeyword',
+            name='last_checked_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Последняя проверка'),
+        ),
+        migrations.AddField(
+            model_name='productkeyword',
+            name='last_position',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Последняя позиция'),
+        ),
+        migrations.AddField(
+            model_name='productposition',
+            name='previous_position',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='PositionAlertRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rule_type', models.CharField(choices=[('left_top', '📉 Выпал из топ-N'), ('entered_top', '📈 Попал в топ-N'), ('drop', '⬇️ Упал на N и более мест'), ('lost', '❌ Пропал из выдачи')], max_length=15, verbose_name='Тип правила')),
+                ('threshold', models.PositiveIntegerField(default=10, verbose_name='Порог (N)')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Активно')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='position_alert_rules', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Правило уведомлений о позициях',
+                'verbose_name_plural': 'Правила уведомлений о позициях',
+            },
+        ),
+        migrations.CreateModel(
+            name='PositionAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rule_type', models.CharField(choices=[('left_top', '📉 Выпал из топ-N'), ('entered_top', '📈 Попал в топ-N'), ('drop', '⬇️ Упал на N и более мест'), ('lost', '❌ Пропал из выдачи')], max_length=15)),
+                ('threshold', models.PositiveIntegerField()),
+                ('previous_position', models.IntegerField()),
+                ('position', models.IntegerField()),
+                ('is_read', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('keyword', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alerts', to='stock.productkeyword')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='position_alerts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Уведомление о позиции',
+                'verbose_name_plural': 'Уведомления о позициях',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', '-created_at'], name='alert_user_date_idx')],
+            },
+        ),
+        migrations.RunPython(fill_last_positions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0014_position_alerts'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='productposition',
+            name='position_keyword_date_idx',
+        ),
+        migrations.AddField(
+            model_name='positionalert',
+            name='region',
+            field=models.CharField(choices=[('Москва', 'Москва'), ('Санкт-Петербург', 'Санкт-Петербург'), ('Казань', 'Казань'), ('Екатеринбург', 'Екатеринбург'), ('Новосибирск', 'Новосибирск'), ('Краснодар', 'Краснодар')], default='Москва', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='productposition',
+            name='region',
+            field=models.CharField(choices=[('Москва', 'Москва'), ('Санкт-Петербург', 'Санкт-Петербург'), ('Казань', 'Казань'), ('Екатеринбург', 'Екатеринбург'), ('Новосибирск', 'Новосибирск'), ('Краснодар', 'Краснодар')], default='Москва', max_length=50, verbose_name='Регион'),
+        ),
+        migrations.AddIndex(
+            model_name='productposition',
+            index=models.Index(fields=['keyword', 'region', '-created_at'], name='position_kw_region_date_idx'),
+        ),
+    ]
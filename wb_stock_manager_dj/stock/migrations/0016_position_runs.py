@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:33
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def fill_last_seen(apps, schema_editor):
+    """Старые записи - серии из одной проверки"""
+    ProductPosition = apps.get_model('stock', 'ProductPosition')
+    ProductPosition.objects.update(last_seen_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0015_position_region'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productposition',
+            name='checks',
+            field=models.PositiveIntegerField(default=1, verbose_name='Проверок в серии'),
+        ),
+        migrations.AddField(
+            model_name='productposition',
+            name='last_seen_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Последняя проверка'),
+        ),
+        migrations.RunPython(fill_last_seen, migrations.RunPython.noop),
+    ]
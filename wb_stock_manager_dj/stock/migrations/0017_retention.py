@@ -0,0 +1,62 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0016_position_runs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job', models.CharField(max_length=50, unique=True)),
+                ('last_id', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CampaignMonthlyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Месяц')),
+                ('days', models.PositiveIntegerField(default=0, verbose_name='Дней со статистикой')),
+                ('views', models.PositiveIntegerField(default=0, verbose_name='Показы')),
+                ('clicks', models.PositiveIntegerField(default=0, verbose_name='Клики')),
+                ('cart_adds', models.PositiveIntegerField(default=0, verbose_name='Добавления в корзину')),
+                ('orders', models.PositiveIntegerField(default=0, verbose_name='Заказы')),
+                ('spent', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Затраты (руб)')),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_stats', to='stock.advertisingcampaign')),
+            ],
+            options={
+                'verbose_name': 'Месячная статистика кампании',
+                'verbose_name_plural': 'Месячная статистика кампаний',
+                'ordering': ['-month'],
+                'unique_together': {('campaign', 'month')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PositionDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region', models.CharField(choices=[('Москва', 'Москва'), ('Санкт-Петербург', 'Санкт-Петербург'), ('Казань', 'Казань'), ('Екатеринбург', 'Екатеринбург'), ('Новосибирск', 'Новосибирск'), ('Краснодар', 'Краснодар')], default='Москва', max_length=50)),
+                ('date', models.DateField()),
+                ('min_position', models.IntegerField(blank=True, null=True)),
+                ('avg_position', models.FloatField(blank=True, null=True)),
+                ('max_position', models.IntegerField(blank=True, null=True)),
+                ('checks', models.PositiveIntegerField(default=0)),
+                ('keyword', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_positions', to='stock.productkeyword')),
+            ],
+            options={
+                'verbose_name': 'Позиции за день (архив)',
+                'verbose_name_plural': 'Позиции по дням (архив)',
+                'ordering': ['-date'],
+                'unique_together': {('keyword', 'region', 'date')},
+            },
+        ),
+    ]
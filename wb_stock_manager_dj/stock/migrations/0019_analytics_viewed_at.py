@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0018_wb_shared_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='analytics_viewed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Последний просмотр аналитики'),
+        ),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0019_analytics_viewed_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WBOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('srid', models.CharField(max_length=100, verbose_name='ID заказа (srid)')),
+                ('odid', models.BigIntegerField(blank=True, null=True)),
+                ('date', models.DateTimeField(verbose_name='Дата заказа')),
+                ('last_change_date', models.DateTimeField()),
+                ('nm_id', models.BigIntegerField(verbose_name='Артикул WB')),
+                ('supplier_article', models.CharField(blank=True, max_length=100)),
+                ('barcode', models.CharField(blank=True, max_length=50)),
+                ('tech_size', models.CharField(blank=True, max_length=50)),
+                ('subject', models.CharField(blank=True, max_length=255)),
+                ('brand', models.CharField(blank=True, max_length=255)),
+                ('warehouse_name', models.CharField(blank=True, max_length=255)),
+                ('region_name', models.CharField(blank=True, max_length=255)),
+                ('total_price', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('discount_percent', models.IntegerField(default=0)),
+                ('spp', models.DecimalField(decimal_places=2, default=0, max_digits=6)),
+                ('finished_price', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('price_with_disc', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('is_cancel', models.BooleanField(default=False)),
+                ('cancel_date', models.DateTimeField(blank=True, null=True)),
+                ('order_type', models.CharField(blank=True, max_length=100)),
+                ('g_number', models.CharField(blank=True, max_length=100)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='wb_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Заказ WB',
+                'verbose_name_plural': 'Заказы WB',
+                'ordering': ['-date'],
+                'indexes': [models.Index(fields=['user', 'date', 'nm_id'], name='wborder_user_date_nm_idx')],
+                'unique_together': {('user', 'srid')},
+            },
+        ),
+        migrations.CreateModel(
+            name='WBSale',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sale_id', models.CharField(max_length=50, verbose_name='ID продажи')),
+                ('srid', models.CharField(max_length=100, verbose_name='ID заказа (srid)')),
+                ('odid', models.BigIntegerField(blank=True, null=True)),
+                ('date', models.DateTimeField(verbose_name='Дата продажи')),
+                ('last_change_date', models.DateTimeField()),
+                ('nm_id', models.BigIntegerField(verbose_name='Артикул WB')),
+                ('supplier_article', models.CharField(blank=True, max_length=100)),
+                ('barcode', models.CharField(blank=True, max_length=50)),
+                ('tech_size', models.CharField(blank=True, max_length=50)),
+                ('subject', models.CharField(blank=True, max_length=255)),
+                ('brand', models.CharField(blank=True, max_length=255)),
+                ('warehouse_name', models.CharField(blank=True, max_length=255)),
+                ('region_name', models.CharField(blank=True, max_length=255)),
+                ('total_price', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('discount_percent', models.IntegerField(default=0)),
+                ('spp', models.DecimalField(decimal_places=2, default=0, max_digits=6)),
+                ('for_pay', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('finished_price', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('price_with_disc', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('is_return', models.BooleanField(default=False)),
+                ('order_type', models.CharField(blank=True, max_length=100)),
+                ('g_number', models.CharField(blank=True, max_length=100)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='wb_sales', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Продажа WB',
+                'verbose_name_plural': 'Продажи WB',
+                'ordering': ['-date'],
+                'indexes': [models.Index(fields=['user', 'date', 'nm_id'], name='wbsale_user_date_nm_idx'), models.Index(fields=['user', 'srid'], name='wbsale_user_srid_idx')],
+                'unique_together': {('user', 'sale_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='WBSyncCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(max_length=20)),
+                ('last_change_date', models.DateTimeField(blank=True, null=True)),
+                ('synced_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='wb_sync_cursors', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'endpoint')},
+            },
+        ),
+    ]
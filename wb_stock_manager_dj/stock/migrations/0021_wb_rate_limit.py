@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0020_wb_orders_sales'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WBRateLimit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('next_at', models.FloatField(default=0)),
+                ('blocked_until', models.FloatField(default=0)),
+            ],
+        ),
+    ]
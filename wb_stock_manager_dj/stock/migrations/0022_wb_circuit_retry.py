@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0021_wb_rate_limit'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WBCircuit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('state', models.CharField(choices=[('closed', 'Работает'), ('open', 'Отключен'), ('half_open', 'Проверка')], default='closed', max_length=10)),
+                ('failures', models.PositiveIntegerField(default=0)),
+                ('retry_at', models.FloatField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('opened_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WBRetryTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job', models.CharField(default='sync', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField()),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='wb_retry_tasks', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['next_attempt_at'], name='wbretry_next_attempt_idx')],
+                'unique_together': {('user', 'job')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-19 03:10
+
+from django.db import migrations, models
+
+
+def fill_found_checks(apps, schema_editor):
+    """Старые дни считали серии, а не проверки - берем их число как вес средней"""
+    PositionDailyStats = apps.get_model('stock', 'PositionDailyStats')
+    PositionDailyStats.objects.filter(avg_position__isnull=False).update(found_checks=models.F('checks'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0022_wb_circuit_retry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='positiondailystats',
+            name='found_checks',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_found_checks, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,14 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
+from django.utils.functional import cached_property
 from cryptography.fernet import Fernet
 from django.conf import settings
 from datetime import date
+from .search_cache import normalize_query
+from .regions import REGIONS, DEFAULT_REGION
+
+REGION_CHOICES = [(name, name) for name in REGIONS]
 
 # Функции для шифрования/дешифрования
 def encrypt_token(token):
@@ -28,6 +33,7 @@ class UserProfile(models.Model):
     company_name = models.CharField(max_length=255, blank=True, verbose_name="Название компании")
     contact_email = models.EmailField(blank=True, verbose_name="Контактный email")
     notification_enabled = models.BooleanField(default=True, verbose_name="Уведомления включены")
+    analytics_viewed_at = models.DateTimeField(null=True, blank=True, verbose_name="Последний просмотр аналитики")
     avatar = models.ImageField(upload_to='avatars/', blank=True, null=True, verbose_name="Аватар")
     
     created_at = models.DateTimeField(auto_now_add=True)
@@ -251,30 +257,53 @@ class AdvertisingCampaign(models.Model):
         end_date = self.end_date or date.today()
         return (end_date - self.start_date).days
 
+    @cached_property
+    def _totals(self):
+        """Суммы по дневной статистике и по месячному архиву (после свертки старых дней)
+
+        Считаются один раз на объект одним запросом (UNION двух агрегатов),
+        а не заново при каждом чтении total_* / ctr / cpc.
+        """
+        fields = ['views', 'clicks', 'cart_adds', 'orders', 'spent']
+        sums = {field: models.Sum(field) for field in fields}
+        rows = self.daily_stats.order_by().values('campaign').annotate(**sums).union(
+            self.monthly_stats.order_by().values('campaign').annotate(**sums),
+            all=True
+        )
+        totals = dict.fromkeys(fields, 0)
+        for row in rows:
+            for field in fields:
+                totals[field] += row[field] or 0
+        return totals
+
+    def _stats_total(self, field):
+        """Сумма по дневной статистике и по месячному архиву"""
+        return self._totals[field]
+
     @property
     def total_spent(self):
         """Общие затраты на кампанию"""
-        return self.daily_stats.aggregate(total=models.Sum('spent'))['total'] or 0
+        return self._stats_total('spent')
 
     @property
     def total_views(self):
         """Общее количество показов"""
-        return self.daily_stats.aggregate(total=models.Sum('views'))['total'] or 0
+        return self._stats_total('views')
 
     @property
     def total_clicks(self):
         """Общее количество кликов"""
-        return self.daily_stats.aggregate(total=models.Sum('clicks'))['total'] or 0
+        return self._stats_total('clicks')
 
     @property
     def total_cart_adds(self):
         """Общее количество добавлений в корзину"""
-        return self.daily_stats.aggregate(total=models.Sum('cart_adds'))['total'] or 0
+        return self._stats_total('cart_adds')
 
     @property
     def total_orders(self):
         """Общее количество заказов"""
-        return self.daily_stats.aggregate(total=models.Sum('orders'))['total'] or 0
+        return self._stats_total('orders')
 
     @property
     def ctr(self):
@@ -375,6 +404,42 @@ class CampaignDailyStats(models.Model):
         return 0
 
 
+
+class CampaignMonthlyStats(models.Model):
+    """Месячный архив статистики кампании (свернутые старые дни)"""
+    campaign = models.ForeignKey(AdvertisingCampaign, on_delete=models.CASCADE, related_name='monthly_stats')
+    month = models.DateField(verbose_name="Месяц")  # Первое число месяца
+    days = models.PositiveIntegerField(default=0, verbose_name="Дней со статистикой")
+
+    views = models.PositiveIntegerField(default=0, verbose_name="Показы")
+    clicks = models.PositiveIntegerField(default=0, verbose_name="Клики")
+    cart_adds = models.PositiveIntegerField(default=0, verbose_name="Добавления в корзину")
+    orders = models.PositiveIntegerField(default=0, verbose_name="Заказы")
+    spent = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Затраты (руб)")
+
+    class Meta:
+        verbose_name = "Месячная статистика кампании"
+        verbose_name_plural = "Месячная статистика кампаний"
+        ordering = ['-month']
+        unique_together = ['campaign', 'month']
+
+    def __str__(self):
+        return f"{self.campaign.name} - {self.month:%m.%Y}"
+
+    @property
+    def ctr(self):
+        """CTR (Click-Through Rate)"""
+        if self.views > 0:
+            return (self.clicks / self.views) * 100
+        return 0
+
+    @property
+    def cpc(self):
+        """Стоимость клика"""
+        if self.clicks > 0:
+            return self.spent / self.clicks
+        return 0
+
 class CampaignGoal(models.Model):
     """Цели для рекламных кампаний"""
     GOAL_TYPES = (
@@ -473,6 +538,29 @@ class GoalNote(models.Model):
         return f"{self.title} - {self.goal.title}"
 
 
+class SearchQuery(models.Model):
+    """Поисковый запрос WB, общий для всех пользователей"""
+    text = models.CharField(max_length=255, unique=True, verbose_name="Нормализованный запрос")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Поисковый запрос"
+        verbose_name_plural = "Поисковые запросы"
+        ordering = ['text']
+
+    def __str__(self):
+        return self.text
+
+    @classmethod
+    def resolve(cls, texts):
+        """Возвращает {нормализованный текст: SearchQuery}, создавая недостающие"""
+        normalized = {normalize_query(text) for text in texts} - {''}
+        if not normalized:
+            return {}
+        cls.objects.bulk_create([cls(text=text) for text in normalized], ignore_conflicts=True)
+        return {query.text: query for query in cls.objects.filter(text__in=normalized)}
+
+
 class ProductKeyword(models.Model):
     """Ключевое слово для товара"""
     product = models.ForeignKey(
@@ -481,6 +569,17 @@ class ProductKeyword(models.Model):
         related_name='keywords'
     )
     keyword = models.CharField(max_length=255)
+    search_query = models.ForeignKey(
+        SearchQuery,
+        on_delete=models.PROTECT,
+        related_name='keywords',
+        null=True,
+        blank=True,
+        verbose_name="Поисковый запрос"
+    )
+    # Последняя проверка в основном регионе (DEFAULT_REGION) - обновляется при каждой записи позиции
+    last_position = models.IntegerField(null=True, blank=True, verbose_name="Последняя позиция")
+    last_checked_at = models.DateTimeField(null=True, blank=True, verbose_name="Последняя проверка")
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -489,15 +588,20 @@ class ProductKeyword(models.Model):
     def __str__(self):
         return f"{self.keyword} - {self.product.name}"
 
+    def save(self, *args, **kwargs):
+        """Привязываем ключевое слово к общему поисковому запросу"""
+        normalized = normalize_query(self.keyword)
+        if self.search_query_id is None or self.search_query.text != normalized:
+            self.search_query, _ = SearchQuery.objects.get_or_create(text=normalized)
+        super().save(*args, **kwargs)
+
     @property
     def current_position(self):
-        latest = self.positions.order_by('-created_at').first()  # Изменено с '-date' на '-created_at'
-        return latest.position if latest else None
+        return self.last_position  # Без запроса к истории - поле обновляет record_positions
 
     @property
     def last_checked(self):
-        latest = self.positions.order_by('-created_at').first()  # Изменено с '-date' на '-created_at'
-        return latest.created_at if latest else None
+        return self.last_checked_at
 
 
 class ProductPosition(models.Model):
@@ -508,14 +612,262 @@ class ProductPosition(models.Model):
         related_name='positions'
     )
     position = models.IntegerField()  # 0 = не найден
-    created_at = models.DateTimeField(auto_now_add=True)  # Автоматическая дата
+    previous_position = models.IntegerField(null=True, blank=True)  # Позиция на предыдущей проверке в том же регионе
+    region = models.CharField(max_length=50, choices=REGION_CHOICES, default=DEFAULT_REGION, verbose_name="Регион")
+    created_at = models.DateTimeField(auto_now_add=True)  # Автоматическая дата (начало серии)
+    # Серия одинаковых проверок хранится одной строкой: created_at - первая, last_seen_at - последняя
+    last_seen_at = models.DateTimeField(default=timezone.now, verbose_name="Последняя проверка")
+    checks = models.PositiveIntegerField(default=1, verbose_name="Проверок в серии")
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['keyword', 'region', '-created_at'], name='position_kw_region_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.keyword.keyword}: {self.position} ({self.created_at.date()})"
     
     @property
     def date(self):  # Свойство для обратной совместимости
-        return self.created_at.date()
\ No newline at end of file
+        return self.created_at.date()
+    @property
+    def change(self):
+        """Изменение относительно предыдущей проверки (плюс - рост)"""
+        if not self.previous_position or not self.position:
+            return None
+        return self.previous_position - self.position
+
+
+class PositionAlertRule(models.Model):
+    """Правило уведомления об изменении позиции"""
+    RULE_TYPES = (
+        ('left_top', '📉 Выпал из топ-N'),
+        ('entered_top', '📈 Попал в топ-N'),
+        ('drop', '⬇️ Упал на N и более мест'),
+        ('lost', '❌ Пропал из выдачи'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='position_alert_rules')
+    rule_type = models.CharField(max_length=15, choices=RULE_TYPES, verbose_name="Тип правила")
+    threshold = models.PositiveIntegerField(default=10, verbose_name="Порог (N)")
+    is_active = models.BooleanField(default=True, verbose_name="Активно")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Правило уведомлений о позициях"
+        verbose_name_plural = "Правила уведомлений о позициях"
+
+    def __str__(self):
+        return f"{self.get_rule_type_display()} (N={self.threshold})"
+
+    def matches(self, previous, position):
+        """Срабатывает ли правило при переходе previous -> position"""
+        if previous is None:
+            return False
+        n = self.threshold
+        if self.rule_type == 'left_top':
+            return 0 < previous <= n and (position == 0 or position > n)
+        if self.rule_type == 'entered_top':
+            return 0 < position <= n and (previous == 0 or previous > n)
+        if self.rule_type == 'drop':
+            return previous > 0 and position > 0 and position - previous >= n
+        if self.rule_type == 'lost':
+            return previous > 0 and position == 0
+        return False
+
+
+class PositionAlert(models.Model):
+    """Уведомление об изменении позиции"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='position_alerts')
+    keyword = models.ForeignKey(ProductKeyword, on_delete=models.CASCADE, related_name='alerts')
+    region = models.CharField(max_length=50, choices=REGION_CHOICES, default=DEFAULT_REGION)
+    rule_type = models.CharField(max_length=15, choices=PositionAlertRule.RULE_TYPES)
+    threshold = models.PositiveIntegerField()
+    previous_position = models.IntegerField()
+    position = models.IntegerField()
+    is_read = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Уведомление о позиции"
+        verbose_name_plural = "Уведомления о позициях"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='alert_user_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.keyword.keyword}: {self.previous_position} → {self.position}"
+
+
+class PositionDailyStats(models.Model):
+    """Свернутая история позиций: ключевое слово × регион × день"""
+    keyword = models.ForeignKey(ProductKeyword, on_delete=models.CASCADE, related_name='daily_positions')
+    region = models.CharField(max_length=50, choices=REGION_CHOICES, default=DEFAULT_REGION)
+    date = models.DateField()
+    # None - за день ни разу не найден
+    min_position = models.IntegerField(null=True, blank=True)
+    avg_position = models.FloatField(null=True, blank=True)
+    max_position = models.IntegerField(null=True, blank=True)
+    checks = models.PositiveIntegerField(default=0)  # Сколько проверок свернуто в день
+    found_checks = models.PositiveIntegerField(default=0)  # Из них с найденной позицией (вес avg_position)
+
+    class Meta:
+        verbose_name = "Позиции за день (архив)"
+        verbose_name_plural = "Позиции по дням (архив)"
+        ordering = ['-date']
+        unique_together = ['keyword', 'region', 'date']
+
+    def __str__(self):
+        return f"{self.keyword.keyword}: {self.min_position}-{self.max_position} ({self.date})"
+
+
+class RetentionCursor(models.Model):
+    """Докуда дошла свертка истории (чтобы прерванный запуск продолжался с места остановки)"""
+    job = models.CharField(max_length=50, unique=True)
+    last_id = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.job}: {self.last_id}"
+
+
+class WBOrder(models.Model):
+    """Заказ из API статистики WB (локальная копия для отчетов)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='wb_orders')
+    srid = models.CharField(max_length=100, verbose_name="ID заказа (srid)")
+    odid = models.BigIntegerField(null=True, blank=True)  # Устаревший ID, по нему сопоставлялись выкупы
+    date = models.DateTimeField(verbose_name="Дата заказа")
+    last_change_date = models.DateTimeField()
+    nm_id = models.BigIntegerField(verbose_name="Артикул WB")
+    supplier_article = models.CharField(max_length=100, blank=True)
+    barcode = models.CharField(max_length=50, blank=True)
+    tech_size = models.CharField(max_length=50, blank=True)
+    subject = models.CharField(max_length=255, blank=True)
+    brand = models.CharField(max_length=255, blank=True)
+    warehouse_name = models.CharField(max_length=255, blank=True)
+    region_name = models.CharField(max_length=255, blank=True)
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    discount_percent = models.IntegerField(default=0)
+    spp = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    finished_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    price_with_disc = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    is_cancel = models.BooleanField(default=False)
+    cancel_date = models.DateTimeField(null=True, blank=True)
+    order_type = models.CharField(max_length=100, blank=True)
+    g_number = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        verbose_name = "Заказ WB"
+        verbose_name_plural = "Заказы WB"
+        ordering = ['-date']
+        unique_together = ['user', 'srid']
+        indexes = [
+            models.Index(fields=['user', 'date', 'nm_id'], name='wborder_user_date_nm_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.srid} ({self.nm_id})"
+
+
+class WBSale(models.Model):
+    """Выкуп или возврат из API статистики WB (локальная копия для отчетов)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='wb_sales')
+    sale_id = models.CharField(max_length=50, verbose_name="ID продажи")  # S... - выкуп, R... - возврат
+    srid = models.CharField(max_length=100, verbose_name="ID заказа (srid)")
+    odid = models.BigIntegerField(null=True, blank=True)
+    date = models.DateTimeField(verbose_name="Дата продажи")
+    last_change_date = models.DateTimeField()
+    nm_id = models.BigIntegerField(verbose_name="Артикул WB")
+    supplier_article = models.CharField(max_length=100, blank=True)
+    barcode = models.CharField(max_length=50, blank=True)
+    tech_size = models.CharField(max_length=50, blank=True)
+    subject = models.CharField(max_length=255, blank=True)
+    brand = models.CharField(max_length=255, blank=True)
+    warehouse_name = models.CharField(max_length=255, blank=True)
+    region_name = models.CharField(max_length=255, blank=True)
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    discount_percent = models.IntegerField(default=0)
+    spp = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    for_pay = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    finished_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    price_with_disc = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    is_return = models.BooleanField(default=False)
+    order_type = models.CharField(max_length=100, blank=True)
+    g_number = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        verbose_name = "Продажа WB"
+        verbose_name_plural = "Продажи WB"
+        ordering = ['-date']
+        unique_together = ['user', 'sale_id']
+        indexes = [
+            models.Index(fields=['user', 'date', 'nm_id'], name='wbsale_user_date_nm_idx'),
+            models.Index(fields=['user', 'srid'], name='wbsale_user_srid_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.sale_id} ({self.nm_id})"
+
+
+class WBSyncCursor(models.Model):
+    """Докуда загружены изменения эндпоинта статистики WB (lastChangeDate) для пользователя"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='wb_sync_cursors')
+    endpoint = models.CharField(max_length=20)  # orders / sales
+    last_change_date = models.DateTimeField(null=True, blank=True)
+    synced_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ['user', 'endpoint']
+
+    def __str__(self):
+        return f"{self.user.username} {self.endpoint}: {self.last_change_date}"
+
+
+class WBRateLimit(models.Model):
+    """Ближайшее разрешенное время запроса к эндпоинту WB для токена (общее для всех процессов)"""
+    key = models.CharField(max_length=100, unique=True)  # <хэш токена>:<эндпоинт>
+    next_at = models.FloatField(default=0)  # Unix-время следующего свободного слота
+    blocked_until = models.FloatField(default=0)  # После 429: до этого времени WB запросы не принимает
+
+    def __str__(self):
+        return self.key
+
+
+class WBCircuit(models.Model):
+    """Состояние предохранителя для эндпоинта WB и токена (общее для всех процессов)"""
+    STATES = (
+        ('closed', 'Работает'),
+        ('open', 'Отключен'),
+        ('half_open', 'Проверка'),
+    )
+
+    key = models.CharField(max_length=100, unique=True)  # <хэш токена>:<эндпоинт>
+    state = models.CharField(max_length=10, choices=STATES, default='closed')
+    failures = models.PositiveIntegerField(default=0)  # Ошибок подряд
+    retry_at = models.FloatField(default=0)  # Unix-время, с которого можно пробовать снова
+    last_error = models.TextField(blank=True)
+    opened_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.key}: {self.state}"
+
+
+class WBRetryTask(models.Model):
+    """Отложенный повтор неудавшейся синхронизации с WB (выполняет process_wb_queue)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='wb_retry_tasks')
+    job = models.CharField(max_length=20, default='sync')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['user', 'job']
+        indexes = [
+            models.Index(fields=['next_attempt_at'], name='wbretry_next_attempt_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} {self.job}: попытка {self.attempts + 1}"
@@ -0,0 +1,740 @@
+# stock/positions.py
+import json
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Min, Max, Count, Sum, Q, F, Value, OuterRef, Subquery, IntegerField, FloatField, Window
+from django.db.models.functions import Cast, Coalesce, RowNumber
+from django.utils import timezone
+
+from .models import (
+    Product, StockMovement, SearchQuery, ProductKeyword, ProductPosition, PositionAlertRule, PositionAlert,
+    PositionDailyStats, normalize_query
+)
+from .wb_cache import get_shared_cache
+from .regions import DEFAULT_REGION
+
+
+def get_positions_version(user_id):
+    """Текущая версия данных позиций пользователя (для ключей кэша)
+
+    Хранится в общем для всех процессов кэше: позиции пишут и воркеры, и
+    check_positions, а читают все воркеры. Начальное значение - время в мс,
+    чтобы после вытеснения счетчика не вернуться к уже использованной версии.
+    """
+    return get_shared_cache().get_or_set(f"positions_version_{user_id}", lambda: int(time.time() * 1000), None)
+
+
+def bump_positions_version(user_id):
+    """Сбрасываем кэши позиций пользователя после записи новых данных"""
+    key = f"positions_version_{user_id}"
+    shared = get_shared_cache()
+    try:
+        shared.incr(key)
+    except ValueError:
+        shared.set(key, int(time.time() * 1000), None)
+
+
+def _movement_sum(movement_type):
+    """Подзапрос суммы движений товара указанного типа"""
+    return Coalesce(
+        Subquery(
+            StockMovement.objects.filter(product=OuterRef('pk'), movement_type=movement_type)
+            .values('product')
+            .annotate(total=Sum('quantity'))
+            .values('total')[:1],
+            output_field=IntegerField()
+        ),
+        Value(0)
+    )
+
+
+def get_top_products(user, limit=6, days=None):
+    """Топ товаров по средней позиции за последние N дней
+
+    Кэшируются только показатели позиций (до следующей записи позиций);
+    название, фото и остаток товара читаются заново одним запросом, чтобы
+    правки товара и движения остатков были видны сразу.
+    """
+    if days is None:
+        days = settings.POSITION_LEADERBOARD_DAYS
+
+    cache_key = f"top_products_{user.id}_{days}_{limit}_v{get_positions_version(user.id)}"
+    position_stats = cache.get(cache_key)
+    if position_stats is None:
+        position_stats = _top_position_stats(user, limit, days)
+        cache.set(cache_key, position_stats, 60 * 60)
+
+    products = (
+        Product.objects.filter(id__in=[stats['id'] for stats in position_stats])
+        .annotate(stock_left=F('initial_quantity') + _movement_sum('in') - _movement_sum('out'))
+        .in_bulk()
+    )
+    return [
+        {
+            **stats,
+            'name': products[stats['id']].name,
+            'article': products[stats['id']].article,
+            'image': products[stats['id']].image,
+            'current_stock': products[stats['id']].stock_left,
+        }
+        for stats in position_stats
+        if stats['id'] in products
+    ]
+
+
+def _top_position_stats(user, limit, days):
+    """Показатели позиций для топа товаров (без полей самого товара)
+
+    Считается по основному региону, чтобы не смешивать разные выдачи;
+    средняя позиция взвешивается числом проверок в каждой серии.
+    """
+    since = timezone.now() - timedelta(days=days)
+    found = Q(
+        keywords__positions__position__gt=0,
+        keywords__positions__last_seen_at__gte=since,
+        keywords__positions__region=DEFAULT_REGION
+    )
+
+    # Один сгруппированный запрос вместо обхода всей истории в Python
+    products = list(
+        Product.objects.filter(user=user)
+        .annotate(
+            position_sum=Sum(
+                F('keywords__positions__position') * F('keywords__positions__checks'), filter=found
+            ),
+            found_checks=Sum('keywords__positions__checks', filter=found),
+            avg_position=Cast('position_sum', FloatField()) / F('found_checks'),
+            best_position=Min('keywords__positions__position', filter=found),
+            worst_position=Max('keywords__positions__position', filter=found),
+            keywords_count=Count('keywords', distinct=True),
+        )
+        .filter(avg_position__isnull=False)
+        .order_by('avg_position')[:limit]
+    )
+
+    # Последние 5 позиций по каждому товару - одним запросом с оконной функцией
+    recent_by_product = {product.id: [] for product in products}
+    if products:
+        recent = (
+            ProductPosition.objects.filter(keyword__product__in=products, region=DEFAULT_REGION)
+            .annotate(
+                product_id=F('keyword__product_id'),
+                row_number=Window(
+                    expression=RowNumber(),
+                    partition_by=[F('keyword__product_id')],
+                    order_by=F('created_at').desc()
+                )
+            )
+            .filter(row_number__lte=5)
+            .select_related('keyword')
+            .order_by('product_id', '-created_at')
+        )
+        for position in recent:
+            recent_by_product[position.product_id].append(position)
+
+    return [{
+        'id': product.id,
+        'avg_position': product.avg_position,
+        'best_position': product.best_position or 0,
+        'worst_position': product.worst_position or 0,
+        'keywords_count': product.keywords_count,
+        'recent_positions': recent_by_product[product.id],
+    } for product in products]
+
+
+
+def get_products_keywords_json(user):
+    """JSON всех товаров пользователя с ключевыми словами и последними позициями
+
+    Один запрос (товары LEFT JOIN ключевые слова, позиции - из денормализованных
+    last_position/last_checked_at); готовая строка кэшируется в общем кэше до
+    следующей записи ключевых слов, позиций или товаров в любом процессе
+    (версия позиций пользователя).
+    """
+    cache_key = f"products_keywords_{user.id}_v{get_positions_version(user.id)}"
+    shared = get_shared_cache()
+    payload = shared.get(cache_key)
+    if payload is not None:
+        return payload
+
+    rows = (
+        Product.objects.filter(user=user)
+        .order_by('name', 'id', 'keywords__keyword')
+        .values_list(
+            'id', 'name', 'article',
+            'keywords__id', 'keywords__keyword', 'keywords__last_position', 'keywords__last_checked_at'
+        )
+    )
+    products = {}
+    for product_id, name, article, keyword_id, text, last_position, last_checked_at in rows:
+        product = products.get(str(product_id))  # Ключ как строка!
+        if product is None:
+            product = products[str(product_id)] = {'id': product_id, 'name': name, 'article': article, 'keywords': []}
+        if keyword_id is not None:
+            product['keywords'].append({
+                'id': keyword_id,
+                'text': text,
+                'current_position': last_position,
+                'last_checked': timezone.localtime(last_checked_at).strftime('%d.%m') if last_checked_at else None
+            })
+
+    payload = json.dumps({'success': True, 'products': products}, ensure_ascii=False)
+    shared.set(cache_key, payload, 60 * 60)
+    return payload
+
+def get_query_subscriptions():
+    """Все отслеживаемые ключевые слова, сгруппированные по общим поисковым запросам
+
+    Возвращает {текст запроса: [(keyword_id, user_id, article), ...]}, чтобы
+    каждый уникальный запрос загружался один раз и результат раздавался
+    всем товарам, которые его отслеживают.
+    """
+    subscriptions = defaultdict(list)
+    rows = ProductKeyword.objects.filter(search_query__isnull=False).values_list(
+        'search_query__text', 'id', 'product__user_id', 'product__article'
+    )
+    for query_text, keyword_id, user_id, article in rows:
+        subscriptions[query_text].append((keyword_id, user_id, article))
+    return dict(subscriptions)
+
+
+def get_latest_positions(keyword_ids):
+    """Последняя позиция по каждому ключевому слову в основном регионе
+
+    Берется из ProductKeyword.last_position, который обновляет record_positions.
+    Возвращает {keyword_id: позиция}; слов без проверок в словаре нет.
+    """
+    return dict(
+        ProductKeyword.objects.filter(id__in=keyword_ids, last_position__isnull=False)
+        .values_list('id', 'last_position')
+    )
+
+
+def get_latest_runs(keyword_ids, regions=None):
+    """Последняя серия позиций по каждой паре (ключевое слово, регион) одним запросом
+
+    Возвращает {(keyword_id, регион): ProductPosition}.
+    """
+    positions = ProductPosition.objects.filter(keyword_id__in=keyword_ids)
+    if regions is not None:
+        positions = positions.filter(region__in=regions)
+    latest = (
+        positions.annotate(row_number=Window(
+            expression=RowNumber(),
+            partition_by=[F('keyword_id'), F('region')],
+            # У строк одной массовой загрузки created_at совпадает - позже записана та, у которой больше id
+            order_by=[F('created_at').desc(), F('id').desc()]
+        ))
+        .filter(row_number=1)
+        .only('id', 'keyword_id', 'region', 'position', 'last_seen_at', 'checks')
+    )
+    return {(run.keyword_id, run.region): run for run in latest}
+
+
+def get_regional_positions(keyword_ids, regions=None):
+    """Последняя позиция по каждому ключевому слову в каждом регионе
+
+    Возвращает {(keyword_id, регион): позиция}; пар без проверок в словаре нет.
+    """
+    return {key: run.position for key, run in get_latest_runs(keyword_ids, regions).items()}
+
+
+def get_alert_rules(user_ids):
+    """Активные правила уведомлений по пользователям
+
+    Пользователям без собственных правил достаются правила по умолчанию
+    из settings.POSITION_ALERT_DEFAULT_RULES.
+    """
+    rules = defaultdict(list)
+    for rule in PositionAlertRule.objects.filter(user_id__in=user_ids, is_active=True):
+        rules[rule.user_id].append(rule)
+    for user_id in user_ids:
+        if user_id not in rules:
+            rules[user_id] = [
+                PositionAlertRule(user_id=user_id, rule_type=rule_type, threshold=threshold)
+                for rule_type, threshold in settings.POSITION_ALERT_DEFAULT_RULES
+            ]
+    return rules
+
+
+def record_positions(entries, checked_at=None):
+    """Записать результаты проверок позиций
+
+    :param entries: список (keyword_id, позиция) или (keyword_id, позиция, регион);
+                    без региона - основной регион
+    :param checked_at: время проверки, если это не "сейчас" (загрузка задним числом)
+
+    Позиции хранятся сериями: если значение не изменилось с прошлой проверки,
+    продлевается последняя строка (last_seen_at, checks), иначе открывается
+    новая (settings.POSITION_RUN_LENGTH = False - строка на каждую проверку).
+    Предыдущая позиция берется из последней серии, правила уведомлений
+    проверяются при смене позиции; все изменения пишутся пакетами в одной
+    транзакции.
+    """
+    entries = [(entry[0], entry[1], entry[2] if len(entry) > 2 else DEFAULT_REGION) for entry in entries]
+    if not entries:
+        return []
+
+    moment = checked_at or timezone.now()
+    compact = settings.POSITION_RUN_LENGTH
+
+    with transaction.atomic():
+        keywords = {
+            keyword_id: [user_id, last_position, last_checked_at]
+            for keyword_id, user_id, last_position, last_checked_at in ProductKeyword.objects.filter(
+                id__in={keyword_id for keyword_id, _, _ in entries}
+            ).values_list('id', 'product__user_id', 'last_position', 'last_checked_at')
+        }
+        runs = get_latest_runs(keywords, {region for _, _, region in entries})
+        user_ids = {user_id for user_id, _, _ in keywords.values()}
+        rules = get_alert_rules(user_ids)
+
+        created, extended, alerts, touched = [], {}, [], set()
+        for keyword_id, position, region in entries:
+            if keyword_id not in keywords:
+                continue  # Ключевое слово удалили, пока шла проверка
+            user_id = keywords[keyword_id][0]
+            run = runs.get((keyword_id, region))
+
+            if run is not None and moment < run.last_seen_at:
+                # Проверка задним числом - отдельная серия без сравнения с текущей позицией
+                created.append(ProductPosition(
+                    keyword_id=keyword_id, position=position, region=region, last_seen_at=moment
+                ))
+                continue
+
+            if compact and run is not None and run.position == position:
+                run.last_seen_at = moment
+                run.checks += 1
+                if run.pk:
+                    extended[run.pk] = run
+            else:
+                previous = run.position if run is not None else None
+                run = runs[keyword_id, region] = ProductPosition(
+                    keyword_id=keyword_id,
+                    position=position,
+                    region=region,
+                    previous_position=previous,
+                    last_seen_at=moment
+                )
+                created.append(run)
+
+                for rule in rules[user_id]:
+                    if rule.matches(previous, position):
+                        alerts.append(PositionAlert(
+                            user_id=user_id,
+                            keyword_id=keyword_id,
+                            region=region,
+                            rule_type=rule.rule_type,
+                            threshold=rule.threshold,
+                            previous_position=previous,
+                            position=position
+                        ))
+
+            if region == DEFAULT_REGION:
+                keywords[keyword_id][1:] = [position, moment]
+                touched.add(keyword_id)
+
+        ProductPosition.objects.bulk_create(created, batch_size=500)
+        # created_at заполняется автоматически текущим временем - переносим на время проверки
+        if checked_at:
+            ProductPosition.objects.filter(pk__in=[position.pk for position in created]).update(created_at=checked_at)
+        ProductPosition.objects.bulk_update(extended.values(), ['last_seen_at', 'checks'], batch_size=500)
+
+        ProductKeyword.objects.bulk_update(
+            [
+                ProductKeyword(id=keyword_id, last_position=keywords[keyword_id][1], last_checked_at=keywords[keyword_id][2])
+                for keyword_id in touched
+            ],
+            ['last_position', 'last_checked_at'],
+            batch_size=500
+        )
+        PositionAlert.objects.bulk_create(alerts, batch_size=500)
+
+    for user_id in user_ids:
+        bump_positions_version(user_id)
+
+    return created
+
+
+def parse_bulk_line(line):
+    """Разбор строки 'Артикул:Ключевое слово:Позиция' (или через табуляцию из Excel)
+
+    Возвращает (артикул, ключевое слово, позиция); при ошибке - ValueError.
+    """
+    if '\t' in line:
+        parts = [part.strip() for part in line.split('\t')]
+        if len(parts) != 3:
+            raise ValueError('ожидается 3 столбца')
+        article, keyword, position = parts
+    else:
+        article, sep, rest = line.partition(':')
+        keyword, sep2, position = rest.rpartition(':')
+        if not sep or not sep2:
+            raise ValueError('ожидается формат Артикул:Ключевое слово:Позиция')
+        article, keyword, position = article.strip(), keyword.strip(), position.strip()
+
+    if not article or not keyword:
+        raise ValueError('пустой артикул или ключевое слово')
+    try:
+        position = int(position)
+    except ValueError:
+        raise ValueError(f'позиция "{position}" не число')
+    if not 0 <= position <= 1000:
+        raise ValueError('позиция должна быть от 0 до 1000')
+    return article, ' '.join(keyword.split()), position
+
+
+def import_positions_bulk(user, text, check_date=None):
+    """Массовая загрузка позиций из текста
+
+    Артикулы и ключевые слова разрешаются двумя IN-запросами, недостающие
+    ключевые слова создаются одним bulk_create, позиции пишутся одной
+    транзакцией. Возвращает словарь со счетчиками и списком ошибок
+    [(номер строки, строка, причина)].
+    """
+    errors = []
+    rows = []
+    for line_number, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            rows.append((line_number, line) + parse_bulk_line(line))
+        except ValueError as e:
+            errors.append((line_number, line, str(e)))
+
+    products = {
+        product.article: product
+        for product in Product.objects.filter(user=user, article__in={row[2] for row in rows})
+    }
+
+    valid_rows = []
+    for line_number, line, article, keyword, position in rows:
+        if article in products:
+            valid_rows.append((line_number, line, products[article], keyword, position))
+        else:
+            errors.append((line_number, line, f'товар с артикулом {article} не найден'))
+
+    def load_keywords():
+        # Сопоставляем по нормализованному запросу, чтобы "Чехол" и "чехол" были одним словом
+        return {
+            (kw.product_id, kw.search_query.text): kw
+            for kw in ProductKeyword.objects.select_related('search_query').filter(
+                product__in={row[2] for row in valid_rows},
+                search_query__text__in={normalize_query(row[3]) for row in valid_rows}
+            )
+        }
+
+    with transaction.atomic():
+        keywords = load_keywords()
+        missing = {}
+        for _, _, product, keyword, _ in valid_rows:
+            key = (product.id, normalize_query(keyword))
+            if key not in keywords:
+                missing.setdefault(key, keyword)
+
+        created_keywords = 0
+        if missing:
+            # bulk_create не вызывает save(), поэтому запросы привязываем сами
+            queries = SearchQuery.resolve(missing.values())
+            # Слово уже есть, но привязано к другому запросу (или ни к какому) - перепривязываем,
+            # иначе bulk_create молча пропустит его из-за unique (product, keyword)
+            stale = [
+                keyword for keyword in ProductKeyword.objects.filter(product_id__in={product_id for product_id, _ in missing})
+                if (keyword.product_id, normalize_query(keyword.keyword)) in missing
+            ]
+            for keyword in stale:
+                keyword.search_query = queries[normalize_query(keyword.keyword)]
+            ProductKeyword.objects.bulk_update(stale, ['search_query'], batch_size=500)
+            known_ids = {keyword.id for keyword in keywords.values()} | {keyword.id for keyword in stale}
+            stale_keys = {(keyword.product_id, normalize_query(keyword.keyword)) for keyword in stale}
+
+            ProductKeyword.objects.bulk_create([
+                ProductKeyword(product_id=product_id, keyword=keyword, search_query=queries[normalized])
+                for (product_id, normalized), keyword in missing.items()
+                if (product_id, normalized) not in stale_keys
+            ], ignore_conflicts=True)
+            keywords = load_keywords()
+            # Считаем реально вставленные строки: конфликтующие bulk_create пропускает
+            created_keywords = len({keyword.id for keyword in keywords.values()} - known_ids)
+
+        entries = []
+        for line_number, line, product, keyword, position in valid_rows:
+            matched = keywords.get((product.id, normalize_query(keyword)))
+            if matched is None:
+                errors.append((line_number, line, 'не удалось сохранить ключевое слово'))
+                continue
+            entries.append((matched.id, position))
+
+        checked_at = None
+        if check_date and check_date != timezone.localdate():
+            checked_at = timezone.make_aware(datetime.combine(check_date, timezone.localtime().time()))
+        record_positions(entries, checked_at=checked_at)
+
+    return {
+        'created_positions': len(entries),
+        'created_keywords': created_keywords,
+        'errors': sorted(errors),
+    }
+
+
+HISTORY_BUCKETS = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+}
+
+
+def _bucket_starts(start, end, bucket, limit):
+    """Начала последних limit интервалов периода [start, end) в местном времени
+
+    Возвращает (начала по возрастанию, есть ли в периоде более ранние интервалы).
+    """
+    last = timezone.localtime(end - timedelta(microseconds=1)).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+    if bucket != 'hour':
+        last = last.replace(hour=0)
+    if bucket == 'week':
+        last -= timedelta(days=last.weekday())
+    first = timezone.localtime(start).replace(tzinfo=None)
+    starts = [last]
+    while len(starts) <= limit and starts[-1] > first:
+        starts.append(starts[-1] - HISTORY_BUCKETS[bucket])
+    truncated = len(starts) > limit
+    return [timezone.make_aware(moment) for moment in reversed(starts[:limit])], truncated
+
+
+def _expand_runs(runs, edges):
+    """Разложить серии по интервалам с границами edges (секунды, по возрастанию)
+
+    Каждая серия покрывает все интервалы между своей первой и последней
+    проверкой; ее проверки делятся между ними пропорционально времени
+    (серия из одной проверки целиком попадает в свой интервал). Возвращает
+    (индекс интервала, позиция, проверок в интервале) для каждой пары.
+    """
+    if not runs:
+        return np.zeros(0, dtype=np.intp), np.zeros(0), np.zeros(0)
+    first_seen = np.array([run[0].timestamp() for run in runs])
+    last_seen = np.array([run[1].timestamp() for run in runs])
+    positions = np.array([run[2] for run in runs], dtype=float)
+    checks = np.array([run[3] for run in runs], dtype=float)
+
+    last_index = len(edges) - 2
+    first = np.clip(np.searchsorted(edges, first_seen, side='right') - 1, 0, last_index)
+    last = np.clip(np.searchsorted(edges, last_seen, side='right') - 1, 0, last_index)
+    lengths = last - first + 1
+    run_index = np.repeat(np.arange(len(runs)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    buckets = first[run_index] + offsets
+
+    duration = (last_seen - first_seen)[run_index]
+    overlap = (
+        np.minimum(last_seen[run_index], edges[buckets + 1]) - np.maximum(first_seen[run_index], edges[buckets])
+    )
+    share = np.where(duration > 0, np.clip(overlap, 0, None) / np.where(duration > 0, duration, 1), 1.0)
+    return buckets, positions[run_index], checks[run_index] * share
+
+
+def _day_start(day):
+    """Начало дня в местном времени"""
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+
+def _period_range(start, end):
+    """Границы периода [start, end) по датам"""
+    return _day_start(start), _day_start(end + timedelta(days=1))
+
+
+def get_keyword_history(keyword, date_from, date_to, bucket='raw', max_points=None, region=DEFAULT_REGION):
+    """История позиций ключевого слова за период
+
+    Позиции хранятся сериями (created_at - last_seen_at), а старые - свернутыми
+    по дням (PositionDailyStats), поэтому читаются только серии и дни,
+    пересекающие период: bucket='raw' - точки начала и конца каждой серии
+    (для свернутых дней - средняя за день), 'hour'/'day'/'week' - min/max и
+    средняя с весом числа проверок по найденным позициям; серия попадает во
+    все интервалы, которые покрывает (0 = в интервале не найден; checks -
+    сколько проверок пришлось на интервал).
+    Возвращается не больше max_points последних точек в хронологическом
+    порядке. История берется по одному региону.
+    """
+    if max_points is None:
+        max_points = settings.POSITION_HISTORY_MAX_POINTS
+
+    # Диапазон по самим полям (а не по __date), чтобы работал индекс (keyword, region, created_at)
+    start, end = _period_range(date_from, date_to)
+    runs = keyword.positions.filter(region=region, created_at__lt=end, last_seen_at__gte=start)
+    archived = keyword.daily_positions.filter(region=region, date__gte=date_from, date__lte=date_to)
+
+    if bucket == 'raw':
+        rows = list(runs.order_by('-created_at').values_list('created_at', 'last_seen_at', 'position')[:max_points + 1])
+        days = list(archived.order_by('-date').values_list('date', 'avg_position')[:max_points + 1])
+        truncated = len(rows) > max_points or len(days) > max_points
+        points = [(_day_start(day), round(avg_position) if avg_position else 0) for day, avg_position in days]
+        for first_seen, last_seen, position in rows[:max_points]:
+            points.append((max(first_seen, start), position))
+            if last_seen > first_seen:
+                points.append((min(last_seen, end), position))
+        points.sort(key=lambda point: point[0])
+        truncated = truncated or len(points) > max_points
+        points = points[-max_points:]
+        return {
+            'dates': [timezone.localtime(moment).strftime('%Y-%m-%d %H:%M') for moment, _ in points],
+            'positions': [position for _, position in points],
+            'truncated': truncated,
+        }
+
+    # Серии разворачиваются по всем интервалам, которые покрывают (векторно),
+    # свернутые дни попадают в интервал своего начала
+    starts, truncated = _bucket_starts(start, end, bucket, max_points)
+    edges = np.array([moment.timestamp() for moment in starts] + [end.timestamp()])
+    rows = list(
+        runs.filter(last_seen_at__gte=starts[0])
+        .values_list('created_at', 'last_seen_at', 'position', 'checks')
+    )
+    buckets, positions, weights = _expand_runs(rows, edges)
+    days = list(
+        archived.filter(date__gte=timezone.localdate(starts[0]))
+        .values_list('date', 'min_position', 'avg_position', 'max_position', 'found_checks', 'checks')
+    )
+    if days:
+        day_buckets = np.searchsorted(edges, [_day_start(day[0]).timestamp() for day in days], side='right') - 1
+        day_values = np.array([day[1:] for day in days], dtype=float)  # None -> nan
+    else:
+        day_buckets, day_values = np.zeros(0, dtype=np.intp), np.zeros((0, 5))
+
+    size = len(starts)
+    found = positions > 0
+    day_found = ~np.isnan(day_values[:, 0])
+    checks = (np.bincount(buckets, weights, minlength=size)
+              + np.bincount(day_buckets, day_values[:, 4], minlength=size))
+    found_checks = (np.bincount(buckets[found], weights[found], minlength=size)
+                    + np.bincount(day_buckets[day_found], day_values[day_found, 3], minlength=size))
+    position_sum = (np.bincount(buckets[found], (positions * weights)[found], minlength=size)
+                    + np.bincount(day_buckets[day_found], (day_values[:, 1] * day_values[:, 3])[day_found],
+                                  minlength=size))
+    # Серия, чья проверка пришлась ровно на границу интервала, получает в нем нулевую долю
+    # проверок - для такого интервала позиция берется средней по найденным сериям без весов
+    found_runs = np.bincount(buckets[found], minlength=size)
+    plain_sum = np.bincount(buckets[found], positions[found], minlength=size)
+    low = np.full(size, np.inf)
+    high = np.zeros(size)
+    np.minimum.at(low, buckets[found], positions[found])
+    np.minimum.at(low, day_buckets[day_found], day_values[day_found, 0])
+    np.maximum.at(high, buckets[found], positions[found])
+    np.maximum.at(high, day_buckets[day_found], day_values[day_found, 2])
+    present = np.bincount(buckets, minlength=size) + np.bincount(day_buckets, minlength=size) > 0
+
+    periods = np.flatnonzero(present)
+    date_format = '%Y-%m-%d %H:00' if bucket == 'hour' else '%Y-%m-%d'
+    return {
+        'dates': [timezone.localtime(starts[index]).strftime(date_format) for index in periods],
+        'positions': [
+            round(float(position_sum[index] / found_checks[index]), 1) if found_checks[index]
+            else round(float(plain_sum[index] / found_runs[index]), 1) if found_runs[index] else 0
+            for index in periods
+        ],
+        'min_positions': [int(low[index]) if np.isfinite(low[index]) else 0 for index in periods],
+        'max_positions': [int(high[index]) for index in periods],
+        'checks': [round(float(checks[index]), 2) for index in periods],
+        'truncated': truncated,
+    }
+
+
+def _best_by_day(runs, archived, key, date_from, days):
+    """Лучшая найденная позиция за каждый день периода по ключу key - одним запросом
+
+    Серии разворачиваются по дням в самом запросе: колонка дня - MIN по
+    сериям, которые этот день покрывают; свернутые дни дают свою
+    min_position. Обе части объединяются через UNION ALL, так что на ключ
+    приходится до двух строк (ключ, день 0, ..., день N-1), None - не найден.
+    """
+    names = [f'day_{offset}' for offset in range(days)]
+    run_days, archived_days = {}, {}
+    for offset, name in enumerate(names):
+        day = date_from + timedelta(days=offset)
+        day_start, day_end = _period_range(day, day)
+        run_days[name] = Min('position', filter=Q(created_at__lt=day_end, last_seen_at__gte=day_start))
+        archived_days[name] = Min('min_position', filter=Q(date=day))
+
+    start, end = _period_range(date_from, date_from + timedelta(days=days - 1))
+    return list(
+        runs.filter(position__gt=0, created_at__lt=end, last_seen_at__gte=start)
+        .order_by().values(key).annotate(**run_days).values_list(key, *names)
+        .union(
+            archived.filter(min_position__isnull=False, date__gte=date_from, date__lt=date_from + timedelta(days=days))
+            .order_by().values(key).annotate(**archived_days).values_list(key, *names),
+            all=True
+        )
+    )
+
+
+def _scatter_best(rows, row_index, days):
+    """Строки _best_by_day -> плотный массив int16 (0 = не найден)
+
+    Строки раскладываются векторно по индексам ключей, две строки одного
+    ключа (серии и архив) объединяются по минимуму.
+    """
+    matrix = np.full((len(row_index), days), np.nan)
+    if rows:
+        cells = np.array(rows, dtype=object)
+        keys = np.fromiter((row_index[key] for key in cells[:, 0]), dtype=np.intp, count=len(cells))
+        np.fmin.at(matrix, keys, cells[:, 1:].astype(float))
+    return np.nan_to_num(matrix).astype(np.int16)
+
+
+def get_keyword_regions(keyword, date_from, date_to):
+    """Сравнение ключевого слова по регионам: лучшая позиция за день в каждом регионе
+
+    Возвращает общие даты и ряд позиций на каждый регион, где ключевое слово
+    находилось за период (0 = не найден или не проверялся).
+    """
+    days = (date_to - date_from).days + 1
+    rows = _best_by_day(keyword.positions.all(), keyword.daily_positions.all(), 'region', date_from, days)
+    regions = sorted({row[0] for row in rows}, key=lambda region: (region != DEFAULT_REGION, region))
+    matrix = _scatter_best(rows, {region: index for index, region in enumerate(regions)}, days)
+
+    return {
+        'dates': [(date_from + timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(days)],
+        'regions': {region: matrix[index].tolist() for index, region in enumerate(regions)},
+    }
+
+
+def get_position_heatmap(user, days=30, product_id=None, region=DEFAULT_REGION):
+    """Матрица "ключевые слова × дни" с лучшей позицией за день
+
+    Лучшие позиции по дням (с разворотом серий и свернутыми днями) считаются
+    одним запросом и раскладываются в плотный массив int16 (0 = в этот день
+    не найден).
+    """
+    date_to = timezone.localdate()
+    date_from = date_to - timedelta(days=days - 1)
+
+    keywords = ProductKeyword.objects.filter(product__user=user)
+    if product_id:
+        keywords = keywords.filter(product_id=product_id)
+    keywords = list(keywords.order_by('product__name', 'keyword').values_list('id', 'keyword', 'product__name'))
+
+    positions = ProductPosition.objects.filter(keyword__product__user=user, region=region)
+    archived = PositionDailyStats.objects.filter(keyword__product__user=user, region=region)
+    if product_id:
+        positions = positions.filter(keyword__product_id=product_id)
+        archived = archived.filter(keyword__product_id=product_id)
+    row_index = {keyword_id: row for row, (keyword_id, _, _) in enumerate(keywords)}
+    # Ключевые слова, добавленные после чтения списка, в матрицу не попадают
+    rows = [row for row in _best_by_day(positions, archived, 'keyword_id', date_from, days) if row[0] in row_index]
+    matrix = _scatter_best(rows, row_index, days)
+
+    return {
+        'keywords': [
+            {'id': keyword_id, 'text': text, 'product': product_name}
+            for keyword_id, text, product_name in keywords
+        ],
+        'dates': [(date_from + timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(days)],
+        'matrix': matrix.tolist(),
+    }
@@ -0,0 +1,15 @@
+# stock/regions.py
+# Регионы поисковой выдачи WB. Модуль без зависимостей: его импортируют
+# и модели Django, и клиент поиска, и отдельные скрипты-парсеры.
+
+# Регионы выдачи: название -> параметр dest поиска WB
+REGIONS = {
+    'Москва': -1257786,
+    'Санкт-Петербург': -1198055,
+    'Казань': -2133462,
+    'Екатеринбург': -5817698,
+    'Новосибирск': -364763,
+    'Краснодар': 12358062,
+}
+DEFAULT_REGION = 'Москва'
+DEFAULT_DEST = REGIONS[DEFAULT_REGION]
@@ -0,0 +1,180 @@
+# stock/retention.py
+# Свертка старой истории: серии позиций -> агрегаты по дням,
+# дневная статистика рекламы -> агрегаты по месяцам.
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import (
+    ProductKeyword, ProductPosition, PositionDailyStats, AdvertisingCampaign, CampaignDailyStats,
+    CampaignMonthlyStats, RetentionCursor
+)
+from .positions import get_latest_runs
+
+DELETE_BATCH = 500  # Сколько id удалять одним запросом (лимит параметров SQLite)
+
+CAMPAIGN_FIELDS = ['views', 'clicks', 'cart_adds', 'orders', 'spent']
+
+
+def _delete_ids(model, ids):
+    """Удаление пачками, чтобы не держать длинный DELETE"""
+    for start in range(0, len(ids), DELETE_BATCH):
+        model.objects.filter(id__in=ids[start:start + DELETE_BATCH]).delete()
+
+
+def _run_chunks(job, queryset, chunk_size, process):
+    """Обойти объекты порциями по id, продолжая с сохраненного курсора
+
+    Каждая порция обрабатывается в своей транзакции вместе с продвижением
+    курсора, поэтому прерванный запуск продолжается с места остановки.
+    После каждой порции выдается результат process(ids); когда проход
+    завершен, курсор сбрасывается.
+    """
+    cursor, _ = RetentionCursor.objects.get_or_create(job=job)
+    while True:
+        ids = list(
+            queryset.filter(id__gt=cursor.last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            cursor.last_id = 0
+            cursor.save()
+            return
+        with transaction.atomic():
+            result = process(ids)
+            cursor.last_id = ids[-1]
+            cursor.save()
+        yield result
+
+
+def _rollup_keywords(keyword_ids, cutoff):
+    """Свернуть закончившиеся до cutoff серии позиций ключевых слов в дни"""
+    # Последняя серия каждой пары остается: от нее продолжаются новые проверки
+    keep = [run.pk for run in get_latest_runs(keyword_ids).values()]
+    runs = list(
+        ProductPosition.objects.filter(keyword_id__in=keyword_ids, last_seen_at__lt=cutoff)
+        .exclude(pk__in=keep)
+        .values_list('id', 'keyword_id', 'region', 'created_at', 'last_seen_at', 'position', 'checks')
+    )
+    if not runs:
+        return 0, 0
+
+    days = {}
+    for _, keyword_id, region, first_seen, last_seen, position, checks in runs:
+        first_day = timezone.localdate(first_seen)
+        span = (timezone.localdate(last_seen) - first_day).days + 1
+        # Проверки серии делим между ее днями поровну (каждому дню - хотя бы одна)
+        share, extra = divmod(checks, span)
+        for offset in range(span):
+            day_checks = max(share + (offset < extra), 1)
+            key = (keyword_id, region, first_day + timedelta(days=offset))
+            row = days.setdefault(key, [None, 0, 0, None, 0])  # min, сумма позиций, найдено проверок, max, проверок
+            row[4] += day_checks
+            if position > 0:
+                row[0] = position if row[0] is None else min(row[0], position)
+                row[1] += position * day_checks
+                row[2] += day_checks
+                row[3] = position if row[3] is None else max(row[3], position)
+
+    existing = {
+        (stats.keyword_id, stats.region, stats.date): stats
+        for stats in PositionDailyStats.objects.filter(
+            keyword_id__in=keyword_ids,
+            date__gte=min(day for _, _, day in days),
+            date__lte=max(day for _, _, day in days)
+        )
+    }
+    to_create, to_update = [], []
+    for key, (low, total, found, high, count) in days.items():
+        stats = existing.get(key)
+        if stats is None:
+            to_create.append(PositionDailyStats(
+                keyword_id=key[0], region=key[1], date=key[2],
+                min_position=low, avg_position=total / found if found else None, max_position=high,
+                checks=count, found_checks=found
+            ))
+            continue
+        # День уже сворачивался (серия тянулась через границу) - объединяем
+        # Средняя взвешивается только найденными проверками, не всеми
+        if found:
+            stats.avg_position = (
+                ((stats.avg_position or 0) * stats.found_checks + total) / (stats.found_checks + found)
+            )
+            stats.min_position = low if stats.min_position is None else min(stats.min_position, low)
+            stats.max_position = high if stats.max_position is None else max(stats.max_position, high)
+        stats.checks += count
+        stats.found_checks += found
+        to_update.append(stats)
+
+    PositionDailyStats.objects.bulk_create(to_create, batch_size=500)
+    PositionDailyStats.objects.bulk_update(
+        to_update, ['min_position', 'avg_position', 'max_position', 'checks', 'found_checks'], batch_size=500
+    )
+    _delete_ids(ProductPosition, [run[0] for run in runs])
+    return len(runs), len(days)
+
+
+def rollup_positions(cutoff, chunk_size=50):
+    """Свернуть серии позиций, закончившиеся до cutoff, в PositionDailyStats
+
+    Генератор: ключевые слова обрабатываются порциями по chunk_size, после
+    каждой порции выдается (свернуто серий, записано дней).
+    """
+    return _run_chunks(
+        'positions',
+        ProductKeyword.objects.all(),
+        chunk_size,
+        lambda keyword_ids: _rollup_keywords(keyword_ids, cutoff)
+    )
+
+
+def _rollup_campaigns(campaign_ids, before):
+    """Свернуть дневную статистику кампаний до даты before в месяцы"""
+    daily = CampaignDailyStats.objects.filter(campaign_id__in=campaign_ids, date__lt=before)
+    months = list(
+        daily.annotate(month=TruncMonth('date'))
+        .values('campaign_id', 'month')
+        .annotate(days=Count('id'), **{field: Sum(field) for field in CAMPAIGN_FIELDS})
+    )
+    if not months:
+        return 0, 0
+
+    existing = {
+        (stats.campaign_id, stats.month): stats
+        for stats in CampaignMonthlyStats.objects.filter(campaign_id__in=campaign_ids, month__lt=before)
+    }
+    to_create, to_update = [], []
+    for row in months:
+        stats = existing.get((row['campaign_id'], row['month']))
+        if stats is None:
+            to_create.append(CampaignMonthlyStats(
+                campaign_id=row['campaign_id'], month=row['month'], days=row['days'],
+                **{field: row[field] for field in CAMPAIGN_FIELDS}
+            ))
+            continue
+        stats.days += row['days']
+        for field in CAMPAIGN_FIELDS:
+            setattr(stats, field, getattr(stats, field) + row[field])
+        to_update.append(stats)
+
+    CampaignMonthlyStats.objects.bulk_create(to_create, batch_size=500)
+    CampaignMonthlyStats.objects.bulk_update(to_update, ['days'] + CAMPAIGN_FIELDS, batch_size=500)
+    daily_ids = list(daily.values_list('id', flat=True))
+    _delete_ids(CampaignDailyStats, daily_ids)
+    return len(daily_ids), len(months)
+
+
+def rollup_campaign_stats(before, chunk_size=50):
+    """Свернуть дневную статистику кампаний до даты before (первое число месяца) в CampaignMonthlyStats
+
+    Генератор: кампании обрабатываются порциями по chunk_size, после каждой
+    порции выдается (свернуто дней, записано месяцев).
+    """
+    return _run_chunks(
+        'campaigns',
+        AdvertisingCampaign.objects.all(),
+        chunk_size,
+        lambda campaign_ids: _rollup_campaigns(campaign_ids, before)
+    )
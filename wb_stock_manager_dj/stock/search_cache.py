@@ -0,0 +1,115 @@
+# stock/search_cache.py
+# Кэш страниц поисковой выдачи WB: память (LRU) + необязательный файл SQLite.
+# Модуль не зависит от Django (только стандартная библиотека).
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# Компактная запись о товаре вместо полного JSON выдачи.
+# organic_position (log.position) добавлен последним со значением по умолчанию,
+# чтобы записи, сохраненные в файл кэша раньше, читались без ошибок.
+SearchItem = namedtuple(
+    'SearchItem',
+    ['id', 'supplier_id', 'brand', 'promo_position', 'price', 'supplier', 'name', 'subject', 'organic_position'],
+    defaults=[None]
+)
+
+
+def normalize_query(text):
+    """Нормализация поискового запроса: регистр и лишние пробелы"""
+    return ' '.join((text or '').split()).casefold()
+
+
+def compact_product(product):
+    """Свернуть товар из ответа поиска в SearchItem"""
+    log_data = product.get('log') or {}
+    price = product.get('salePriceU')
+    return SearchItem(
+        id=product.get('id'),
+        supplier_id=product.get('supplierId'),
+        brand=product.get('brand', ''),
+        promo_position=log_data.get('promoPosition'),
+        price=price // 100 if price else None,
+        supplier=product.get('supplier', ''),
+        name=product.get('name', ''),
+        subject=product.get('subjectName', product.get('entity', '')),
+        organic_position=log_data.get('position'),
+    )
+
+
+class SearchPageCache:
+    """Кэш страниц выдачи по ключу (запрос, страница, регион, сортировка)
+
+    :param ttl: время жизни страницы в секундах
+    :param max_pages: сколько страниц держать в памяти (LRU)
+    :param path: файл SQLite для второго уровня кэша (общий между процессами)
+    """
+
+    def __init__(self, ttl=1800, max_pages=2000, path=None):
+        self.ttl = ttl
+        self.max_pages = max_pages
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(str(path), timeout=10, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS search_pages '
+                '(key TEXT PRIMARY KEY, expires REAL NOT NULL, items TEXT NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS search_pages_expires ON search_pages (expires)')
+            self._db.commit()
+
+    @staticmethod
+    def make_key(query, page, dest, sort):
+        return f"{normalize_query(query)}|{page}|{dest}|{sort}"
+
+    def get(self, query, page, dest, sort):
+        """Страница из кэша или None"""
+        key = self.make_key(query, page, dest, sort)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires, items = entry
+                if expires > now:
+                    self._memory.move_to_end(key)
+                    return items
+                del self._memory[key]
+
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                'SELECT expires, items FROM search_pages WHERE key = ?', (key,)
+            ).fetchone()
+
+        if row is None or row[0] <= now:
+            return None
+        items = [SearchItem(*values) for values in json.loads(row[1])]
+        self._remember(key, row[0], items)
+        return items
+
+    def set(self, query, page, dest, sort, items):
+        """Сохранить страницу в кэш"""
+        key = self.make_key(query, page, dest, sort)
+        expires = time.time() + self.ttl
+        self._remember(key, expires, items)
+
+        if self._db is not None:
+            with self._lock:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO search_pages (key, expires, items) VALUES (?, ?, ?)',
+                    (key, expires, json.dumps([list(item) for item in items], ensure_ascii=False))
+                )
+                self._db.execute('DELETE FROM search_pages WHERE expires <= ?', (time.time(),))
+                self._db.commit()
+
+    def _remember(self, key, expires, items):
+        with self._lock:
+            self._memory[key] = (expires, items)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_pages:
+                self._memory.popitem(last=False)
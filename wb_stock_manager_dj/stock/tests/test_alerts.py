@@ -0,0 +1,69 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from stock.models import Product, ProductKeyword, PositionAlert, PositionAlertRule
+from stock.positions import record_positions
+
+
+class AlertRuleMatchTests(SimpleTestCase):
+    """Условия правил уведомлений"""
+
+    def check(self, rule_type, threshold, cases):
+        rule = PositionAlertRule(rule_type=rule_type, threshold=threshold)
+        for previous, position, expected in cases:
+            with self.subTest(rule=rule_type, previous=previous, position=position):
+                self.assertEqual(rule.matches(previous, position), expected)
+
+    def test_rules(self):
+        self.check('left_top', 10, [(5, 11, True), (5, 0, True), (5, 10, False), (0, 20, False), (None, 20, False)])
+        self.check('entered_top', 10, [(20, 10, True), (0, 3, True), (5, 3, False), (20, 0, False)])
+        self.check('drop', 30, [(10, 40, True), (10, 39, False), (0, 40, False), (10, 0, False)])
+        self.check('lost', 1, [(10, 0, True), (0, 0, False), (10, 11, False)])
+
+
+class PositionAlertTests(TestCase):
+    """Уведомления создаются при записи позиций (record_positions)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('seller', password='secret')
+        product = Product.objects.create(user=self.user, name='Чехол', article='101')
+        self.keyword = ProductKeyword.objects.create(product=product, keyword='чехол')
+
+    def alerts(self):
+        return list(PositionAlert.objects.order_by('id').values_list('rule_type', 'previous_position', 'position', 'region'))
+
+    def test_default_rules_fire_on_change(self):
+        record_positions([(self.keyword.id, 5)])
+        record_positions([(self.keyword.id, 5)])  # Серия продлена - правила не проверяются
+        record_positions([(self.keyword.id, 50)])
+
+        self.assertEqual(self.alerts(), [('left_top', 5, 50, 'Москва'), ('drop', 5, 50, 'Москва')])
+
+    def test_first_check_does_not_alert(self):
+        record_positions([(self.keyword.id, 0)])
+
+        self.assertEqual(self.alerts(), [])
+
+    def test_user_rules_replace_defaults(self):
+        PositionAlertRule.objects.create(user=self.user, rule_type='lost', threshold=1)
+        PositionAlertRule.objects.create(user=self.user, rule_type='left_top', threshold=3, is_active=False)
+
+        record_positions([(self.keyword.id, 2)])
+        record_positions([(self.keyword.id, 0)])
+
+        self.assertEqual(self.alerts(), [('lost', 2, 0, 'Москва')])
+
+    def test_previous_position_is_per_region(self):
+        record_positions([(self.keyword.id, 5), (self.keyword.id, 50, 'Казань')])
+        record_positions([(self.keyword.id, 6), (self.keyword.id, 60, 'Казань')])
+
+        self.assertEqual(self.alerts(), [])
+
+    def test_backdated_checks_do_not_alert(self):
+        record_positions([(self.keyword.id, 5)])
+        record_positions([(self.keyword.id, 90)], checked_at=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(self.alerts(), [])
@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from stock.models import Product, ProductKeyword, ProductPosition
+from stock.positions import import_positions_bulk, parse_bulk_line
+
+
+class ParseBulkLineTests(SimpleTestCase):
+    """Разбор строки массовой загрузки"""
+
+    def test_colon_and_tab_formats(self):
+        self.assertEqual(parse_bulk_line('101: чехол  на  айфон :15'), ('101', 'чехол на айфон', 15))
+        self.assertEqual(parse_bulk_line('101\tчехол\t0'), ('101', 'чехол', 0))
+
+    def test_keyword_may_contain_colons(self):
+        self.assertEqual(parse_bulk_line('101:чехол 2:1:7'), ('101', 'чехол 2:1', 7))
+
+    def test_invalid_lines(self):
+        for line in ['101 чехол 15', '101:чехол:abc', '101:чехол:1001', ':чехол:1', '101\tчехол']:
+            with self.subTest(line=line), self.assertRaises(ValueError):
+                parse_bulk_line(line)
+
+
+class ImportPositionsBulkTests(TestCase):
+    """Массовая загрузка позиций"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('seller', password='secret')
+        self.product = Product.objects.create(user=self.user, name='Чехол', article='101')
+        self.keyword = ProductKeyword.objects.create(product=self.product, keyword='Чехол')
+
+    def test_existing_keywords_are_matched_by_normalized_query(self):
+        result = import_positions_bulk(self.user, '101:чехол:12\n101:  ЧЕХОЛ :14\n')
+
+        self.assertEqual(result, {'created_positions': 2, 'created_keywords': 0, 'errors': []})
+        self.assertEqual(self.product.keywords.count(), 1)
+        self.keyword.refresh_from_db()
+        self.assertEqual(self.keyword.last_position, 14)
+
+    def test_missing_keywords_are_created_once(self):
+        result = import_positions_bulk(self.user, '101:новое слово:3\n101:Новое слово:4\n')
+
+        self.assertEqual(result['created_keywords'], 1)
+        created = self.product.keywords.get(search_query__text='новое слово')
+        self.assertEqual(list(created.positions.values_list('position', flat=True)), [4, 3])
+
+    def test_errors_keep_line_numbers_and_valid_rows_are_saved(self):
+        other = User.objects.create_user('other', password='secret')
+        Product.objects.create(user=other, name='Чужой', article='202')
+
+        result = import_positions_bulk(self.user, '101:чехол:5\n\n202:чехол:1\nмусор\n')
+
+        self.assertEqual(result['created_positions'], 1)
+        self.assertEqual([(line_number, line) for line_number, line, _ in result['errors']],
+                         [(3, '202:чехол:1'), (4, 'мусор')])
+        self.assertIn('202', result['errors'][0][2])
+
+    def test_check_date_backdates_positions(self):
+        day = timezone.localdate() - timedelta(days=3)
+
+        import_positions_bulk(self.user, '101:чехол:8', check_date=day)
+
+        position = ProductPosition.objects.get(keyword=self.keyword)
+        self.assertEqual(timezone.localdate(position.created_at), day)
+        self.assertEqual(timezone.localdate(position.last_seen_at), day)
@@ -0,0 +1,107 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from stock import wb_circuit
+from stock.models import WBCircuit, WBRetryTask
+from stock.wb_sync import WBSyncError, schedule_retry, sync_or_schedule
+
+
+class FakeClock:
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@override_settings(WB_CIRCUIT_FAILURES=3, WB_CIRCUIT_COOLDOWN=100)
+class CircuitBreakerTests(TestCase):
+    """Предохранитель пары (токен, эндпоинт)"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(wb_circuit, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fail(self, times, endpoint='orders'):
+        return [wb_circuit.record_failure('token', endpoint, 'HTTP 500') for _ in range(times)]
+
+    def circuit(self, endpoint='orders'):
+        return WBCircuit.objects.get(key=f'token:{endpoint}')
+
+    def test_opens_after_consecutive_failures(self):
+        self.assertEqual(self.fail(3), [False, False, True])
+        self.assertTrue(wb_circuit.is_open('token', 'orders'))
+        self.assertFalse(wb_circuit.is_open('token', 'sales'))
+        self.assertFalse(wb_circuit.is_open('other', 'orders'))
+        self.assertEqual(wb_circuit.open_endpoints('token'), ['orders'])
+        self.assertEqual(self.circuit().retry_at, 1100)
+        self.assertEqual(self.circuit().last_error, 'HTTP 500')
+
+    def test_success_resets_failures(self):
+        self.fail(2)
+        wb_circuit.record_success('token', 'orders')
+        self.assertEqual(self.fail(2), [False, False])
+
+    def test_single_probe_after_cooldown(self):
+        self.fail(3)
+        self.assertEqual(wb_circuit.due_probes(), [])
+        self.assertFalse(wb_circuit.start_probe('token', 'orders'))
+
+        self.clock.now += 100
+        self.assertEqual(wb_circuit.due_probes(), [('token', 'orders')])
+        self.assertTrue(wb_circuit.start_probe('token', 'orders'))
+        self.assertFalse(wb_circuit.start_probe('token', 'orders'))  # Пробу уже взял другой воркер
+        self.assertEqual(self.circuit().state, 'half_open')
+        self.assertTrue(wb_circuit.is_open('token', 'orders'))
+
+        wb_circuit.record_success('token', 'orders')
+        self.assertEqual((self.circuit().state, self.circuit().failures), ('closed', 0))
+        self.assertIsNone(self.circuit().opened_at)
+
+    def test_failed_probe_doubles_cooldown(self):
+        self.fail(3)
+        self.clock.now += 100
+        wb_circuit.start_probe('token', 'orders')
+
+        self.assertTrue(self.fail(1)[0])
+        self.assertEqual(self.circuit().state, 'open')
+        self.assertEqual(self.circuit().retry_at, self.clock.now + 200)
+
+        self.fail(10)
+        self.assertEqual(self.circuit().retry_at, self.clock.now + 100 * 32)
+
+
+@override_settings(WB_RETRY_BASE_DELAY=60, WB_RETRY_MAX_DELAY=300)
+class RetryQueueTests(TestCase):
+    """Очередь повторов синхронизации"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('seller', password='secret')
+
+    def test_delay_doubles_up_to_maximum(self):
+        delays = []
+        for _ in range(5):
+            before = timezone.now()
+            task = schedule_retry(self.user, 'HTTP 500')
+            delays.append(round((task.next_attempt_at - before).total_seconds()))
+        self.assertEqual(delays, [60, 120, 240, 300, 300])
+        self.assertEqual(WBRetryTask.objects.get().attempts, 5)
+
+    def test_failed_sync_is_queued_and_success_clears_queue(self):
+        with mock.patch('stock.wb_sync.sync_user', side_effect=WBSyncError('orders: нет данных')):
+            with self.assertRaises(WBSyncError):
+                sync_or_schedule(None, self.user)
+        task = WBRetryTask.objects.get(user=self.user)
+        self.assertEqual(task.last_error, 'orders: нет данных')
+        self.assertGreater(task.next_attempt_at, timezone.now() + timedelta(seconds=50))
+
+        with mock.patch('stock.wb_sync.sync_user', return_value={'orders': 0, 'sales': 0}):
+            sync_or_schedule(None, self.user)
+        self.assertFalse(WBRetryTask.objects.exists())
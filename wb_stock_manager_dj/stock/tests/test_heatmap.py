@@ -0,0 +1,72 @@
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from stock.models import Product, ProductKeyword, ProductPosition, PositionDailyStats
+from stock.positions import get_position_heatmap
+
+
+def day_moment(days_ago, hour):
+    day = timezone.localdate() - timedelta(days=days_ago)
+    return timezone.make_aware(datetime.combine(day, time(hour)))
+
+
+class PositionHeatmapTests(TestCase):
+    """Матрица "ключевые слова × дни" (get_position_heatmap и API)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('seller', password='secret')
+        self.product = Product.objects.create(user=self.user, name='Чехол', article='101')
+        self.other_product = Product.objects.create(user=self.user, name='Кабель', article='102')
+        self.keyword = ProductKeyword.objects.create(product=self.product, keyword='чехол')
+        self.other_keyword = ProductKeyword.objects.create(product=self.other_product, keyword='кабель')
+
+    def add_run(self, keyword, position, first_seen, last_seen, region='Москва'):
+        run = ProductPosition.objects.create(keyword=keyword, position=position, region=region, last_seen_at=last_seen)
+        ProductPosition.objects.filter(pk=run.pk).update(created_at=first_seen)
+
+    def test_best_position_per_day_with_run_expansion(self):
+        # Серия 8 с позавчера до сегодня и серия 3 вчера: вчера лучшая - 3
+        self.add_run(self.keyword, 8, day_moment(2, 10), day_moment(0, 9))
+        self.add_run(self.keyword, 3, day_moment(1, 12), day_moment(1, 13))
+        self.add_run(self.keyword, 0, day_moment(0, 10), day_moment(0, 11))
+
+        heatmap = get_position_heatmap(self.user, days=4)
+
+        self.assertEqual([item['id'] for item in heatmap['keywords']], [self.other_keyword.id, self.keyword.id])
+        self.assertEqual(heatmap['dates'][-1], timezone.localdate().strftime('%Y-%m-%d'))
+        self.assertEqual(heatmap['matrix'], [[0, 0, 0, 0], [0, 8, 3, 8]])
+
+    def test_archived_days_and_region(self):
+        PositionDailyStats.objects.create(
+            keyword=self.keyword, date=timezone.localdate() - timedelta(days=1),
+            min_position=4, avg_position=6.0, max_position=9, checks=5, found_checks=5
+        )
+        self.add_run(self.keyword, 2, day_moment(1, 10), day_moment(1, 10), region='Казань')
+
+        self.assertEqual(get_position_heatmap(self.user, days=2)['matrix'][1], [4, 0])
+        self.assertEqual(get_position_heatmap(self.user, days=2, region='Казань')['matrix'][1], [2, 0])
+
+    def test_product_filter(self):
+        self.add_run(self.other_keyword, 5, day_moment(0, 8), day_moment(0, 8))
+
+        heatmap = get_position_heatmap(self.user, days=1, product_id=self.other_product.id)
+
+        self.assertEqual([item['text'] for item in heatmap['keywords']], ['кабель'])
+        self.assertEqual(heatmap['matrix'], [[5]])
+
+    def test_api_validates_parameters(self):
+        self.client.force_login(self.user)
+        url = reverse('api_position_heatmap')
+
+        self.assertEqual(self.client.get(url, {'product_id': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'region': 'Марс'}).status_code, 400)
+        foreign = Product.objects.create(user=User.objects.create_user('other'), name='Чужой', article='201')
+        self.assertEqual(self.client.get(url, {'product_id': foreign.id}).status_code, 404)
+
+        response = self.client.get(url, {'product_id': self.product.id, 'days': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['dates']), 3)
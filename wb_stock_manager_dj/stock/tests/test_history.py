@@ -0,0 +1,124 @@
+from datetime import date, datetime
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+
+from stock.models import Product, ProductKeyword, ProductPosition, PositionDailyStats
+from stock.positions import get_keyword_history, record_positions
+
+
+def moment(day, hour=0):
+    return timezone.make_aware(datetime(2026, 1, day, hour))
+
+
+class HistoryTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('seller', password='secret')
+        product = Product.objects.create(user=self.user, name='Чехол', article='101')
+        self.keyword = ProductKeyword.objects.create(product=product, keyword='чехол')
+
+    def add_run(self, position, first_seen, last_seen, checks, region='Москва'):
+        run = ProductPosition.objects.create(
+            keyword=self.keyword, position=position, region=region, last_seen_at=last_seen, checks=checks
+        )
+        ProductPosition.objects.filter(pk=run.pk).update(created_at=first_seen)  # auto_now_add
+        return run
+
+
+class RunLengthTests(HistoryTestCase):
+    """Хранение позиций сериями (record_positions)"""
+
+    def test_same_position_extends_run(self):
+        record_positions([(self.keyword.id, 5)], checked_at=moment(1, 10))
+        record_positions([(self.keyword.id, 5)], checked_at=moment(1, 11))
+        record_positions([(self.keyword.id, 8)], checked_at=moment(1, 12))
+
+        runs = list(self.keyword.positions.order_by('created_at').values_list(
+            'position', 'previous_position', 'checks', 'created_at', 'last_seen_at'
+        ))
+        self.assertEqual(runs, [
+            (5, None, 2, moment(1, 10), moment(1, 11)),
+            (8, 5, 1, moment(1, 12), moment(1, 12)),
+        ])
+        self.keyword.refresh_from_db()
+        self.assertEqual((self.keyword.last_position, self.keyword.last_checked_at), (8, moment(1, 12)))
+
+    def test_regions_have_separate_runs(self):
+        record_positions([(self.keyword.id, 5), (self.keyword.id, 5, 'Казань')], checked_at=moment(1, 10))
+        record_positions([(self.keyword.id, 5), (self.keyword.id, 9, 'Казань')], checked_at=moment(1, 11))
+
+        self.assertEqual(self.keyword.positions.filter(region='Москва').get().checks, 2)
+        self.assertEqual(list(self.keyword.positions.filter(region='Казань').values_list('position', flat=True)), [9, 5])
+
+
+class KeywordHistoryTests(HistoryTestCase):
+    """История позиций по периоду (get_keyword_history)"""
+
+    def test_long_run_covers_every_day_bucket(self):
+        # Серия с 2 января 12:00 по 12 января 12:00: 241 проверка раз в час
+        self.add_run(7, moment(2, 12), moment(12, 12), 241)
+
+        history = get_keyword_history(self.keyword, date(2026, 1, 1), date(2026, 1, 15), bucket='day')
+
+        self.assertEqual(history['dates'], [f'2026-01-{day:02d}' for day in range(2, 13)])
+        self.assertEqual(history['positions'], [7.0] * 11)
+        self.assertEqual(history['min_positions'], [7] * 11)
+        self.assertEqual(history['max_positions'], [7] * 11)
+        # Проверки делятся по времени: половина дня на краях, целые дни посередине
+        self.assertAlmostEqual(history['checks'][0], 12.05)
+        self.assertAlmostEqual(history['checks'][1], 24.1)
+        self.assertAlmostEqual(sum(history['checks']), 241)
+        self.assertFalse(history['truncated'])
+
+    def test_not_found_checks_do_not_lower_the_average(self):
+        self.add_run(10, moment(3, 1), moment(3, 5), 5)
+        self.add_run(0, moment(3, 6), moment(3, 8), 3)
+        self.add_run(4, moment(3, 9), moment(3, 9), 1)
+
+        history = get_keyword_history(self.keyword, date(2026, 1, 3), date(2026, 1, 3), bucket='day')
+
+        self.assertEqual(history['positions'], [9.0])  # (10 * 5 + 4) / 6
+        self.assertEqual((history['min_positions'], history['max_positions']), ([4], [10]))
+        self.assertEqual(history['checks'], [9])
+
+    def test_archived_days_are_merged(self):
+        self.add_run(6, moment(5, 10), moment(5, 12), 3)
+        PositionDailyStats.objects.create(
+            keyword=self.keyword, date=date(2026, 1, 4), min_position=3, avg_position=4.0, max_position=5,
+            checks=10, found_checks=8
+        )
+
+        history = get_keyword_history(self.keyword, date(2026, 1, 1), date(2026, 1, 7), bucket='day')
+
+        self.assertEqual(history['dates'], ['2026-01-04', '2026-01-05'])
+        self.assertEqual(history['positions'], [4.0, 6.0])
+        self.assertEqual(history['min_positions'], [3, 6])
+        self.assertEqual(history['checks'], [10, 3])
+
+    def test_hour_buckets_and_max_points(self):
+        self.add_run(2, moment(6, 0), moment(6, 23), 24)
+
+        # Возвращаются последние max_points интервалов периода
+        history = get_keyword_history(self.keyword, date(2026, 1, 6), date(2026, 1, 6), bucket='hour', max_points=4)
+
+        self.assertTrue(history['truncated'])
+        self.assertEqual(history['dates'], [f'2026-01-06 {hour:02d}:00' for hour in range(20, 24)])
+        self.assertEqual(history['positions'], [2.0] * 4)
+
+    def test_other_regions_are_excluded(self):
+        self.add_run(3, moment(8, 10), moment(8, 10), 1, region='Казань')
+
+        history = get_keyword_history(self.keyword, date(2026, 1, 8), date(2026, 1, 8), bucket='day')
+
+        self.assertEqual(history['dates'], [])
+
+    def test_raw_points_are_run_edges(self):
+        self.add_run(5, moment(9, 10), moment(9, 14), 5)
+        self.add_run(8, moment(9, 15), moment(9, 15), 1)
+
+        history = get_keyword_history(self.keyword, date(2026, 1, 9), date(2026, 1, 9))
+
+        self.assertEqual(history['dates'], ['2026-01-09 10:00', '2026-01-09 14:00', '2026-01-09 15:00'])
+        self.assertEqual(history['positions'], [5, 5, 8])
@@ -0,0 +1,62 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from stock.models import Product, ProductKeyword
+from stock.positions import get_top_products, record_positions
+
+
+class TopProductsTests(TestCase):
+    """Топ товаров по средней позиции (get_top_products)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('seller', password='secret')
+        self.first = Product.objects.create(user=self.user, name='Чехол', article='101')
+        self.second = Product.objects.create(user=self.user, name='Кабель', article='102')
+        self.missing = Product.objects.create(user=self.user, name='Наушники', article='103')
+        self.first_keyword = ProductKeyword.objects.create(product=self.first, keyword='чехол')
+        self.second_keyword = ProductKeyword.objects.create(product=self.second, keyword='кабель')
+        self.second_extra = ProductKeyword.objects.create(product=self.second, keyword='кабель usb')
+        self.missing_keyword = ProductKeyword.objects.create(product=self.missing, keyword='наушники')
+
+    def test_average_is_weighted_by_checks(self):
+        # Серия 5 из двух проверок и серия 11 из одной: (5 * 2 + 11) / 3 = 7
+        record_positions([(self.first_keyword.id, 5), (self.second_keyword.id, 3), (self.second_extra.id, 0)])
+        record_positions([(self.first_keyword.id, 5)])
+        record_positions([(self.first_keyword.id, 11)])
+
+        top = get_top_products(self.user)
+
+        self.assertEqual([item['id'] for item in top], [self.second.id, self.first.id])
+        first = top[1]
+        self.assertAlmostEqual(first['avg_position'], 7)
+        self.assertEqual((first['best_position'], first['worst_position']), (5, 11))
+        self.assertEqual(top[0]['keywords_count'], 2)
+        self.assertEqual([position.position for position in first['recent_positions']], [11, 5])
+
+    def test_not_found_and_other_regions_are_ignored(self):
+        record_positions([(self.first_keyword.id, 40), (self.first_keyword.id, 1, 'Казань'), (self.missing_keyword.id, 0)])
+
+        top = get_top_products(self.user)
+
+        self.assertEqual([item['id'] for item in top], [self.first.id])
+        self.assertEqual(top[0]['avg_position'], 40)
+
+    def test_new_positions_and_product_edits_are_visible(self):
+        record_positions([(self.first_keyword.id, 20)])
+        self.assertEqual(get_top_products(self.user)[0]['avg_position'], 20)
+
+        # Запись позиций сбрасывает кэш, правка товара видна без сброса
+        record_positions([(self.first_keyword.id, 10)])
+        Product.objects.filter(id=self.first.id).update(name='Чехол прозрачный')
+
+        top = get_top_products(self.user)
+        self.assertEqual(top[0]['avg_position'], 15)
+        self.assertEqual(top[0]['name'], 'Чехол прозрачный')
+
+    def test_other_users_products_are_not_listed(self):
+        other = User.objects.create_user('other', password='secret')
+        product = Product.objects.create(user=other, name='Чужой', article='201')
+        keyword = ProductKeyword.objects.create(product=product, keyword='чехол')
+        record_positions([(keyword.id, 1)])
+
+        self.assertEqual(get_top_products(self.user), [])
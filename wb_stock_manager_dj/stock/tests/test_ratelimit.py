@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from stock import wb_ratelimit
+from stock.models import WBRateLimit
+
+
+class FakeClock:
+    """Подмена модуля time: время идет только по sleep"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@override_settings(WB_API_RATE_LIMITS={'orders': 60, 'sales': 10}, WB_API_DEFAULT_INTERVAL=30)
+class RateLimiterTests(TestCase):
+    """Общий планировщик слотов API статистики WB"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(wb_ratelimit, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.token = wb_ratelimit.token_key('secret-token')
+
+    def test_token_is_hashed(self):
+        self.assertEqual(len(self.token), 16)
+        self.assertNotIn('secret', self.token)
+
+    def test_slots_are_spaced_by_endpoint_interval(self):
+        waits = [wb_ratelimit.reserve(self.token, 'orders') for _ in range(3)]
+        self.assertEqual(waits, [0, 60, 120])
+        self.assertEqual(wb_ratelimit.reserve(self.token, 'sales'), 0)
+        self.assertEqual(wb_ratelimit.reserve(self.token, 'sales'), 10)
+        self.assertEqual(wb_ratelimit.reserve(self.token, 'unknown'), 0)
+        self.assertEqual(wb_ratelimit.reserve(self.token, 'unknown'), 30)
+
+    def test_tokens_are_independent(self):
+        wb_ratelimit.reserve(self.token, 'orders')
+        self.assertEqual(wb_ratelimit.reserve(wb_ratelimit.token_key('other'), 'orders'), 0)
+
+    def test_slot_after_idle_period_is_immediate(self):
+        wb_ratelimit.reserve(self.token, 'orders')
+        self.clock.now += 600
+        self.assertEqual(wb_ratelimit.reserve(self.token, 'orders'), 0)
+
+    def test_too_distant_slot_is_not_taken(self):
+        wb_ratelimit.reserve(self.token, 'orders')
+        self.assertIsNone(wb_ratelimit.reserve(self.token, 'orders', max_wait=30))
+        # Отказ не сдвинул очередь
+        self.assertEqual(wb_ratelimit.reserve(self.token, 'orders'), 60)
+
+    def test_penalize_blocks_until_retry_after(self):
+        wb_ratelimit.penalize(self.token, 'orders', 300)
+        self.assertEqual(wb_ratelimit.reserve(self.token, 'orders'), 300)
+
+    def test_wait_for_slot_sleeps_and_honours_deadline(self):
+        self.assertTrue(wb_ratelimit.wait_for_slot(self.token, 'orders'))
+        self.assertTrue(wb_ratelimit.wait_for_slot(self.token, 'orders'))
+        self.assertEqual(self.clock.sleeps, [60])
+        self.assertFalse(wb_ratelimit.wait_for_slot(self.token, 'orders', deadline=self.clock.now + 10))
+
+    def test_wait_for_slot_retakes_slot_after_block(self):
+        wb_ratelimit.reserve(self.token, 'orders')
+        # Пока ждали слот, другой процесс получил 429 - слот занимается заново после блокировки
+        WBRateLimit.objects.filter(key=f'{self.token}:orders').update(blocked_until=self.clock.now + 90)
+
+        self.assertTrue(wb_ratelimit.wait_for_slot(self.token, 'orders'))
+        self.assertEqual(self.clock.sleeps, [60, 60])
+
+
+class ParseRetryAfterTests(SimpleTestCase):
+
+    def test_headers(self):
+        response = SimpleNamespace(headers={'X-Ratelimit-Retry': '12'})
+        self.assertEqual(wb_ratelimit.parse_retry_after(response, 60), 12)
+        response = SimpleNamespace(headers={'Retry-After': 'soon', 'X-Ratelimit-Retry': '-5'})
+        self.assertEqual(wb_ratelimit.parse_retry_after(response, 60), 0)
+        self.assertEqual(wb_ratelimit.parse_retry_after(SimpleNamespace(headers={}), 60), 60)
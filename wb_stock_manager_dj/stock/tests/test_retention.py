@@ -0,0 +1,136 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+
+from stock.models import (
+    Product, ProductKeyword, ProductPosition, PositionDailyStats, AdvertisingCampaign, CampaignDailyStats,
+    CampaignMonthlyStats, RetentionCursor
+)
+from stock.positions import get_keyword_history
+from stock.retention import rollup_campaign_stats, rollup_positions
+
+
+def moment(day, hour=0):
+    return timezone.make_aware(datetime(2026, 1, day, hour))
+
+
+class PositionRollupTests(TestCase):
+    """Свертка серий позиций по дням (rollup_positions)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('seller', password='secret')
+        self.product = Product.objects.create(user=self.user, name='Чехол', article='101')
+        self.keyword = ProductKeyword.objects.create(product=self.product, keyword='чехол')
+
+    def add_run(self, position, first_seen, last_seen, checks, keyword=None):
+        run = ProductPosition.objects.create(
+            keyword=keyword or self.keyword, position=position, last_seen_at=last_seen, checks=checks
+        )
+        ProductPosition.objects.filter(pk=run.pk).update(created_at=first_seen)
+        return run
+
+    def add_runs(self):
+        self.add_run(10, moment(2, 10), moment(3, 10), 5)  # 3 проверки 2 января, 2 - 3 января
+        self.add_run(0, moment(3, 12), moment(3, 12), 2)
+        self.add_run(4, moment(3, 13), moment(3, 13), 1)
+        return self.add_run(6, moment(4, 10), moment(5, 10), 10)  # Последняя серия - остается
+
+    def daily(self):
+        return {
+            stats.date.day: (stats.min_position, stats.avg_position, stats.max_position, stats.checks, stats.found_checks)
+            for stats in PositionDailyStats.objects.all()
+        }
+
+    def test_finished_runs_become_days(self):
+        latest = self.add_runs()
+
+        self.assertEqual(list(rollup_positions(moment(10))), [(3, 2)])
+
+        self.assertEqual(self.daily(), {2: (10, 10.0, 10, 3, 3), 3: (4, 8.0, 10, 5, 3)})
+        self.assertEqual(list(ProductPosition.objects.values_list('pk', flat=True)), [latest.pk])
+
+    def test_runs_after_cutoff_are_kept(self):
+        self.add_runs()
+
+        list(rollup_positions(moment(3)))
+
+        self.assertEqual(ProductPosition.objects.count(), 4)
+        self.assertFalse(PositionDailyStats.objects.exists())
+
+    def test_existing_day_is_merged_by_found_checks(self):
+        PositionDailyStats.objects.create(
+            keyword=self.keyword, date=date(2026, 1, 3), min_position=2, avg_position=2.0, max_position=2,
+            checks=1, found_checks=1
+        )
+        self.add_runs()
+
+        list(rollup_positions(moment(10)))
+
+        self.assertEqual(self.daily()[3], (2, 6.5, 10, 6, 4))  # (2 * 1 + 10 * 2 + 4) / 4
+
+    def test_history_is_preserved(self):
+        self.add_runs()
+        before = get_keyword_history(self.keyword, date(2026, 1, 2), date(2026, 1, 3), bucket='day')
+
+        list(rollup_positions(moment(10)))
+
+        after = get_keyword_history(self.keyword, date(2026, 1, 2), date(2026, 1, 3), bucket='day')
+        self.assertEqual(after['dates'], before['dates'])
+        self.assertEqual(after['min_positions'], before['min_positions'])
+        self.assertEqual(after['max_positions'], before['max_positions'])
+        self.assertEqual(sum(after['checks']), sum(before['checks']))
+
+    def test_interrupted_run_resumes_from_cursor(self):
+        keywords = [self.keyword] + [
+            ProductKeyword.objects.create(product=self.product, keyword=f'чехол {index}') for index in range(2)
+        ]
+        for keyword in keywords:
+            self.add_run(5, moment(1, 10), moment(1, 11), 2, keyword=keyword)
+            self.add_run(7, moment(2, 10), moment(2, 10), 1, keyword=keyword)
+
+        chunks = rollup_positions(moment(10), chunk_size=1)
+        next(chunks)  # Первая порция - и процесс прервался
+        self.assertEqual(RetentionCursor.objects.get(job='positions').last_id, keywords[0].id)
+
+        self.assertEqual(list(rollup_positions(moment(10), chunk_size=1)), [(1, 1), (1, 1)])
+        self.assertEqual(PositionDailyStats.objects.count(), 3)
+        self.assertEqual(RetentionCursor.objects.get(job='positions').last_id, 0)
+
+
+class CampaignRollupTests(TestCase):
+    """Свертка дневной статистики рекламы по месяцам (rollup_campaign_stats)"""
+
+    def setUp(self):
+        user = User.objects.create_user('seller', password='secret')
+        self.campaign = AdvertisingCampaign.objects.create(user=user, name='Поиск', campaign_type='search')
+        for day, views, spent in [(date(2025, 11, 5), 100, '10.50'), (date(2025, 11, 20), 50, '4.50'),
+                                  (date(2025, 12, 1), 30, '3.00'), (date(2026, 1, 2), 10, '1.00')]:
+            CampaignDailyStats.objects.create(campaign=self.campaign, date=day, views=views, clicks=1, spent=spent)
+
+    def test_full_months_before_date_are_rolled_up(self):
+        self.assertEqual(list(rollup_campaign_stats(date(2026, 1, 1))), [(3, 2)])
+
+        months = {
+            stats.month: (stats.days, stats.views, stats.clicks, stats.spent)
+            for stats in CampaignMonthlyStats.objects.all()
+        }
+        self.assertEqual(months, {
+            date(2025, 11, 1): (2, 150, 2, Decimal('15.00')),
+            date(2025, 12, 1): (1, 30, 1, Decimal('3.00')),
+        })
+        self.assertEqual(list(self.campaign.daily_stats.values_list('date', flat=True)), [date(2026, 1, 2)])
+
+    def test_totals_are_unchanged(self):
+        before = (self.campaign.total_views, self.campaign.total_spent)
+
+        list(rollup_campaign_stats(date(2026, 1, 1)))
+        # Повторная свертка позже в том же месяце дописывает к существующему месяцу
+        CampaignDailyStats.objects.create(campaign=self.campaign, date=date(2025, 12, 15), views=5, spent='1.00')
+        list(rollup_campaign_stats(date(2026, 1, 1)))
+
+        campaign = AdvertisingCampaign.objects.get(pk=self.campaign.pk)
+        self.assertEqual((campaign.total_views, campaign.total_spent), (before[0] + 5, before[1] + Decimal('1.00')))
+        self.assertEqual(CampaignMonthlyStats.objects.get(month=date(2025, 12, 1)).days, 2)
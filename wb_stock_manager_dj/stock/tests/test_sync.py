@@ -0,0 +1,107 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from stock import wb_cache
+from stock.models import WBOrder, WBSale, WBSyncCursor
+from stock.wb_sync import WBSyncError, WBSyncLockLost, _parse_datetime, sync_endpoint
+
+
+class FakeService:
+    """Отвечает заранее заданными порциями и запоминает запросы"""
+
+    def __init__(self, *pages):
+        self.pages = list(pages)
+        self.requests = []
+
+    def make_request_with_retry(self, endpoint, params):
+        self.requests.append((endpoint, params['dateFrom']))
+        return self.pages.pop(0)
+
+
+def order(srid, changed, **extra):
+    return {'srid': srid, 'date': '2026-01-10T10:00:00', 'lastChangeDate': changed, 'nmId': 101, **extra}
+
+
+@override_settings(WB_SYNC_PAGE_ROWS=2)
+class SyncCursorTests(TestCase):
+    """Инкрементальная синхронизация заказов и продаж (sync_endpoint)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('seller', password='secret')
+
+    def cursor(self, endpoint='orders'):
+        return WBSyncCursor.objects.get(user=self.user, endpoint=endpoint)
+
+    def test_first_sync_then_incremental(self):
+        service = FakeService([order('a', '2026-01-10T10:00:00')], [order('b', '2026-01-11T09:30:00')])
+
+        self.assertEqual(sync_endpoint(service, self.user, 'orders', initial_days=5), 1)
+        first_from = service.requests[0][1]
+        expected = (timezone.now() - timedelta(days=5)).astimezone(timezone.get_current_timezone())
+        self.assertEqual(first_from[:13], expected.strftime('%Y-%m-%dT%H'))
+        self.assertIsNotNone(self.cursor().synced_at)
+
+        sync_endpoint(service, self.user, 'orders')
+        self.assertEqual(service.requests[1], ('orders', '2026-01-10T10:00:00'))
+        self.assertEqual(self.cursor().last_change_date, _parse_datetime('2026-01-11T09:30:00'))
+        self.assertEqual(WBOrder.objects.count(), 2)
+
+    def test_full_page_continues_from_last_change(self):
+        service = FakeService(
+            [order('a', '2026-01-10T10:00:00'), order('b', '2026-01-10T11:00:00')],
+            [order('b', '2026-01-10T11:00:00', isCancel=True), order('c', '2026-01-10T12:00:00')],
+            [order('c', '2026-01-10T12:00:00')],
+        )
+
+        self.assertEqual(sync_endpoint(service, self.user, 'orders'), 5)
+
+        self.assertEqual([date_from for _, date_from in service.requests[1:]],
+                         ['2026-01-10T11:00:00', '2026-01-10T12:00:00'])
+        self.assertEqual(WBOrder.objects.count(), 3)
+        self.assertTrue(WBOrder.objects.get(srid='b').is_cancel)  # Новая версия строки обновила старую
+
+    def test_repeated_full_page_on_same_date_finishes(self):
+        # Вся порция с одним lastChangeDate - сдвинуться дальше нельзя, считаем синхронизацию законченной
+        service = FakeService([order('a', '2026-01-10T10:00:00'), order('b', '2026-01-10T10:00:00')],
+                              [order('a', '2026-01-10T10:00:00'), order('b', '2026-01-10T10:00:00')])
+
+        sync_endpoint(service, self.user, 'orders')
+
+        self.assertEqual(len(service.requests), 2)
+        self.assertIsNotNone(self.cursor().synced_at)
+
+    def test_failed_page_keeps_cursor(self):
+        service = FakeService([order('a', '2026-01-10T10:00:00'), order('b', '2026-01-10T11:00:00')], None)
+
+        with self.assertRaises(WBSyncError):
+            sync_endpoint(service, self.user, 'orders')
+
+        # Первая порция сохранена, но эндпоинт не считается свежим
+        self.assertEqual(self.cursor().last_change_date, _parse_datetime('2026-01-10T11:00:00'))
+        self.assertIsNone(self.cursor().synced_at)
+
+    def test_lost_lock_stops_before_writing(self):
+        wb_cache.get_shared_cache().set('lock_wb_sync', 'other-process', 60)
+        wb_cache._held.lock = ('lock_wb_sync', 'this-process')
+        self.addCleanup(setattr, wb_cache._held, 'lock', None)
+
+        with self.assertRaises(WBSyncLockLost):
+            sync_endpoint(FakeService([order('a', '2026-01-10T10:00:00')]), self.user, 'orders')
+
+        self.assertFalse(WBOrder.objects.exists())
+        self.assertIsNone(self.cursor().last_change_date)
+
+    def test_sales_and_returns(self):
+        service = FakeService([
+            {'saleID': 'S1', 'srid': 'a', 'date': '2026-01-10T10:00:00', 'lastChangeDate': '2026-01-10T10:00:00',
+             'priceWithDisc': 500},
+            {'saleID': 'R1', 'srid': 'a', 'date': '2026-01-11T10:00:00', 'lastChangeDate': '2026-01-11T10:00:00',
+             'priceWithDisc': -500},
+            {'srid': 'b', 'date': '2026-01-11T10:00:00', 'lastChangeDate': '2026-01-11T10:00:00'},
+        ], [])
+
+        self.assertEqual(sync_endpoint(service, self.user, 'sales'), 2)
+        self.assertEqual(dict(WBSale.objects.values_list('sale_id', 'is_return')), {'S1': False, 'R1': True})
@@ -38,10 +38,16 @@ urlpatterns = [
     path('advertising/goals/<int:goal_id>/reactivate/', views.goal_reactivate, name='goal_reactivate'),
     path('advertising/goals/<int:goal_id>/delete/', views.goal_delete, name='goal_delete'),
     path('positions/', views.position_tracking, name='position_tracking'),
+    path('positions/bulk/', views.bulk_position_add, name='bulk_position_add'),
+    path('positions/heatmap/', views.position_heatmap, name='position_heatmap'),
+    path('positions/alerts/', views.position_alerts, name='position_alerts'),
     path('keyword/<int:keyword_id>/delete/', views.delete_keyword, name='delete_keyword'),
     path('keyword/<int:keyword_id>/history/', views.keyword_history, name='keyword_history'),
     
     # API
     path('api/keyword/<int:keyword_id>/history/', views.api_keyword_history, name='api_keyword_history'),
+    path('api/keyword/<int:keyword_id>/regions/', views.api_keyword_regions, name='api_keyword_regions'),
     path('api/keywords-by-product/<int:product_id>/', views.api_keywords_by_product, name='api_keywords_by_product'),
+    path('api/products-keywords/', views.api_all_products_keywords, name='api_all_products_keywords'),
+    path('api/positions/heatmap/', views.api_position_heatmap, name='api_position_heatmap'),
 ]
@@ -9,13 +9,23 @@ from django.shortcuts import render
 from django.core.exceptions import PermissionDenied
 from django.http import Http404
 from django.core.paginator import Paginator
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse
 from django.core.paginator import Paginator
 from django.utils import timezone
-from .models import Product, UserProfile, StockMovement, AdvertisingCampaign, CampaignDailyStats, CampaignGoal, GoalNote, ProductKeyword, ProductPosition
+from django.conf import settings
+from .models import Product, UserProfile, StockMovement, AdvertisingCampaign, CampaignDailyStats, CampaignGoal, GoalNote, ProductKeyword, PositionAlert
 
 from .forms import CustomUserCreationForm, UserProfileForm, APITokenForm, StockMovementForm, ProductForm, CampaignDailyStatsForm, AdvertisingCampaignForm, CampaignGoalForm, GoalNoteForm, BulkPositionsForm, ProductKeywordForm, AddPositionForm, AddKeywordForm
-from .wb_parser import get_wb_simple_service, clear_wb_cache
+from .wb_parser import get_wb_simple_service, clear_wb_cache, mark_analytics_viewed
+from .wb_cache import allow_refresh
+from .wb_circuit import open_endpoints
+from .wb_reports import analyze_period_data
+from .wb_sync import ensure_synced
+from .positions import (
+    get_top_products, bump_positions_version, import_positions_bulk, get_keyword_history, HISTORY_BUCKETS,
+    get_position_heatmap, record_positions, get_keyword_regions, get_products_keywords_json
+)
+from .regions import REGIONS, DEFAULT_REGION
 
 
 def home(request):
@@ -219,6 +229,7 @@ def product_add(request):
             product = form.save(commit=False)
             product.user = request.user
             product.save()
+            bump_positions_version(request.user.id)
             messages.success(request, f'Товар "{product.name}" успешно добавлен!')
             return redirect('product_list')
     else:
@@ -239,6 +250,7 @@ def product_edit(request, product_id):
         form = ProductForm(request.POST, request.FILES, instance=product)
         if form.is_valid():
             form.save()
+            bump_positions_version(request.user.id)
             messages.success(request, f'Товар "{product.name}" успешно обновлен!')
             return redirect('product_list')
     else:
@@ -259,6 +271,7 @@ def product_delete(request, product_id):
     if request.method == 'POST':
         product_name = product.name
         product.delete()
+        bump_positions_version(request.user.id)
         messages.success(request, f'Товар "{product_name}" успешно удален!')
         return redirect('product_list')
     
@@ -306,18 +319,28 @@ def analytics_dashboard(request):
     # Проверяем, не нужно ли обновить данные
     refresh = request.GET.get('refresh')
     if refresh:
-        clear_wb_cache(request.user)
+        if allow_refresh(request.user.id):
+            clear_wb_cache(request.user)
+        else:
+            messages.warning(
+                request, f'Данные можно обновлять не чаще раза в {settings.WB_REFRESH_INTERVAL} сек. Показаны последние загруженные.'
+            )
     
     service = get_wb_simple_service(request.user)
     
     analytics_data = None
+    updated_at = None
+    refreshing = False
+    unavailable = []
     error = None
     
     if service:
+        mark_analytics_viewed(request.user)
+        unavailable = open_endpoints(service.token_key)
         try:
-            # Получаем данные за сегодня с кэшированием
-            analytics_data = service.analyze_today_data(request.user.id)
-            if not analytics_data['success']:
+            # Последние загруженные данные сразу, обновление - в фоне
+            analytics_data, updated_at, refreshing = service.get_today_snapshot(request.user.id)
+            if analytics_data and not analytics_data['success']:
                 error = analytics_data.get('error', 'Не удалось получить данные аналитики')
         except Exception as e:
             error = f"Ошибка при получении данных: {str(e)}"
@@ -347,27 +370,34 @@ def analytics_dashboard(request):
     context = {
         'page_title': 'Аналитика за сегодня',
         'analytics_data': analytics_data,
+        'updated_at': updated_at,
+        'refreshing': refreshing,
+        'unavailable': unavailable,
         'error': error
     }
     return render(request, 'stock/analytics_dashboard.html', context)
 
 @login_required
 def sales_report(request):
-    """Детальный отчет по продажам"""
-    parser = get_wb_parser_for_user(request.user)
+    """Детальный отчет по продажам (из локальной копии заказов и продаж)"""
+    service = get_wb_simple_service(request.user)
     
     period = request.GET.get('period', '7')
     try:
         period_days = int(period)
     except:
         period_days = 7
+    period_days = min(max(period_days, 1), settings.WB_REPORT_MAX_DAYS)
     
     report_data = None
+    syncing = False
     error = None
     
-    if parser:
+    if service:
+        # Отчет строится по уже загруженным данным, свежие догружаются в фоне
+        syncing = ensure_synced(service, request.user)
         try:
-            report_data = parser.analyze_period_data(period_days)
+            report_data = analyze_period_data(request.user.id, period_days)
         except Exception as e:
             error = f"Ошибка при получении отчета: {str(e)}"
     else:
@@ -376,6 +406,7 @@ def sales_report(request):
     context = {
         'page_title': 'Отчет по продажам',
         'report_data': report_data,
+        'syncing': syncing,
         'error': error,
         'period_days': period_days
     }
@@ -565,6 +596,7 @@ def campaign_detail(request, campaign_id):
         'page_title': f'Кампания: {campaign.name}',
         'campaign': campaign,
         'daily_stats': daily_stats.order_by('-date'),  # Для таблицы - новые сверху
+        'monthly_stats': campaign.monthly_stats.all(),  # Свернутые старые месяцы
         'stats_form': stats_form,
         'chart_data': {
             'dates': dates,
@@ -869,98 +901,95 @@ def position_tracking(request):
         if 'add_keyword' in request.POST:
             keyword_form = AddKeywordForm(request.POST, user=request.user)
             if keyword_form.is_valid():
-                # ... существующий код ...
-                pass
+                product = keyword_form.cleaned_data['product']
+                keyword, created = ProductKeyword.objects.get_or_create(
+                    product=product,
+                    keyword=' '.join(keyword_form.cleaned_data['keyword'].split())
+                )
+                if created:
+                    bump_positions_version(request.user.id)
+                    messages.success(request, f'Ключевое слово "{keyword.keyword}" добавлено')
+                else:
+                    messages.info(request, f'Ключевое слово "{keyword.keyword}" уже отслеживается')
+                return redirect(f"{request.path}?product_id={product.id}")
         
         elif 'add_position' in request.POST:
-            position_form = AddPositionForm(request.POST, user=request.user)
+            position_form = AddPositionForm(request.POST, user=request.user, product_id=selected_product_id)
             if position_form.is_valid():
-                # ... существующий код ...
-                pass
+                record_positions([(
+                    position_form.cleaned_data['keyword'].id,
+                    position_form.cleaned_data['position'],
+                    position_form.cleaned_data['region']
+                )])
+                messages.success(request, 'Позиция сохранена')
+                return redirect(f"{request.path}?product_id={position_form.cleaned_data['product'].id}")
     
     # Получаем все товары с ключевыми словами
     products_with_keywords = Product.objects.filter(
         user=request.user,
         keywords__isnull=False
-    ).distinct().order_by('name')
+    ).distinct().order_by('name').prefetch_related('keywords')
     
     # Для каждого товара получаем его ключевые слова и текущие позиции
     product_stats = []
     for product in products_with_keywords:
-        keywords = product.keywords.all()
-        keyword_data = []
-        
-        for kw in keywords:
-            current_position = kw.current_position
-            last_position = kw.positions.first()  # Последняя запись
-            keyword_data.append({
-                'keyword': kw,
-                'current_position': current_position,
-                'last_checked': last_position.created_at if last_position else None
-            })
+        keyword_data = [{
+            'keyword': kw,
+            'current_position': kw.last_position,
+            'last_checked': kw.last_checked_at
+        } for kw in product.keywords.all()]
         
         product_stats.append({
             'product': product,
             'keywords': keyword_data,
-            'keyword_count': keywords.count()
+            'keyword_count': len(keyword_data)
         })
     
-    # Рассчитываем топ товаров по средней позиции
-    top_products = []
-    for product in products_with_keywords:
-        all_positions = []
-        best_position = None
-        worst_position = None
-        
-        for kw in product.keywords.all():
-            positions = kw.positions.all()
-            if positions:
-                kw_positions = [p.position for p in positions if p.position > 0]
-                if kw_positions:
-                    all_positions.extend(kw_positions)
-                    
-                    kw_best = min(kw_positions)
-                    kw_worst = max(kw_positions)
-                    
-                    if best_position is None or kw_best < best_position:
-                        best_position = kw_best
-                    if worst_position is None or kw_worst > worst_position:
-                        worst_position = kw_worst
-        
-        if all_positions:
-            avg_position = sum(all_positions) / len(all_positions)
-            # Получаем последние 5 позиций для отображения
-            recent_positions = ProductPosition.objects.filter(
-                keyword__product=product
-            ).order_by('-created_at')[:5]
-            
-            top_products.append({
-                'id': product.id,
-                'name': product.name,
-                'article': product.article,
-                'image': product.image,
-                'avg_position': avg_position,
-                'best_position': best_position or 0,
-                'worst_position': worst_position or 0,
-                'keywords_count': product.keywords.count(),
-                'recent_positions': recent_positions,
-                'current_stock': product.current_stock
-            })
-    
-    # Сортируем по средней позиции (чем меньше - тем лучше)
-    top_products.sort(key=lambda x: x['avg_position'])
+    # Топ товаров по средней позиции за последние N дней
+    top_products = get_top_products(request.user, limit=6)
     
     context = {
         'page_title': 'Отслеживание позиций',
         'keyword_form': keyword_form,
         'position_form': position_form,
         'product_stats': product_stats,
-        'top_products': top_products[:6],  # Топ 6 товаров
+        'top_products': top_products,  # Топ 6 товаров
         'selected_product_id': selected_product_id,
     }
     return render(request, 'stock/position_tracking.html', context)
 
 
+@login_required
+def bulk_position_add(request):
+    """Массовое добавление позиций"""
+    import_result = None
+    
+    if request.method == 'POST':
+        form = BulkPositionsForm(request.POST)
+        if form.is_valid():
+            import_result = import_positions_bulk(
+                request.user,
+                form.cleaned_data['data'],
+                check_date=form.cleaned_data['date']
+            )
+            if not import_result['errors']:
+                messages.success(request, f"Загружено позиций: {import_result['created_positions']}")
+                return redirect('position_tracking')
+            # Сохраненные строки убираем из формы - повторная отправка не задвоит их
+            form = BulkPositionsForm(initial={
+                'date': form.cleaned_data['date'],
+                'data': '\n'.join(line for _, line, _ in import_result['errors']),
+            })
+    else:
+        form = BulkPositionsForm()
+    
+    return render(request, 'stock/bulk_position_add.html', {
+        'page_title': 'Массовое добавление позиций',
+        'form': form,
+        'import_result': import_result,
+    })
+
+
 @login_required
 def delete_keyword(request, keyword_id):
     """Удаление ключевого слова"""
@@ -968,6 +997,7 @@ def delete_keyword(request, keyword_id):
     
     if request.method == 'POST':
         keyword.delete()
+        bump_positions_version(request.user.id)
         messages.success(request, 'Ключевое слово удалено')
         return redirect('position_tracking')
     
@@ -978,7 +1008,8 @@ def delete_keyword(request, keyword_id):
 def keyword_history(request, keyword_id):
     """История позиций по ключевому слову"""
     keyword = get_object_or_404(ProductKeyword, id=keyword_id, product__user=request.user)
-    positions = keyword.positions.all().order_by('-date')
+    # Одна строка - серия одинаковых позиций (с created_at по last_seen_at)
+    positions = keyword.positions.filter(region=DEFAULT_REGION).order_by('-created_at')
     
     context = {
         'page_title': f'История - {keyword.keyword}',
@@ -992,60 +1023,132 @@ def keyword_history(request, keyword_id):
 @login_required
 def api_all_products_keywords(request):
     """API для получения всех товаров с их ключевыми словами"""
-    products = Product.objects.filter(user=request.user).order_by('name')
+    return HttpResponse(get_products_keywords_json(request.user), content_type='application/json')
+
+@login_required
+def api_keyword_history(request, keyword_id):
+    """API для получения истории позиций ключевого слова
+    
+    Параметры: from, to (YYYY-MM-DD), bucket (raw/hour/day/week), region
+    """
+    keyword = get_object_or_404(
+        ProductKeyword.objects.select_related('product'),
+        id=keyword_id,
+        product__user=request.user
+    )
     
-    products_data = {}
-    for product in products:
-        keywords = product.keywords.all().order_by('keyword')
-        
-        keywords_data = []
-        for kw in keywords:
-            last_position = kw.positions.first()  # Последняя позиция
-            keywords_data.append({
-                'id': kw.id,
-                'text': kw.keyword,
-                'current_position': kw.current_position,
-                'last_checked': last_position.created_at.strftime('%d.%m') if last_position else None
-            })
-        
-        products_data[str(product.id)] = {  # Ключ как строка!
-            'id': product.id,
-            'name': product.name,
-            'article': product.article,
-            'keywords': keywords_data
-        }
+    bucket = request.GET.get('bucket', 'raw')
+    if bucket != 'raw' and bucket not in HISTORY_BUCKETS:
+        return JsonResponse({'success': False, 'error': 'bucket: raw, hour, day или week'}, status=400)
+    
+    region = request.GET.get('region', DEFAULT_REGION)
+    if region not in REGIONS:
+        return JsonResponse({'success': False, 'error': f"region: {', '.join(REGIONS)}"}, status=400)
+    
+    try:
+        date_to = datetime.strptime(request.GET['to'], '%Y-%m-%d').date() if request.GET.get('to') else timezone.localdate()
+        date_from = (
+            datetime.strptime(request.GET['from'], '%Y-%m-%d').date() if request.GET.get('from')
+            else date_to - timedelta(days=settings.POSITION_HISTORY_DAYS)
+        )
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Даты в формате YYYY-MM-DD'}, status=400)
+    
+    history = get_keyword_history(keyword, date_from, date_to, bucket, region=region)
     
     return JsonResponse({
         'success': True,
-        'products': products_data
+        'keyword': keyword.keyword,
+        'product_name': keyword.product.name,
+        'region': region,
+        'bucket': bucket,
+        'from': date_from.strftime('%Y-%m-%d'),
+        'to': date_to.strftime('%Y-%m-%d'),
+        **history,
+        'current_position': keyword.current_position,
+        'total_positions': len(history['positions'])
     })
 
 @login_required
-def api_keyword_history(request, keyword_id):
-    """API для получения истории позиций ключевого слова"""
-    keyword = get_object_or_404(ProductKeyword, id=keyword_id, product__user=request.user)
+def position_heatmap(request):
+    """Тепловая карта позиций: ключевые слова × дни"""
+    products = Product.objects.filter(user=request.user, keywords__isnull=False).distinct().order_by('name')
     
-    # Получаем последние 30 позиций
-    positions_data = keyword.positions.all().order_by('created_at')[:30]
+    context = {
+        'page_title': 'Тепловая карта позиций',
+        'products': products,
+        'selected_product_id': request.GET.get('product_id', ''),
+        'regions': REGIONS,
+        'default_region': DEFAULT_REGION,
+    }
+    return render(request, 'stock/position_heatmap.html', context)
+
+
+@login_required
+def api_position_heatmap(request):
+    """API матрицы лучших позиций за день по всем ключевым словам"""
+    product_id = request.GET.get('product_id')
+    if product_id:
+        try:
+            product_id = int(product_id)
+        except ValueError:
+            return JsonResponse({'success': False, 'error': 'product_id: ожидается число'}, status=400)
+        get_object_or_404(Product, id=product_id, user=request.user)
     
-    # Подготавливаем данные для графика
-    dates = []
-    positions = []
+    try:
+        days = min(max(int(request.GET.get('days', 30)), 1), 365)
+    except ValueError:
+        days = 30
     
-    for pos in positions_data:
-        dates.append(pos.created_at.strftime('%Y-%m-%d'))
-        positions.append(pos.position)
+    region = request.GET.get('region', DEFAULT_REGION)
+    if region not in REGIONS:
+        return JsonResponse({'success': False, 'error': f"region: {', '.join(REGIONS)}"}, status=400)
     
+    return JsonResponse({
+        'success': True,
+        **get_position_heatmap(request.user, days=days, product_id=product_id, region=region)
+    })
+
+
+@login_required
+def api_keyword_regions(request, keyword_id):
+    """API сравнения ключевого слова по регионам (лучшая позиция за день)"""
+    keyword = get_object_or_404(ProductKeyword, id=keyword_id, product__user=request.user)
+    
+    try:
+        days = min(max(int(request.GET.get('days', settings.POSITION_HISTORY_DAYS)), 1), 365)
+    except ValueError:
+        days = settings.POSITION_HISTORY_DAYS
+    
+    date_to = timezone.localdate()
     return JsonResponse({
         'success': True,
         'keyword': keyword.keyword,
-        'product_name': keyword.product.name,
-        'dates': dates,
-        'positions': positions,
-        'current_position': keyword.current_position,
-        'total_positions': positions_data.count()
+        **get_keyword_regions(keyword, date_to - timedelta(days=days - 1), date_to)
     })
 
+
+@login_required
+def position_alerts(request):
+    """Лента уведомлений об изменении позиций"""
+    alerts = PositionAlert.objects.filter(user=request.user)
+    
+    if request.method == 'POST':
+        updated = alerts.filter(is_read=False).update(is_read=True)
+        messages.success(request, f'Отмечено прочитанными: {updated}')
+        return redirect('position_alerts')
+    
+    # Индекс (user, -created_at) отдает страницу без сортировки всей таблицы
+    page_obj = Paginator(alerts.select_related('keyword__product'), 50).get_page(request.GET.get('page'))
+    
+    context = {
+        'page_title': 'Уведомления о позициях',
+        'page_obj': page_obj,
+        'unread_count': alerts.filter(is_read=False).count(),
+    }
+    return render(request, 'stock/position_alerts.html', context)
+
+
 @login_required
 def api_keywords_by_product(request, product_id):
     """API для получения ключевых слов по товару"""
@@ -1055,12 +1158,11 @@ def api_keywords_by_product(request, product_id):
     
     keywords_data = []
     for kw in keywords:
-        last_position = kw.positions.first()
         keywords_data.append({
             'id': kw.id,
             'text': kw.keyword,
-            'current_position': kw.current_position,
-            'last_checked': last_position.created_at.strftime('%d.%m') if last_position else None
+            'current_position': kw.last_position,
+            'last_checked': timezone.localtime(kw.last_checked_at).strftime('%d.%m') if kw.last_checked_at else None
         })
     
     return JsonResponse({
@@ -0,0 +1,245 @@
+# stock/wb_cache.py
+# Общий для всех процессов кэш аналитики WB с защитой от одновременного пересчета.
+# Хранилище - отдельный алиас CACHES (settings.WB_SHARED_CACHE): по умолчанию
+# таблица в базе, меняется на Redis / Memcached без правок кода.
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+LOCK_POLL_INTERVAL = 0.2  # Как часто ждущий процесс проверяет готовность пересчета (сек)
+
+_background = None
+_background_lock = threading.Lock()
+_held = threading.local()  # Блокировка, под которой идет пересчет в этом потоке
+
+
+def get_shared_cache():
+    """Кэш, общий для всех воркеров"""
+    return caches[settings.WB_SHARED_CACHE]
+
+
+def get_entry(key):
+    """Запись кэша {'value', 'created_at', 'expires_at'} или None"""
+    return get_shared_cache().get(key)
+
+
+def set_entry(key, value, ttl):
+    """Сохранить значение свежим на ttl секунд
+
+    Физически запись живет дольше (settings.WB_STALE_TTL), чтобы после
+    устаревания ее можно было отдавать, пока идет пересчет.
+    """
+    now = time.time()
+    entry = {'value': value, 'created_at': now, 'expires_at': now + ttl}
+    get_shared_cache().set(key, entry, ttl + settings.WB_STALE_TTL)
+    return entry
+
+
+def _store(key, value, ttl):
+    """Сохранить результат пересчета; None - новых данных нет, продлеваем прежние
+
+    Если продлевать нечего (прежняя запись уже вытеснена), ничего не
+    сохраняется и возвращается None.
+    """
+    if value is None:
+        entry = get_entry(key)
+        if entry is None:
+            return None
+        entry['expires_at'] = time.time() + ttl
+        get_shared_cache().set(key, entry, ttl + settings.WB_STALE_TTL)
+        return entry
+    return set_entry(key, value, ttl)
+
+
+def invalidate(key):
+    """Пометить запись устаревшей во всех процессах
+
+    Значение не удаляется: следующий запрос запустит пересчет, а остальные
+    до его окончания получат прежние данные.
+    """
+    entry = get_entry(key)
+    if entry is not None:
+        entry['expires_at'] = 0
+        get_shared_cache().set(key, entry, settings.WB_STALE_TTL)
+
+
+def _acquire(lock_key):
+    """Захватить блокировку пересчета; токен владельца или None"""
+    token = uuid.uuid4().hex
+    if get_shared_cache().add(lock_key, token, settings.WB_LOCK_TTL):
+        return token
+    return None
+
+
+def _release(lock_key, token):
+    """Снять блокировку, если она все еще наша (не истекла и не перехвачена)"""
+    shared = get_shared_cache()
+    if shared.get(lock_key) == token:
+        shared.delete(lock_key)
+
+
+def single_flight(key, compute):
+    """Значение по ключу, которое пересчитывает только один процесс
+
+    compute() возвращает (значение, ttl); значение None - оставить прежнее
+    еще на ttl секунд. Свежая запись отдается сразу.
+    Устаревшую пересчитывает тот, кто первым захватил блокировку, остальные
+    получают устаревшее значение, а если его нет - ждут результат до
+    settings.WB_LOCK_TTL секунд. Возвращает запись (см. get_entry) или
+    None, если compute() вернул None, а прежней записи уже нет.
+    """
+    entry = get_entry(key)
+    if entry is not None and entry['expires_at'] > time.time():
+        print(f"📦 Данные из общего кэша ({key})")
+        return entry
+
+    lock_key = f"{key}:lock"
+    token = _acquire(lock_key)
+    if token is None:
+        if entry is not None:
+            print(f"📦 Пересчет уже идет, отдаем прежние данные ({key})")
+            return entry
+        # Данных еще нет - ждем, пока пересчитает владелец блокировки
+        deadline = time.monotonic() + settings.WB_LOCK_TTL
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            entry = get_entry(key)
+            if entry is not None:
+                return entry
+            token = _acquire(lock_key)
+            if token is not None:
+                # Владелец блокировки упал или отпустил ее без результата
+                break
+        else:
+            print(f"⏳ Не дождались пересчета {key}, считаем сами")
+
+    try:
+        value, ttl = compute()
+        return _store(key, value, ttl)
+    finally:
+        if token is not None:
+            _release(lock_key, token)
+
+
+def renew_lock():
+    """Проверить, что блокировка текущего пересчета все еще наша, и продлить ее
+
+    Вызывается перед записью результатов долгих пересчетов (например,
+    порций синхронизации). Возвращает False, если блокировку перехватил
+    другой процесс и продолжать нельзя. Вне пересчета под блокировкой
+    всегда True.
+    """
+    held = getattr(_held, 'lock', None)
+    if held is None:
+        return True
+    lock_key, token = held
+    shared = get_shared_cache()
+    if shared.get(lock_key) != token:
+        return False
+    return shared.touch(lock_key, settings.WB_LOCK_TTL)
+
+
+def _keep_alive(lock_key, token, stop):
+    """Продлевать блокировку, пока идет пересчет
+
+    Пересчет может ждать слот лимита WB и ответ дольше WB_LOCK_TTL, поэтому
+    блокировка продлевается каждую треть TTL. Если процесс упал, продлевать
+    некому - блокировка истечет сама.
+    """
+    try:
+        while not stop.wait(settings.WB_LOCK_TTL / 3):
+            shared = get_shared_cache()
+            if shared.get(lock_key) != token:
+                return
+            shared.touch(lock_key, settings.WB_LOCK_TTL)
+    except Exception as e:
+        print(f"❌ Не удалось продлить блокировку {lock_key}: {e}")
+    finally:
+        connections.close_all()
+
+
+def _refresh_locked(key, compute, lock_key, token):
+    """Пересчет под уже захваченной блокировкой (она продлевается, пока он идет)"""
+    _held.lock = (lock_key, token)
+    stop = threading.Event()
+    threading.Thread(target=_keep_alive, args=(lock_key, token, stop), daemon=True).start()
+    try:
+        value, ttl = compute()
+        return _store(key, value, ttl)
+    finally:
+        stop.set()
+        _held.lock = None
+        _release(lock_key, token)
+
+
+def refresh(key, compute):
+    """Пересчитать запись сейчас
+
+    None, если пересчет уже идет в другом процессе или сохранять нечего
+    (compute() вернул None, а прежней записи нет).
+    """
+    lock_key = f"{key}:lock"
+    token = _acquire(lock_key)
+    if token is None:
+        return None
+    return _refresh_locked(key, compute, lock_key, token)
+
+
+def _get_background():
+    """Пул потоков для фоновых пересчетов"""
+    global _background
+    if _background is None:
+        with _background_lock:
+            if _background is None:
+                _background = ThreadPoolExecutor(
+                    max_workers=settings.WB_BACKGROUND_WORKERS,
+                    thread_name_prefix='wb-refresh'
+                )
+    return _background
+
+
+def _refresh_job(key, compute, lock_key, token):
+    """Фоновый пересчет: ошибки только в лог, соединения с базой закрываем"""
+    try:
+        _refresh_locked(key, compute, lock_key, token)
+    except Exception as e:
+        print(f"❌ Ошибка фонового обновления {key}: {e}")
+    finally:
+        connections.close_all()
+
+
+def refresh_in_background(key, compute):
+    """Запустить пересчет в фоновом потоке; False, если он уже идет"""
+    lock_key = f"{key}:lock"
+    # Блокировку берем сразу, чтобы не ставить в очередь одинаковые пересчеты
+    token = _acquire(lock_key)
+    if token is None:
+        return False
+    _get_background().submit(_refresh_job, key, compute, lock_key, token)
+    print(f"🔄 Фоновое обновление {key}")
+    return True
+
+
+def stale_while_revalidate(key, compute):
+    """Последняя запись без ожидания WB и фоновое обновление при необходимости
+
+    Если записи нет, она устарела или устареет в ближайшие
+    settings.WB_REFRESH_AHEAD секунд - пересчет запускается в фоне.
+    Возвращает (запись или None, идет ли обновление).
+    """
+    entry = get_entry(key)
+    if entry is not None and entry['expires_at'] - time.time() > settings.WB_REFRESH_AHEAD:
+        return entry, False
+    # Если блокировка занята, обновление уже идет в другом процессе
+    refresh_in_background(key, compute)
+    return entry, True
+
+
+def allow_refresh(user_id):
+    """Ограничение ручного обновления: не чаще раза в settings.WB_REFRESH_INTERVAL секунд"""
+    return get_shared_cache().add(f"wb_refresh_{user_id}", 1, settings.WB_REFRESH_INTERVAL)
@@ -0,0 +1,80 @@
+# stock/wb_circuit.py
+# Предохранитель (circuit breaker) для запросов к API статистики WB.
+# После settings.WB_CIRCUIT_FAILURES ошибок подряд пара (токен, эндпоинт)
+# отключается: запросы пользователей сразу получают отказ и последние
+# сохраненные данные. Включает пару обратно только пробный запрос фонового
+# воркера (process_wb_queue), а не запрос пользователя.
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import WBCircuit
+
+
+def _ensure_row(key):
+    """Создать строку предохранителя для пары, если ее еще нет"""
+    try:
+        WBCircuit.objects.get_or_create(key=key)
+    except IntegrityError:
+        pass  # Строку только что создал другой процесс
+
+
+def is_open(token, endpoint):
+    """Отключена ли пара (открыт или идет пробный запрос)"""
+    return WBCircuit.objects.filter(key=f"{token}:{endpoint}").exclude(state='closed').exists()
+
+
+def open_endpoints(token):
+    """Отключенные эндпоинты токена"""
+    return [
+        key.split(':', 1)[1]
+        for key in WBCircuit.objects.filter(key__startswith=f"{token}:").exclude(state='closed').values_list('key', flat=True)
+    ]
+
+
+def record_success(token, endpoint):
+    """Успешный запрос: сбросить счетчик ошибок и включить пару"""
+    WBCircuit.objects.filter(key=f"{token}:{endpoint}").exclude(state='closed', failures=0).update(
+        state='closed', failures=0, last_error='', opened_at=None
+    )
+
+
+def record_failure(token, endpoint, error):
+    """Ошибка запроса: после порога ошибок подряд - отключить пару
+
+    Каждая следующая неудача (в том числе пробного запроса) удваивает паузу
+    до следующей проверки, но не больше чем в 32 раза.
+    """
+    key = f"{token}:{endpoint}"
+    _ensure_row(key)
+    with transaction.atomic():
+        rows = WBCircuit.objects.filter(key=key)
+        rows.update(failures=F('failures') + 1, last_error=str(error)[:500])
+        failures = rows.values_list('failures', flat=True).get()
+        if failures < settings.WB_CIRCUIT_FAILURES:
+            return False
+        cooldown = settings.WB_CIRCUIT_COOLDOWN * 2 ** min(failures - settings.WB_CIRCUIT_FAILURES, 5)
+        opened = rows.filter(state='closed').update(state='open', opened_at=timezone.now())
+        rows.update(state='open', retry_at=time.time() + cooldown)
+    if opened:
+        print(f"🔌 {endpoint}: отключен после {failures} ошибок подряд, проверка через {cooldown:.0f} сек")
+    return True
+
+
+def due_probes():
+    """Отключенные пары, которые пора проверить: [(хэш токена, эндпоинт)]"""
+    keys = WBCircuit.objects.exclude(state='closed').filter(retry_at__lte=time.time()).values_list('key', flat=True)
+    return [tuple(key.split(':', 1)) for key in keys]
+
+
+def start_probe(token, endpoint):
+    """Занять пробный запрос для пары (ровно один воркер); False - проверять не нужно или уже проверяют"""
+    # Аренда пробы на время паузы: если воркер упадет, пару проверит следующий запуск
+    return bool(
+        WBCircuit.objects.filter(key=f"{token}:{endpoint}", retry_at__lte=time.time())
+        .exclude(state='closed')
+        .update(state='half_open', retry_at=time.time() + settings.WB_CIRCUIT_COOLDOWN)
+    )
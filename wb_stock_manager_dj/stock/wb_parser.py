@@ -1,181 +1,332 @@
 # stock/wb_simple_service.py
 import requests
-import json
-from datetime import datetime, timedelta
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
 import time
-from django.core.cache import cache
+import numpy as np
+from requests.adapters import HTTPAdapter
 from django.conf import settings
+from django.db import connections
+from django.db.models import Q, Sum
+from django.db.models.functions import Coalesce
+
+from .wb_cache import single_flight, invalidate, stale_while_revalidate, refresh, get_entry
+from .wb_ratelimit import token_key, wait_for_slot, penalize, parse_retry_after
+from .wb_circuit import is_open, record_success, record_failure, start_probe
+from .models import Product
+from .wb_records import (
+    RecordBatch, iter_json_array, cancellation_mask, article_breakdown,
+    price_with_discount, article_name, display_time
+)
+
+_session = None
+_session_lock = threading.Lock()
+_executor = None
+
+# Эндпоинты, которые загружаются для аналитики за сегодня, и их параметры
+# (сюда же добавляются stocks / incomes - они загрузятся параллельно с остальными)
+TODAY_ENDPOINTS = {
+    'orders': {'flag': 1},
+    'sales': {'flag': 1},
+}
+# Эти эндпоинты разбираются потоково в RecordBatch, а не в список словарей
+COMPACT_ENDPOINTS = ('orders', 'sales')
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def get_wb_session():
+    """Общая на процесс HTTP-сессия для API WB
+
+    Одна сессия на всех пользователей: соединения (TCP + TLS) держатся в пуле
+    и переиспользуются между запросами, число соединений к одному хосту
+    ограничено settings.WB_API_POOL_SIZE. Токен передается в заголовках
+    каждого запроса, поэтому сессия не хранит данных пользователя.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=settings.WB_API_POOL_HOSTS,
+                    pool_maxsize=settings.WB_API_POOL_SIZE,
+                    pool_block=True  # Не больше pool_maxsize соединений на хост - остальные ждут
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({
+                    'Accept': 'application/json',
+                    'Accept-Encoding': 'gzip, deflate',
+                    'Connection': 'keep-alive',
+                })
+                _session = session
+    return _session
+
+
+def get_wb_executor():
+    """Общий пул потоков для параллельной загрузки эндпоинтов WB"""
+    global _executor
+    if _executor is None:
+        with _session_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.WB_API_FETCH_WORKERS,
+                    thread_name_prefix='wb-fetch'
+                )
+    return _executor
+
 
 class WBSimpleService:
     def __init__(self, api_token):
         self.api_token = api_token
+        self.token_key = token_key(api_token)  # Ключ в общем реестре лимитов
         self.base_url = "https://statistics-api.wildberries.ru/api/v1/supplier"
+        # Заголовки конкретного пользователя - передаются с каждым запросом общей сессии
         self.headers = {
             "Authorization": f"Bearer {api_token}",
-            "Content-Type": "application/json"
         }
     
     def get_cache_key(self, user_id):
         """Генерируем ключ для кэша на основе пользователя"""
         return f"wb_today_data_{user_id}"
     
-    def make_request_with_retry(self, endpoint, params, max_retries=3):
-        """Делаем запрос с повторными попытками"""
+    def make_request_with_retry(self, endpoint, params, max_retries=3, deadline=None, probe=False, parse=None):
+        """Делаем запрос с повторными попытками
+
+        deadline - момент time.monotonic(), после которого новые попытки
+        не начинаются, а ожидание ответа обрезается по оставшемуся времени.
+        Перед каждой попыткой занимаем слот в общем реестре лимитов
+        (wb_ratelimit), чтобы все процессы вместе не превышали квоту токена.
+        Если эндпоинт отключен предохранителем (wb_circuit), сразу возвращаем
+        None; probe=True - пробный запрос воркера, он идет в обход.
+        parse - функция от итератора строк ответа: тогда ответ читается
+        потоково и целиком в память не загружается.
+        """
         url = f"{self.base_url}/{endpoint}"
+        connect_timeout, read_timeout = settings.WB_API_TIMEOUT
         
         for attempt in range(max_retries):
+            if not probe and is_open(self.token_key, endpoint):
+                print(f"🔌 {endpoint}: WB API временно отключен после ошибок, запрос не отправляем")
+                return None
+            if not wait_for_slot(self.token_key, endpoint, deadline):
+                print(f"⏳ {endpoint}: свободный слот лимита WB будет позже дедлайна")
+                return None
+            
+            timeout = (connect_timeout, read_timeout)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"⏳ {endpoint}: время на загрузку истекло")
+                    return None
+                timeout = (min(connect_timeout, remaining), min(read_timeout, remaining))
             try:
-                response = requests.get(url, headers=self.headers, params=params, timeout=30)
-                
-                if response.status_code == 429:
-                    wait_time = (2 ** attempt) * 5
-                    print(f"⏳ 429 Too Many Requests. Ждем {wait_time} секунд...")
-                    time.sleep(wait_time)
-                    continue
-                
-                response.raise_for_status()
-                return response.json()
+                response = get_wb_session().get(
+                    url, headers=self.headers, params=params, timeout=timeout, stream=parse is not None
+                )
+                with response:
+                    if response.status_code == 429:
+                        # Сообщаем реестру: следующие слоты для токена - не раньше, чем разрешит WB
+                        retry_after = parse_retry_after(response, default=(2 ** attempt) * 5)
+                        penalize(self.token_key, endpoint, retry_after)
+                        print(f"⏳ 429 Too Many Requests ({endpoint}). WB просит подождать {retry_after:.0f} сек")
+                        continue
+                    
+                    response.raise_for_status()
+                    if parse is None:
+                        data = response.json()
+                    else:
+                        data = parse(iter_json_array(response.iter_content(chunk_size=STREAM_CHUNK_SIZE)))
+                record_success(self.token_key, endpoint)
+                return data
                 
-            except requests.exceptions.RequestException as e:
+            except (requests.exceptions.RequestException, ValueError) as e:
                 print(f"❌ Ошибка при запросе {endpoint} (попытка {attempt + 1}): {e}")
-                if attempt == max_retries - 1:
+                opened = record_failure(self.token_key, endpoint, e)
+                if opened or probe or attempt == max_retries - 1:
                     return None
                 time.sleep(2)
         
         return None
     
-    def get_orders_today(self):
-        """Получить заказы за сегодня"""
+    def get_today(self, endpoint, deadline=None, probe=False):
+        """Получить данные эндпоинта за сегодня"""
         today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
         date_from = today.strftime("%Y-%m-%d")
         
-        params = {"dateFrom": date_from, "flag": 1}
-        return self.make_request_with_retry("orders", params)
+        params = {"dateFrom": date_from, **TODAY_ENDPOINTS.get(endpoint, {})}
+        parse = RecordBatch.from_rows if endpoint in COMPACT_ENDPOINTS else None
+        if probe:
+            return self.make_request_with_retry(endpoint, params, max_retries=1, probe=True, parse=parse)
+        return self.make_request_with_retry(endpoint, params, deadline=deadline, parse=parse)
+    
+    def probe(self, endpoint):
+        """Пробный запрос к отключенному эндпоинту (только из фонового воркера)
+
+        Возвращает None, если проверять не нужно или пару уже проверяет
+        другой воркер, иначе - удалось ли включить эндпоинт.
+        """
+        if not start_probe(self.token_key, endpoint):
+            return None
+        return self.get_today(endpoint, probe=True) is not None
+    
+    def get_orders_today(self):
+        """Получить заказы за сегодня"""
+        return self.get_today("orders")
     
     def get_sales_today(self):
         """Получить продажи за сегодня"""
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        date_from = today.strftime("%Y-%m-%d")
+        return self.get_today("sales")
+    
+    def _fetch_in_thread(self, endpoint, deadline):
+        """Загрузка эндпоинта в потоке пула (реестр лимитов в базе - закрываем соединение)"""
+        try:
+            return self.get_today(endpoint, deadline)
+        finally:
+            connections.close_all()
+    
+    def fetch_today(self, endpoints=None, timeout=None):
+        """Параллельно загрузить данные за сегодня по нескольким эндпоинтам
+
+        Все запросы идут одновременно, общее время ограничено timeout
+        (по умолчанию settings.WB_TODAY_DEADLINE). Возвращает
+        {эндпоинт: данные или None}: None - эндпоинт не ответил вовремя
+        или с ошибкой, остальные результаты при этом не теряются.
+        """
+        endpoints = list(endpoints or TODAY_ENDPOINTS)
+        timeout = settings.WB_TODAY_DEADLINE if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        
+        executor = get_wb_executor()
+        futures = {
+            executor.submit(self._fetch_in_thread, endpoint, deadline): endpoint
+            for endpoint in endpoints
+        }
+        done, not_done = wait(futures, timeout=timeout)
         
-        params = {"dateFrom": date_from, "flag": 1}
-        return self.make_request_with_retry("sales", params)
+        results = {endpoint: None for endpoint in endpoints}
+        for future in done:
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                print(f"❌ Ошибка загрузки {futures[future]}: {e}")
+        for future in not_done:
+            # Поток сам завершится по дедлайну, ждать его не нужно
+            future.cancel()
+            print(f"⏳ {futures[future]}: не успели загрузить за {timeout} сек")
+        return results
     
     def get_price_with_discount(self, item):
         """Получить правильную цену"""
-        price_fields = ['priceWithDisc', 'finishedPrice', 'totalPrice', 'price']
-        for field in price_fields:
-            if field in item and item[field] is not None:
-                price = float(item[field])
-                return abs(price)
-        return 0
+        return price_with_discount(item)
     
     def get_article_name(self, item):
         """Получить название товара"""
-        if 'subject' in item and item['subject']:
-            name = item['subject']
-            if 'brand' in item and item['brand']:
-                name = f"{item['brand']} - {name}"
-            return name
-        elif 'techSize' in item and 'nmId' in item:
-            return f"Арт. {item['nmId']} (разм. {item['techSize']})"
-        elif 'nmId' in item:
-            return f"Арт. {item['nmId']}"
-        else:
-            return "Неизвестный товар"
+        return article_name(item)
     
     def get_article_code(self, item):
         """Получить артикул"""
         return item.get('nmId', 'N/A')
     
-    def filter_real_sales(self, sales):
-        """Фильтрует реальные выкупы и возвраты"""
-        real_sales = []
-        returns = []
-        
-        for sale in sales:
-            original_price = sale.get('priceWithDisc', 0) or sale.get('finishedPrice', 0) or sale.get('totalPrice', 0) or 0
-            
-            if original_price < 0:
-                returns.append(sale)
-            else:
-                real_sales.append(sale)
-        
-        return real_sales, returns
+    def analyze_today_data(self, user_id):
+        """Анализ данных только за сегодня с кэшированием
+
+        Кэш общий для всех процессов; при устаревании данные у WB
+        запрашивает только один из них (см. wb_cache.single_flight).
+        None - WB недоступен, а прежних данных в кэше уже нет.
+        """
+        entry = single_flight(self.get_cache_key(user_id), lambda: self.compute_today_data(user_id))
+        return entry['value'] if entry is not None else None
     
-    def find_cancellations_from_orders(self, orders, real_sales):
-        """Находит отказы сравнивая заказы и выкупы - ИСПРАВЛЕННАЯ ЛОГИКА"""
-        if not orders:
-            return []
-        
-        # Собираем ID всех ВЫКУПЛЕННЫХ заказов
-        sold_order_ids = set()
-        for sale in real_sales:
-            # Используем odid для сопоставления с заказами
-            order_id = sale.get('odid')
-            if order_id:
-                sold_order_ids.add(str(order_id))
-        
-        print(f"🔍 Найдено выкупленных заказов: {len(sold_order_ids)}")
-        print(f"🔍 Всего заказов: {len(orders)}")
-        
-        # Отказами считаем заказы, которых НЕТ в выкупах
-        cancellations = []
-        for order in orders:
-            order_id = str(order.get('odid', ''))
-            # Если заказ есть в orders, но нет в sold_order_ids - это отказ
-            if order_id and order_id not in sold_order_ids:
-                cancellations.append(order)
-        
-        print(f"🔍 Найдено отказов: {len(cancellations)}")
-        
-        # Дополнительная проверка: выводим первые несколько ID для отладки
-        if orders and real_sales:
-            sample_order_ids = [str(order.get('odid', '')) for order in orders[:3]]
-            sample_sale_ids = [str(sale.get('odid', '')) for sale in real_sales[:3]]
-            print(f"📋 Пример ID заказов: {sample_order_ids}")
-            print(f"📋 Пример ID выкупов: {sample_sale_ids}")
-        
-        return cancellations
+    def get_today_snapshot(self, user_id):
+        """Последние данные за сегодня без ожидания WB
+
+        Возвращает (данные или None, когда обновлены, идет ли обновление).
+        Устаревшие данные обновляются в фоне - страница их не ждет.
+        """
+        entry, refreshing = stale_while_revalidate(
+            self.get_cache_key(user_id), lambda: self.compute_today_data(user_id)
+        )
+        if entry is None or entry['value'] is None:
+            return None, None, refreshing
+        return entry['value'], datetime.fromtimestamp(entry['created_at'], tz=timezone.utc), refreshing
     
-    def analyze_today_data(self, user_id):
-        """Анализ данных только за сегодня с кэшированием"""
+    def rewarm_today_data(self, user_id, ahead=0):
+        """Обновить данные заранее, если они устареют в ближайшие ahead секунд
+
+        Возвращает True, если данные пересчитаны.
+        """
         cache_key = self.get_cache_key(user_id)
+        entry = get_entry(cache_key)
+        if entry is not None and entry['expires_at'] - time.time() > ahead:
+            return False
+        return refresh(cache_key, lambda: self.compute_today_data(user_id)) is not None
+    
+    def join_products(self, user_id, rows):
+        """Дополнить строки разбивки товаром пользователя и запасом в днях
+
+        Товары ищутся одним запросом по индексу (user, article), остаток
+        считается там же агрегацией движений. Запас в днях - остаток,
+        деленный на темп выкупов за прошедшую часть дня.
+        """
+        incoming = Coalesce(Sum('movements__quantity', filter=Q(movements__movement_type='in')), 0)
+        outgoing = Coalesce(Sum('movements__quantity', filter=Q(movements__movement_type='out')), 0)
+        products = {
+            article: (product_id, name, initial + added - removed)
+            for article, product_id, name, initial, added, removed in Product.objects.filter(
+                user_id=user_id, article__in=[str(row['nm_id']) for row in rows]
+            ).annotate(incoming=incoming, outgoing=outgoing).values_list(
+                'article', 'id', 'name', 'initial_quantity', 'incoming', 'outgoing'
+            )
+        }
         
-        # Пробуем получить данные из кэша
-        cached_data = cache.get(cache_key)
-        if cached_data is not None:
-            print(f"📦 Данные из кэша для пользователя {user_id}")
-            return cached_data
-        
+        now = datetime.now()
+        # Не меньше часа, чтобы первые заказы после полуночи не давали нереальный темп
+        day_share = max((now - now.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds(), 3600) / 86400
+        for row in rows:
+            product_id, product_name, stock = products.get(str(row['nm_id']), (None, None, None))
+            row['product_id'] = product_id
+            row['product_name'] = product_name
+            row['stock'] = stock
+            row['days_of_cover'] = stock / (row['sales'] / day_share) if stock is not None and row['sales'] else None
+        return rows
+    
+    def compute_today_data(self, user_id):
+        """Загрузить и посчитать данные за сегодня: (результат, время жизни в кэше)"""
         print(f"🔍 Загрузка данных за сегодня для пользователя {user_id}")
         
         try:
-            # Получаем данные за сегодня
-            orders = self.get_orders_today() or []
-            all_sales = self.get_sales_today() or []
+            # Получаем данные за сегодня (все эндпоинты параллельно)
+            fetched = self.fetch_today()
+            missing = [endpoint for endpoint, data in fetched.items() if data is None]
+            if len(missing) == len(fetched):
+                raise RuntimeError("WB API не ответил вовремя")
+            orders = fetched['orders'] if fetched['orders'] is not None else RecordBatch.empty()
+            all_sales = fetched['sales'] if fetched['sales'] is not None else RecordBatch.empty()
             
             print(f"📊 Получено за сегодня: {len(orders)} заказов, {len(all_sales)} продаж")
+            if missing:
+                print(f"⚠️ Неполные данные, не загружено: {', '.join(missing)}")
             
-            # Фильтруем выкупы от возвратов
-            real_sales, returns_from_sales = self.filter_real_sales(all_sales)
-            all_returns = returns_from_sales
-            
-            print(f"📊 После фильтрации: {len(real_sales)} выкупов, {len(all_returns)} возвратов")
-            
-            # Находим отказы - ИСПРАВЛЕННАЯ ЛОГИКА
-            cancellations = self.find_cancellations_from_orders(orders, real_sales)
+            # Все показатели - векторными операциями по колонкам, без проходов по строкам
+            sales_mask = ~all_sales.returned
+            returns_mask = all_sales.returned
+            # Отказы - заказы без выкупа; без продаж их не посчитать (каждый заказ выглядел бы отказом)
+            if 'sales' in missing:
+                cancellations_mask = np.zeros(len(orders), dtype=bool)
+            else:
+                cancellations_mask = cancellation_mask(orders, all_sales, sales_mask)
+            orders_mask = np.ones(len(orders), dtype=bool)
             
-            # Статистика
-            total_orders = len(orders)
-            total_sales = len(real_sales)
-            total_cancellations = len(cancellations)
-            total_returns = len(all_returns)
+            total_orders, orders_sum = orders.total(orders_mask)
+            total_sales, sales_sum = all_sales.total(sales_mask)
+            total_cancellations, cancellations_sum = orders.total(cancellations_mask)
+            total_returns, returns_sum = all_sales.total(returns_mask)
             
-            # Суммы
-            orders_sum = sum(self.get_price_with_discount(order) for order in orders)
-            sales_sum = sum(self.get_price_with_discount(sale) for sale in real_sales)
-            cancellations_sum = sum(self.get_price_with_discount(order) for order in cancellations)
-            returns_sum = sum(self.get_price_with_discount(sale) for sale in all_returns)
+            # Разбивка по артикулам + остатки товаров пользователя
+            by_article = article_breakdown(orders, all_sales, sales_mask, cancellations_mask)
+            self.join_products(user_id, by_article)
             
             # Проценты
             conversion_rate = (total_sales / total_orders * 100) if total_orders > 0 else 0
@@ -188,54 +339,47 @@ class WBSimpleService:
             print(f"   Возвраты: {total_returns} на {returns_sum:.0f} руб.")
             print(f"   Конверсия: {conversion_rate:.1f}%")
             
-            # Форматируем данные для отображения (только первые 8)
-            def format_items_for_display(items, limit=8):
-                formatted = []
-                for item in items[:limit]:
-                    formatted.append({
-                        'id': item.get('odid') or item.get('srid', 'N/A'),
-                        'article': self.get_article_code(item),
-                        'name': self.get_article_name(item),
-                        'price': self.get_price_with_discount(item),
-                        'date': self.format_display_date(item.get('date', ''))
-                    })
-                return formatted
-            
             result = {
                 'date': datetime.now().strftime("%d.%m.%Y"),
                 'orders': {
                     'count': total_orders,
                     'sum': orders_sum,
-                    'data': format_items_for_display(orders)
+                    'data': orders.display(orders_mask)
                 },
                 'sales': {
                     'count': total_sales,
                     'sum': sales_sum,
-                    'data': format_items_for_display(real_sales)
+                    'data': all_sales.display(sales_mask)
                 },
                 'cancellations': {
                     'count': total_cancellations,
                     'sum': cancellations_sum,
-                    'data': format_items_for_display(cancellations)
+                    'data': orders.display(cancellations_mask)
                 },
                 'returns': {
                     'count': total_returns,
                     'sum': returns_sum,
-                    'data': format_items_for_display(all_returns)
+                    'data': all_sales.display(returns_mask)
                 },
                 'conversion_rate': conversion_rate,
                 'cancellation_rate': cancellation_rate,
+                'by_article': by_article,
+                'missing': missing,
                 'success': True
             }
             
-            # Сохраняем в кэш на 20 минут
-            cache.set(cache_key, result, 60 * 20)
-            print(f"💾 Сохранено в кэш на 20 минут")
+            # Полные данные - в кэш на 20 минут, неполные - на 5, чтобы скорее догрузить
+            timeout = 60 * 5 if missing else 60 * 20
+            print(f"💾 Сохранено в кэш на {timeout // 60} минут")
             
-            return result
+            return result, timeout
             
         except Exception as e:
             print(f"❌ Ошибка анализа: {e}")
+            previous = get_entry(self.get_cache_key(user_id))
+            if previous is not None and (previous['value'] or {}).get('success'):
+                # WB недоступен - продолжаем показывать последние хорошие данные
+                return None, 60 * 5
             error_result = {
                 'success': False,
                 'error': str(e),
@@ -248,17 +392,11 @@ class WBSimpleService:
                 'cancellation_rate': 0
             }
             # Даже ошибку кэшируем на 5 минут, чтобы не спамить API
-            cache.set(cache_key, error_result, 60 * 5)
-            return error_result
+            return error_result, 60 * 5
     
     def format_display_date(self, date_str):
         """Форматирование даты для отображения"""
-        try:
-            clean_date = date_str.replace('Z', '')
-            date_obj = datetime.fromisoformat(clean_date)
-            return date_obj.strftime("%H:%M")
-        except:
-            return date_str
+        return display_time(date_str)
 
 def get_wb_simple_service(user):
     """Получить сервис для пользователя"""
@@ -271,12 +409,20 @@ def get_wb_simple_service(user):
         print(f"❌ Ошибка получения сервиса: {e}")
     return None
 
+def mark_analytics_viewed(user):
+    """Отметить, что пользователь смотрел аналитику (для прогрева кэша по расписанию)"""
+    from .models import UserProfile
+    now = datetime.now(timezone.utc)
+    # Пишем не чаще раза в 5 минут, чтобы не обновлять профиль на каждый просмотр
+    UserProfile.objects.filter(user=user).exclude(
+        analytics_viewed_at__gte=now - timedelta(minutes=5)
+    ).update(analytics_viewed_at=now)
+
 def clear_wb_cache(user):
-    """Очистить кэш для пользователя"""
+    """Очистить кэш для пользователя (во всех процессах)"""
     try:
         service = WBSimpleService("dummy")  # Просто для получения ключа
-        cache_key = service.get_cache_key(user.id)
-        cache.delete(cache_key)
+        invalidate(service.get_cache_key(user.id))
         print(f"🧹 Кэш очищен для пользователя {user.id}")
     except Exception as e:
         print(f"❌ Ошибка очистки кэша: {e}")
\ No newline at end of file
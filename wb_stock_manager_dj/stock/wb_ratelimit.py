@@ -0,0 +1,98 @@
+# stock/wb_ratelimit.py
+# Общий для всех процессов планировщик запросов к API статистики WB.
+# Лимиты WB считаются на токен и эндпоинт, поэтому и слоты выдаются по паре
+# (токен, эндпоинт). Состояние хранится в базе (WBRateLimit): каждый процесс
+# атомарно занимает следующий свободный слот и ждет его, а не ловит 429.
+import hashlib
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .models import WBRateLimit
+
+
+def token_key(api_token):
+    """Ключ токена для реестра: сам токен в базу не пишем"""
+    return hashlib.sha256(api_token.encode()).hexdigest()[:16]
+
+
+def get_interval(endpoint):
+    """Минимальный интервал между запросами к эндпоинту одним токеном (сек)"""
+    return settings.WB_API_RATE_LIMITS.get(endpoint, settings.WB_API_DEFAULT_INTERVAL)
+
+
+def _ensure_row(key):
+    """Создать строку реестра для пары, если ее еще нет"""
+    try:
+        WBRateLimit.objects.get_or_create(key=key)
+    except IntegrityError:
+        pass  # Строку только что создал другой процесс
+
+
+def reserve(token, endpoint, max_wait=None):
+    """Занять ближайший слот для запроса
+
+    Возвращает, сколько секунд ждать до слота, или None, если ждать
+    пришлось бы дольше max_wait (слот тогда не занимается).
+    """
+    key = f"{token}:{endpoint}"
+    interval = get_interval(endpoint)
+    _ensure_row(key)
+    with transaction.atomic():
+        now = time.time()
+        rows = WBRateLimit.objects.filter(key=key)
+        # Один UPDATE: строка блокируется до конца транзакции, слоты не пересекаются
+        rows.update(next_at=Greatest(F('next_at'), Value(now)) + interval)
+        slot = rows.values_list('next_at', flat=True).get() - interval
+        wait = slot - now
+        if max_wait is not None and wait > max_wait:
+            rows.update(next_at=F('next_at') - interval)
+            return None
+    return max(wait, 0)
+
+
+def wait_for_slot(token, endpoint, deadline=None):
+    """Дождаться своего слота для запроса
+
+    deadline - момент time.monotonic(); False, если слот будет позже него.
+    Если пока ждали, кто-то получил 429, занятый слот недействителен -
+    занимаем новый после окончания блокировки.
+    """
+    key = f"{token}:{endpoint}"
+    while True:
+        max_wait = None if deadline is None else deadline - time.monotonic()
+        wait = reserve(token, endpoint, max_wait)
+        if wait is None:
+            return False
+        if wait > 0:
+            print(f"⏳ {endpoint}: ждем слот лимита WB {wait:.1f} сек")
+            time.sleep(wait)
+        blocked_until = WBRateLimit.objects.filter(key=key).values_list('blocked_until', flat=True).get()
+        if blocked_until <= time.time():
+            return True
+
+
+def penalize(token, endpoint, retry_after):
+    """WB ответил 429: не выдавать слоты этой паре еще retry_after секунд"""
+    key = f"{token}:{endpoint}"
+    until = time.time() + retry_after
+    _ensure_row(key)
+    WBRateLimit.objects.filter(key=key).update(
+        next_at=Greatest(F('next_at'), Value(until)),
+        blocked_until=Greatest(F('blocked_until'), Value(until))
+    )
+
+
+def parse_retry_after(response, default):
+    """Сколько ждать после 429: Retry-After или X-Ratelimit-Retry из ответа WB"""
+    for header in ('Retry-After', 'X-Ratelimit-Retry'):
+        value = response.headers.get(header)
+        if value:
+            try:
+                return max(float(value), 0)
+            except ValueError:
+                continue
+    return default
@@ -0,0 +1,219 @@
+# stock/wb_records.py
+# Компактное представление строк orders / sales из API статистики WB.
+# Ответ разбирается потоково (по одному объекту), из каждой строки берутся
+# только нужные для аналитики поля и складываются в колонки NumPy -
+# полный список словарей в памяти не держится.
+import codecs
+import json
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+PRICE_FIELDS = ['priceWithDisc', 'finishedPrice', 'totalPrice', 'price']
+MISSING_ID = -1  # Поля odid / nmId нет в строке
+
+
+def iter_json_array(chunks):
+    """Потоковый разбор JSON-массива: объекты по одному по мере получения байтов"""
+    text = codecs.getincrementaldecoder('utf-8')()
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    for chunk in chunks:
+        buffer += text.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer.startswith('null', pos):
+                    return  # WB отвечает null, когда данных нет
+                if buffer[pos] != '[':
+                    raise ValueError(f"Ожидался JSON-массив, получено: {buffer[pos:pos + 50]!r}")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                item, pos_end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # Объект пришел не целиком - ждем следующий кусок
+            yield item
+            pos = pos_end
+        buffer = buffer[pos:]
+    if started or buffer.strip():
+        raise ValueError("Ответ WB оборвался посреди JSON")
+
+
+def price_with_discount(item):
+    """Цена строки: первое заполненное из PRICE_FIELDS, по модулю"""
+    for field in PRICE_FIELDS:
+        if item.get(field) is not None:
+            return abs(float(item[field]))
+    return 0
+
+
+def article_name(item):
+    """Название товара"""
+    if item.get('subject'):
+        name = item['subject']
+        if item.get('brand'):
+            name = f"{item['brand']} - {name}"
+        return name
+    elif 'techSize' in item and 'nmId' in item:
+        return f"Арт. {item['nmId']} (разм. {item['techSize']})"
+    elif 'nmId' in item:
+        return f"Арт. {item['nmId']}"
+    return "Неизвестный товар"
+
+
+def display_time(date_str):
+    """Время из даты WB для отображения (ЧЧ:ММ)"""
+    try:
+        return datetime.fromisoformat(date_str.replace('Z', '')).strftime("%H:%M")
+    except (AttributeError, TypeError, ValueError):
+        return date_str
+
+
+def is_return(item):
+    """Возврат - отрицательная цена в строке продаж"""
+    original_price = item.get('priceWithDisc', 0) or item.get('finishedPrice', 0) or item.get('totalPrice', 0) or 0
+    return original_price < 0
+
+
+class RecordBatch:
+    """Строки orders / sales в колонках NumPy
+
+    odid и nm_id - int64 (MISSING_ID, если поля нет; None -> 0), price -
+    цена по модулю, returned - строка продаж с отрицательной ценой.
+    Названия и время хранятся индексами в общей таблице строк, srid -
+    списком (нужен только для отображения строк без odid).
+    """
+
+    __slots__ = ('odid', 'nm_id', 'price', 'returned', 'name', 'time', 'srid', 'strings')
+
+    def __init__(self, odid, nm_id, price, returned, name, time, srid, strings):
+        self.odid = odid
+        self.nm_id = nm_id
+        self.price = price
+        self.returned = returned
+        self.name = name
+        self.time = time
+        self.srid = srid
+        self.strings = strings
+
+    def __len__(self):
+        return len(self.price)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Собрать пачку из итератора строк (словари отбрасываются сразу после разбора)"""
+        odid, nm_id, price = array('q'), array('q'), array('d')
+        returned, name, time = array('b'), array('i'), array('i')
+        srid, strings, index = [], [], {}
+
+        def intern(value):
+            position = index.get(value)
+            if position is None:
+                position = index[value] = len(strings)
+                strings.append(value)
+            return position
+
+        for item in rows:
+            value = item.get('odid', MISSING_ID)
+            odid.append(int(value or 0))
+            nm_id.append(int(item.get('nmId', MISSING_ID) or 0))
+            price.append(price_with_discount(item))
+            returned.append(is_return(item))
+            name.append(intern(article_name(item)))
+            time.append(intern(display_time(item.get('date', ''))))
+            srid.append(item.get('srid'))
+
+        return cls(
+            np.frombuffer(odid, dtype=np.int64), np.frombuffer(nm_id, dtype=np.int64),
+            np.frombuffer(price, dtype=np.float64), np.frombuffer(returned, dtype=np.int8).astype(bool),
+            np.frombuffer(name, dtype=np.int32), np.frombuffer(time, dtype=np.int32),
+            srid, strings
+        )
+
+    @classmethod
+    def empty(cls):
+        """Пустая пачка (эндпоинт не ответил)"""
+        return cls.from_rows([])
+
+    def total(self, mask):
+        """Количество и сумма строк по маске"""
+        return int(np.count_nonzero(mask)), float(self.price[mask].sum())
+
+    def display(self, mask, limit=8):
+        """Первые limit строк по маске в виде для шаблона"""
+        rows = []
+        for i in np.flatnonzero(mask)[:limit]:
+            odid, nm_id = int(self.odid[i]), int(self.nm_id[i])
+            rows.append({
+                'id': odid if odid > 0 else (self.srid[i] or 'N/A'),
+                'article': nm_id if nm_id != MISSING_ID else 'N/A',
+                'name': self.strings[self.name[i]],
+                'price': float(self.price[i]),
+                'date': self.strings[self.time[i]],
+            })
+        return rows
+
+
+def cancellation_mask(orders, sales, sold_mask):
+    """Отказы: заказы, odid которых нет среди выкупов"""
+    sold_ids = sales.odid[sold_mask]
+    sold_ids = sold_ids[sold_ids > 0]
+    return (orders.odid != MISSING_ID) & ~np.isin(orders.odid, sold_ids)
+
+
+def article_breakdown(orders, sales, sold_mask, cancel_mask):
+    """Показатели по артикулам (nmId) одной группировкой по колонкам
+
+    Заказы и продажи сводятся к общим номерам групп (np.unique), суммы
+    считаются np.bincount. Строки отсортированы по заказам и выручке.
+    """
+    nm_ids, inverse = np.unique(np.concatenate([orders.nm_id, sales.nm_id]), return_inverse=True)
+    order_group, sale_group = inverse[:len(orders)], inverse[len(orders):]
+    size = len(nm_ids)
+
+    def count(groups, mask):
+        return np.bincount(groups[mask], minlength=size)
+
+    def amount(groups, batch, mask):
+        return np.bincount(groups[mask], weights=batch.price[mask], minlength=size)
+
+    all_orders = np.ones(len(orders), dtype=bool)
+    columns = {
+        'orders': count(order_group, all_orders),
+        'orders_sum': amount(order_group, orders, all_orders),
+        'sales': count(sale_group, sold_mask),
+        'sales_sum': amount(sale_group, sales, sold_mask),
+        'cancellations': count(order_group, cancel_mask),
+        'cancellations_sum': amount(order_group, orders, cancel_mask),
+        'returns': count(sale_group, sales.returned),
+        'returns_sum': amount(sale_group, sales, sales.returned),
+    }
+    columns['revenue'] = columns['sales_sum'] - columns['returns_sum']
+
+    # Название группы - из первой строки артикула (заказы приоритетнее продаж)
+    names = {}
+    for batch, groups in ((sales, sale_group), (orders, order_group)):
+        first_groups, first_rows = np.unique(groups, return_index=True)
+        names.update(zip(first_groups.tolist(), (batch.strings[batch.name[row]] for row in first_rows)))
+
+    rows = []
+    for group in np.lexsort((-columns['revenue'], -columns['orders'])):
+        nm_id = int(nm_ids[group])
+        if nm_id <= 0:
+            continue  # Строки без nmId в разбивку не попадают
+        row = {'nm_id': nm_id, 'name': names[int(group)]}
+        for column, values in columns.items():
+            row[column] = values[group].item()
+        row['conversion_rate'] = row['sales'] / row['orders'] * 100 if row['orders'] else 0
+        rows.append(row)
+    return rows
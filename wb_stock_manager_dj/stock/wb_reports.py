@@ -0,0 +1,143 @@
+# stock/wb_reports.py
+# Отчеты по продажам за произвольный период из локальных WBOrder / WBSale.
+# Все показатели считаются векторно (pandas), без циклов по отдельным заказам.
+from datetime import datetime, time, timedelta
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .models import WBOrder, WBSale, WBSyncCursor
+
+ORDER_COLUMNS = ['date', 'nm_id', 'price', 'is_cancel', 'subject', 'brand', 'supplier_article']
+SALE_COLUMNS = ['date', 'nm_id', 'price', 'is_return', 'subject', 'brand', 'supplier_article']
+
+
+def get_data_version(user_id):
+    """Версия локальных данных пользователя - меняется, когда синхронизация приносит изменения"""
+    cursors = WBSyncCursor.objects.filter(user_id=user_id).order_by('endpoint').values_list('last_change_date', flat=True)
+    return '_'.join(str(int(value.timestamp())) if value else '0' for value in cursors) or '0'
+
+
+def _load(model, user_id, since, columns):
+    """Строки периода в DataFrame; цену приводим к float прямо в запросе"""
+    rows = model.objects.filter(user_id=user_id, date__gte=since).annotate(
+        price=Cast('price_with_disc', FloatField())
+    ).values_list(*columns)
+    frame = pd.DataFrame.from_records(list(rows), columns=columns)
+    # Дата в часовом поясе проекта (день заказа для продавца)
+    frame['day'] = pd.to_datetime(frame['date'], utc=True).dt.tz_convert(settings.TIME_ZONE).dt.date
+    return frame
+
+
+def _article_names(orders, sales):
+    """Название артикула: бренд - предмет (или Арт. nmId)"""
+    info = pd.concat([orders, sales])[['nm_id', 'subject', 'brand', 'supplier_article']]
+    info = info.drop_duplicates('nm_id').set_index('nm_id')
+    names = np.where(
+        info['subject'] != '',
+        np.where(info['brand'] != '', info['brand'] + ' - ' + info['subject'], info['subject']),
+        'Арт. ' + info.index.astype(str)
+    )
+    return pd.DataFrame({'name': names, 'supplier_article': info['supplier_article']}, index=info.index)
+
+
+def _totals(frame, mask, column='price'):
+    """Количество и сумма строк по маске"""
+    return {'count': int(mask.sum()), 'sum': float(frame.loc[mask, column].abs().sum())}
+
+
+def _compute_period(user_id, days, date_from):
+    """Посчитать отчет по локальным данным"""
+    since = timezone.make_aware(datetime.combine(date_from, time.min))
+    orders = _load(WBOrder, user_id, since, ORDER_COLUMNS)
+    sales = _load(WBSale, user_id, since, SALE_COLUMNS)
+
+    cancel_mask = orders['is_cancel'].astype(bool)
+    return_mask = sales['is_return'].astype(bool)
+    orders_total = _totals(orders, np.ones(len(orders), dtype=bool))
+    sales_total = _totals(sales, ~return_mask)
+    cancellations_total = _totals(orders, cancel_mask)
+    returns_total = _totals(sales, return_mask)
+    revenue = sales_total['sum'] - returns_total['sum']
+
+    orders_count = orders_total['count']
+    conversion_rate = sales_total['count'] / orders_count * 100 if orders_count else 0
+    cancellation_rate = cancellations_total['count'] / orders_count * 100 if orders_count else 0
+
+    # Разбивки: заказы и продажи сворачиваем одной группировкой каждые
+    orders = orders.assign(
+        cancelled=cancel_mask.astype(int),
+        cancelled_sum=orders['price'].abs().where(cancel_mask, 0.0),
+    )
+    sales = sales.assign(
+        sold=(~return_mask).astype(int),
+        sold_sum=sales['price'].abs().where(~return_mask, 0.0),
+        returned=return_mask.astype(int),
+        returned_sum=sales['price'].abs().where(return_mask, 0.0),
+    )
+    order_aggs = {
+        'orders': ('price', 'size'), 'orders_sum': ('price', 'sum'),
+        'cancellations': ('cancelled', 'sum'), 'cancellations_sum': ('cancelled_sum', 'sum'),
+    }
+    sale_aggs = {
+        'sales': ('sold', 'sum'), 'sales_sum': ('sold_sum', 'sum'),
+        'returns': ('returned', 'sum'), 'returns_sum': ('returned_sum', 'sum'),
+    }
+
+    by_article = orders.groupby('nm_id').agg(**order_aggs).join(
+        sales.groupby('nm_id').agg(**sale_aggs), how='outer'
+    ).fillna(0)
+    by_article['revenue'] = by_article['sales_sum'] - by_article['returns_sum']
+    by_article['conversion_rate'] = (by_article['sales'] / by_article['orders'].replace(0, np.nan) * 100).fillna(0)
+    by_article = by_article.join(_article_names(orders, sales)).sort_values(
+        ['orders', 'revenue'], ascending=False
+    )
+
+    all_days = [date_from + timedelta(days=offset) for offset in range(days)]
+    by_day = orders.groupby('day').agg(**order_aggs).join(
+        sales.groupby('day').agg(**sale_aggs), how='outer'
+    ).reindex(all_days, fill_value=0).fillna(0)
+    by_day['revenue'] = by_day['sales_sum'] - by_day['returns_sum']
+
+    count_columns = ['orders', 'cancellations', 'sales', 'returns']
+    by_article[count_columns] = by_article[count_columns].astype(int)
+    by_day[count_columns] = by_day[count_columns].astype(int)
+
+    return {
+        'success': True,
+        'period_days': days,
+        'date_from': date_from,
+        'date_to': all_days[-1],
+        'orders': orders_total,
+        'sales': sales_total,
+        'cancellations': cancellations_total,
+        'returns': returns_total,
+        'revenue': revenue,
+        'conversion_rate': conversion_rate,
+        'cancellation_rate': cancellation_rate,
+        'by_article': by_article.rename_axis('nm_id').reset_index().to_dict('records'),
+        'by_day': by_day.rename_axis('day').reset_index().to_dict('records'),
+    }
+
+
+def analyze_period_data(user_id, days):
+    """Отчет по продажам за последние days дней (включая сегодня)
+
+    Заказы, выкупы, отказы, возвраты, выручка, конверсия, разбивка по
+    артикулам и по дням. Результат кэшируется по (пользователь, период,
+    версия данных) - новая синхронизация сразу дает новый ключ.
+    """
+    date_from = timezone.localdate() - timedelta(days=days - 1)
+    cache_key = f"wb_period_{user_id}_{date_from}_{days}_v{get_data_version(user_id)}"
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    result = _compute_period(user_id, days, date_from)
+    cache.set(cache_key, result, 60 * 60)
+    return result
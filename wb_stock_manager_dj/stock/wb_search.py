@@ -0,0 +1,484 @@
+# stock/wb_search.py
+# Поиск позиций товаров в выдаче Wildberries.
+# Модуль не зависит от Django (только requests и стандартная библиотека).
+import asyncio
+import random
+import time
+from collections import defaultdict, deque, namedtuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .regions import DEFAULT_DEST
+from .search_cache import compact_product
+
+SEARCH_URL = 'https://search.wb.ru/exactmatch/ru/common/v4/search'
+PAGE_SIZE = 100
+
+# Чем закончился обход запроса в регионе
+WALK_COMPLETE = 'complete'  # Выдача закончилась или все нужное найдено
+WALK_LIMIT = 'limit'  # Дошли до лимита страниц, дальше выдача не просмотрена
+WALK_FAILED = 'failed'  # Страница не загрузилась - результат неизвестен
+
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/119.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+]
+
+
+class TokenBucket:
+    """Общий лимит запросов в секунду для всех одновременных загрузок"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Дождаться свободного токена"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HostBackoff:
+    """Пауза по хосту после 429/5xx, общая для всех загрузок"""
+
+    def __init__(self, base_delay=2, max_delay=60):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.blocked_until = {}
+
+    async def wait(self, host):
+        delay = self.blocked_until.get(host, 0) - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def penalize(self, host, attempt, retry_after=None):
+        """Запретить запросы к хосту на время Retry-After или экспоненциальной паузы"""
+        delay = retry_after if retry_after is not None else self.base_delay * (2 ** attempt)
+        delay = min(delay, self.max_delay)
+        until = time.monotonic() + delay
+        self.blocked_until[host] = max(self.blocked_until.get(host, 0), until)
+        return delay
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class NameAutomaton:
+    """Автомат Ахо-Корасик: все названия, входящие в строку, за один проход по ней
+
+    В отличие от регулярного выражения с альтернативами находит и
+    перекрывающиеся названия ("Shop" внутри "YalowShop").
+    """
+
+    def __init__(self, names):
+        self._goto = [{}]
+        self._fail = [0]
+        self._found = [[]]
+        for name in names:
+            state = 0
+            for char in name:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._found.append([])
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._found[state].append(name)
+
+        # Ссылки неудач - обходом в ширину от корня
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._found[child] = self._found[child] + self._found[self._fail[child]]
+                queue.append(child)
+
+    def find(self, text):
+        """Множество названий, которые входят в text"""
+        goto, fail, found = self._goto, self._fail, self._found
+        state, result = 0, set()
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if found[state]:
+                result.update(found[state])
+        return result
+
+
+# Совпадение в выдаче: чей товар, по какому ключевому слову и на какой позиции
+SearchHit = namedtuple('SearchHit', ['user', 'product', 'keyword', 'article', 'position', 'promo'])
+
+
+class SearchMatcher:
+    """Сопоставление страницы выдачи сразу со всеми отслеживаемыми товарами
+
+    Артикулы и ID поставщиков хранятся в хэш-таблицах, бренды - в словаре
+    по нормализованному названию, названия поставщиков (поиск подстроки) -
+    в одном автомате Ахо-Корасик, который находит все входящие названия,
+    в том числе вложенные друг в друга. Каждая страница разбирается за
+    один проход, независимо от числа пользователей.
+    """
+
+    def __init__(self):
+        self._articles = defaultdict(list)
+        self._suppliers = defaultdict(list)
+        self._brands = defaultdict(list)
+        self._supplier_names = defaultdict(list)
+        self._supplier_name_automaton = None
+
+    def track_article(self, article, user=None, product=None, keyword=None):
+        self._articles[str(article)].append((user, product, keyword))
+
+    def track_supplier(self, supplier_id, user=None, keyword=None):
+        self._suppliers[str(supplier_id)].append((user, None, keyword))
+
+    def track_brand(self, brand, user=None, keyword=None):
+        self._brands[brand.strip().casefold()].append((user, None, keyword))
+
+    def track_supplier_name(self, name, user=None, keyword=None):
+        name = name.strip().casefold()
+        if name:
+            self._supplier_names[name].append((user, None, keyword))
+            self._supplier_name_automaton = None
+
+    @property
+    def articles(self):
+        return set(self._articles)
+
+    @property
+    def articles_only(self):
+        """Отслеживаются только артикулы (можно остановиться, когда все найдены)"""
+        return not (self._suppliers or self._brands or self._supplier_names)
+
+    def compile(self):
+        """Собрать автомат по всем названиям поставщиков"""
+        if self._supplier_names:
+            self._supplier_name_automaton = NameAutomaton(self._supplier_names)
+        return self
+
+    def match(self, items, page=1):
+        """Разобрать страницу выдачи и вернуть список SearchHit"""
+        if self._supplier_names and self._supplier_name_automaton is None:
+            self.compile()
+
+        hits = []
+        articles, suppliers, brands = self._articles, self._suppliers, self._brands
+        automaton = self._supplier_name_automaton
+        offset = (page - 1) * PAGE_SIZE
+
+        for idx, item in enumerate(items):
+            article = str(item.id)
+            owners = articles.get(article, [])
+            if suppliers:
+                owners = owners + suppliers.get(str(item.supplier_id), [])
+            if brands and item.brand:
+                owners = owners + brands.get(item.brand.strip().casefold(), [])
+            if automaton is not None and item.supplier:
+                for name in automaton.find(item.supplier.casefold()):
+                    owners = owners + self._supplier_names[name]
+
+            for user, product, keyword in owners:
+                hits.append(SearchHit(user, product, keyword, article, offset + idx + 1, item.promo_position))
+
+        return hits
+
+
+class WBSearchClient:
+    """Клиент поисковой выдачи WB
+
+    Страницы разных запросов загружаются параллельно (не больше concurrency
+    запросов одновременно) в пределах общего лимита rate запросов в секунду.
+    Товары возвращаются компактными записями SearchItem; если передан cache
+    (SearchPageCache), страницы в пределах его TTL повторно не загружаются.
+    """
+
+    def __init__(self, rate=5, concurrency=8, timeout=10, max_retries=3, cache=None):
+        self.cache = cache
+        self.rate = rate
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'User-Agent': random.choice(USER_AGENTS),
+            'Accept': '*/*',
+            'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
+            'Origin': 'https://www.wildberries.ru',
+            'Referer': 'https://www.wildberries.ru/',
+        })
+
+    def build_params(self, query, page, dest=DEFAULT_DEST, sort='popular'):
+        """Параметры запроса страницы выдачи"""
+        return {
+            'appType': 1,
+            'curr': 'rub',
+            'dest': dest,
+            'query': query,
+            'resultset': 'catalog',
+            'sort': sort,
+            'spp': 30,
+            'page': page,
+            'lang': 'ru',
+            'locale': 'ru',
+        }
+
+    def _get(self, query, page, dest, sort):
+        return self.session.get(
+            SEARCH_URL,
+            params=self.build_params(query, page, dest, sort),
+            timeout=self.timeout
+        )
+
+    def fetch_page(self, query, page, dest=DEFAULT_DEST, sort='popular'):
+        """Загрузить одну страницу выдачи. None - ошибка, [] - выдача закончилась"""
+        return asyncio.run(self._run_one(query, page, dest, sort))
+
+    async def _run_one(self, query, page, dest, sort):
+        self._setup_async()
+        return await self.fetch_page_async(query, page, dest, sort)
+
+    def _setup_async(self):
+        """Общие лимиты создаются заново для каждого цикла событий"""
+        self._bucket = TokenBucket(self.rate)
+        self._backoff = HostBackoff()
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def fetch_page_async(self, query, page, dest=DEFAULT_DEST, sort='popular'):
+        """Загрузить страницу с учетом кэша, лимита скорости и паузы по хосту"""
+        if self.cache is not None:
+            items = self.cache.get(query, page, dest, sort)
+            if items is not None:
+                return items
+
+        host = urlparse(SEARCH_URL).netloc
+
+        for attempt in range(self.max_retries):
+            await self._backoff.wait(host)
+            await self._bucket.acquire()
+            try:
+                async with self._slots:
+                    response = await asyncio.to_thread(self._get, query, page, dest, sort)
+            except requests.exceptions.RequestException as e:
+                print(f"⚠️ Ошибка при запросе страницы {page} для '{query}' (попытка {attempt + 1}): {e}")
+                self._backoff.penalize(host, attempt)
+                continue
+
+            if response.status_code == 429 or response.status_code >= 500:
+                delay = self._backoff.penalize(host, attempt, _retry_after(response))
+                print(f"⏳ {response.status_code} от {host}, пауза {delay:.1f} сек")
+                continue
+
+            if response.status_code != 200:
+                print(f"❌ Ошибка {response.status_code} на странице {page} для '{query}'")
+                return None
+
+            try:
+                products = response.json().get('data', {}).get('products', [])
+            except ValueError:
+                return None
+
+            items = [compact_product(product) for product in products if isinstance(product, dict)]
+            if self.cache is not None:
+                self.cache.set(query, page, dest, sort, items)
+            return items
+
+        return None
+
+    async def _walk_query(self, query, max_pages, dest, sort, on_page, first_page=1):
+        """Последовательно пройти страницы одного запроса (с first_page по max_pages)
+
+        on_page может вернуть True, чтобы остановить обход раньше max_pages.
+        Возвращает WALK_FAILED, если страница не загрузилась (ошибка - это не
+        конец выдачи), WALK_LIMIT, если кончился лимит страниц, иначе
+        WALK_COMPLETE.
+        """
+        for page in range(first_page, max_pages + 1):
+            products = await self.fetch_page_async(query, page, dest, sort)
+            if products is None:
+                print(f"❌ Выдача '{query}' (dest={dest}) не загружена: страница {page}")
+                return WALK_FAILED
+            if not products or on_page(page, products) or len(products) < PAGE_SIZE:
+                return WALK_COMPLETE
+        return WALK_LIMIT
+
+    async def _walk_all(self, pairs, max_pages, sort, on_page, first_pages=None):
+        """Обойти пары (запрос, dest) под общими лимитами
+
+        on_page(запрос, dest, страница, товары) вызывается для каждой страницы.
+        first_pages - {(запрос, dest): с какой страницы продолжить}.
+        Возвращает {(запрос, dest): WALK_COMPLETE / WALK_LIMIT / WALK_FAILED}.
+        """
+        first_pages = first_pages or {}
+        statuses = await asyncio.gather(*(
+            self._walk_query(query, _budget(max_pages, query, dest), dest, sort,
+                             lambda page, products, query=query, dest=dest: on_page(query, dest, page, products),
+                             first_pages.get((query, dest), 1))
+            for query, dest in pairs
+        ))
+        return dict(zip(pairs, statuses))
+
+    def search_regions(self, queries, dests, max_pages=10, sort='popular', stop=None):
+        """Загрузить выдачу по нескольким запросам сразу в нескольких регионах
+
+        :param dests: коды регионов (dest), см. regions.REGIONS
+        :param max_pages: лимит страниц - число, {запрос: число} или {(запрос, dest): число}
+        :param stop: необязательная функция (запрос, страница, товары) -> bool,
+                     True прекращает обход этого запроса в этом регионе
+        :return: {dest: {запрос: [(номер страницы, товары страницы), ...]}};
+                 None вместо списка - выдача не загрузилась
+        """
+        results = {dest: {query: [] for query in queries} for dest in dests}
+
+        def on_page(query, dest, page, products):
+            results[dest][query].append((page, products))
+            return stop(query, page, products) if stop else False
+
+        async def walk():
+            self._setup_async()
+            return await self._walk_all([(query, dest) for dest in results for query in queries], max_pages, sort, on_page)
+
+        statuses = asyncio.run(walk())
+        for (query, dest), status in statuses.items():
+            if status == WALK_FAILED:
+                results[dest][query] = None
+            else:
+                results[dest][query].sort(key=lambda item: item[0])
+        return results
+
+    def search_many(self, queries, max_pages=10, dest=DEFAULT_DEST, sort='popular', stop=None):
+        """Загрузить выдачу по нескольким запросам параллельно (один регион)
+
+        :return: {запрос: [(номер страницы, товары страницы), ...] или None}
+        """
+        return self.search_regions(queries, [dest], max_pages, sort, stop)[dest]
+
+    def match_regions(self, matchers, dests, max_pages=10, widen_to=None):
+        """Пройти выдачу по нескольким запросам в нескольких регионах и сопоставить с SearchMatcher
+
+        Все пары (запрос, регион) загружаются параллельно под общим лимитом
+        скорости, поэтому добавление региона не умножает время проверки
+        (пока лимит не исчерпан). Если запрос отслеживает только артикулы,
+        его обход в регионе прекращается, как только найдены все они.
+
+        :param matchers: {запрос: SearchMatcher}
+        :param dests: коды регионов (dest)
+        :param max_pages: лимит страниц - число, {запрос: число} или {(запрос, dest): число}
+        :param widen_to: если пара исчерпала свой (урезанный) лимит, не найдя всех
+                         артикулов, обход продолжается до widen_to страниц - иначе
+                         товар, опустившийся ниже лимита, выглядел бы пропавшим
+        :return: {dest: {запрос: [SearchHit, ...]}}; None вместо списка - выдача
+                 не загрузилась, и ненайденные артикулы считать пропавшими нельзя
+        """
+        hits = {dest: {query: [] for query in matchers} for dest in dests}
+        found = defaultdict(set)
+        for matcher in matchers.values():
+            matcher.compile()
+
+        def on_page(query, dest, page, products):
+            matcher = matchers[query]
+            page_hits = matcher.match(products, page)
+            hits[dest][query].extend(page_hits)
+            if not matcher.articles_only:
+                return False
+            found[query, dest].update(hit.article for hit in page_hits)
+            return found[query, dest] >= matcher.articles
+
+        async def walk():
+            self._setup_async()
+            pairs = [(query, dest) for dest in hits for query in matchers]
+            statuses = await self._walk_all(pairs, max_pages, 'popular', on_page)
+            if widen_to:
+                # Продолжаем со следующей страницы: уже пройденные заново не загружаются
+                first_pages = {
+                    pair: _budget(max_pages, *pair) + 1 for pair, status in statuses.items()
+                    if status == WALK_LIMIT and _budget(max_pages, *pair) < widen_to
+                }
+                if first_pages:
+                    statuses.update(await self._walk_all(list(first_pages), widen_to, 'popular', on_page, first_pages))
+            return statuses
+
+        for (query, dest), status in asyncio.run(walk()).items():
+            if status == WALK_FAILED:
+                hits[dest][query] = None
+        return hits
+
+    def match_many(self, matchers, max_pages=10, dest=DEFAULT_DEST):
+        """Пройти выдачу по нескольким запросам и сопоставить ее с SearchMatcher
+
+        :param matchers: {запрос: SearchMatcher}
+        :param max_pages: лимит страниц - число или {запрос: число}
+        :return: {запрос: [SearchHit, ...] или None}
+        """
+        return self.match_regions(matchers, [dest], max_pages)[dest]
+
+    def find_positions_many(self, jobs, max_pages=10, dest=DEFAULT_DEST):
+        """Найти позиции артикулов по нескольким запросам параллельно
+
+        :param jobs: {запрос: множество артикулов (строки)}
+        :param max_pages: лимит страниц - число или {запрос: число}
+        :return: {запрос: {артикул: позиция}}; ненайденных артикулов в словарях нет,
+                 None - выдача по запросу не загрузилась
+        """
+        matchers = {}
+        for query, articles in jobs.items():
+            matcher = matchers[query] = SearchMatcher()
+            for article in articles:
+                matcher.track_article(article)
+
+        found = {}
+        for query, hits in self.match_many(matchers, max_pages, dest).items():
+            if hits is None:
+                found[query] = None
+                continue
+            query_found = found[query] = {}
+            for hit in hits:
+                query_found.setdefault(hit.article, hit.position)
+        return found
+
+    def find_positions(self, query, articles, max_pages=10, dest=DEFAULT_DEST):
+        """Найти позиции артикулов в выдаче по одному запросу (None - выдача не загрузилась)"""
+        return self.find_positions_many({query: articles}, max_pages, dest)[query]
+
+
+def _budget(max_pages, query, dest):
+    """Лимит страниц для запроса: общий, по запросу или по паре (запрос, регион)"""
+    if isinstance(max_pages, dict):
+        return max_pages.get((query, dest), max_pages.get(query, 1))
+    return max_pages
+
+
+def page_budget(previous_positions, max_pages, slack=2):
+    """Лимит страниц по результатам прошлой проверки
+
+    Если все артикулы запроса раньше находились, ищем до самой глубокой
+    страницы находки плюс slack; иначе проверяем все max_pages страниц.
+    """
+    if not previous_positions or any(not position for position in previous_positions):
+        return max_pages
+    deepest_page = (max(previous_positions) - 1) // PAGE_SIZE + 1
+    return min(max_pages, deepest_page + slack)
@@ -0,0 +1,228 @@
+# stock/wb_sync.py
+# Инкрементальная загрузка заказов и продаж WB в локальные таблицы (WBOrder / WBSale).
+# Забираем только изменения (flag=0) начиная с сохраненного lastChangeDate.
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import WBOrder, WBSale, WBSyncCursor, WBRetryTask
+from .wb_cache import refresh_in_background, renew_lock
+
+WB_TZ = ZoneInfo('Europe/Moscow')  # Даты в API статистики - московское время без зоны
+
+
+class WBSyncError(Exception):
+    """WB API не отдал данные - курсор не сдвигается, следующий запуск повторит загрузку"""
+
+
+class WBSyncLockLost(WBSyncError):
+    """Блокировку синхронизации перехватил другой процесс - порция не записывается, повтор через очередь"""
+
+
+def _parse_datetime(value):
+    """Дата из WB -> aware datetime; None для пустых и 0001-01-01"""
+    if not value or value.startswith('0001'):
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=WB_TZ)
+    return parsed
+
+
+def _format_datetime(value):
+    """aware datetime -> dateFrom для WB"""
+    return value.astimezone(WB_TZ).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def _money(value):
+    """Сумма из WB (float / None) -> Decimal"""
+    try:
+        return Decimal(str(value or 0)).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        return Decimal('0')
+
+
+def _common_fields(row):
+    """Поля, одинаковые у заказов и продаж"""
+    return {
+        'odid': row.get('odid') or None,
+        'date': _parse_datetime(row.get('date')),
+        'last_change_date': _parse_datetime(row.get('lastChangeDate')),
+        'nm_id': row.get('nmId') or 0,
+        'supplier_article': row.get('supplierArticle') or '',
+        'barcode': row.get('barcode') or '',
+        'tech_size': row.get('techSize') or '',
+        'subject': row.get('subject') or '',
+        'brand': row.get('brand') or '',
+        'warehouse_name': row.get('warehouseName') or '',
+        'region_name': row.get('regionName') or '',
+        'total_price': _money(row.get('totalPrice')),
+        'discount_percent': row.get('discountPercent') or 0,
+        'spp': _money(row.get('spp')),
+        'finished_price': _money(row.get('finishedPrice')),
+        'price_with_disc': _money(row.get('priceWithDisc')),
+        'order_type': row.get('orderType') or '',
+        'g_number': row.get('gNumber') or '',
+    }
+
+
+def _order_from_row(user, row):
+    """Строка orders -> WBOrder (None, если строка без srid)"""
+    if not row.get('srid'):
+        return None
+    return WBOrder(
+        user=user,
+        srid=row['srid'],
+        is_cancel=bool(row.get('isCancel')),
+        cancel_date=_parse_datetime(row.get('cancelDate')),
+        **_common_fields(row)
+    )
+
+
+def _sale_from_row(user, row):
+    """Строка sales -> WBSale (None, если строка без saleID)"""
+    sale_id = row.get('saleID')
+    if not sale_id:
+        return None
+    sale = WBSale(
+        user=user,
+        sale_id=sale_id,
+        srid=row.get('srid') or '',
+        for_pay=_money(row.get('forPay')),
+        **_common_fields(row)
+    )
+    sale.is_return = sale_id.startswith('R') or sale.price_with_disc < 0
+    return sale
+
+
+# Эндпоинт -> (модель, уникальный ключ, конвертер строки)
+SYNC_ENDPOINTS = {
+    'orders': (WBOrder, ['user', 'srid'], _order_from_row),
+    'sales': (WBSale, ['user', 'sale_id'], _sale_from_row),
+}
+
+
+def _upsert(model, unique_fields, objects):
+    """Вставить новые строки и обновить существующие одним bulk-запросом на пачку"""
+    update_fields = [
+        field.name for field in model._meta.concrete_fields
+        if not field.primary_key and field.name not in unique_fields
+    ]
+    model.objects.bulk_create(
+        objects,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=update_fields
+    )
+
+
+def sync_endpoint(service, user, endpoint, initial_days=None):
+    """Загрузить изменения одного эндпоинта с момента последней синхронизации
+
+    Первый запуск забирает последние initial_days дней
+    (по умолчанию settings.WB_SYNC_INITIAL_DAYS). Возвращает число
+    сохраненных строк.
+    """
+    model, unique_fields, convert = SYNC_ENDPOINTS[endpoint]
+    key_field = unique_fields[-1]
+    cursor, _ = WBSyncCursor.objects.get_or_create(user=user, endpoint=endpoint)
+    date_from = cursor.last_change_date or (
+        timezone.now() - timedelta(days=initial_days or settings.WB_SYNC_INITIAL_DAYS)
+    )
+
+    saved = 0
+    while True:
+        rows = service.make_request_with_retry(endpoint, {'dateFrom': _format_datetime(date_from), 'flag': 0})
+        if rows is None:
+            raise WBSyncError(f"{endpoint}: WB API не отдал данные")
+
+        # В одной порции строка может повторяться - оставляем последнюю версию
+        objects = {}
+        for row in rows:
+            obj = convert(user, row)
+            if obj is not None and obj.date and obj.last_change_date:
+                objects[getattr(obj, key_field)] = obj
+
+        # Блокировка продлевается, пока идет синхронизация; если ее все же
+        # перехватили, порцию не пишем
+        if not renew_lock():
+            raise WBSyncLockLost(f"{endpoint}: синхронизацию продолжает другой процесс")
+
+        with transaction.atomic():
+            _upsert(model, unique_fields, list(objects.values()))
+            if objects:
+                cursor.last_change_date = max(obj.last_change_date for obj in objects.values())
+            # Неполная порция - изменений больше нет. Только тогда эндпоинт считается
+            # свежим: прерванная синхронизация не должна откладывать следующую
+            finished = len(rows) < settings.WB_SYNC_PAGE_ROWS or cursor.last_change_date == date_from
+            if finished:
+                cursor.synced_at = timezone.now()
+            cursor.save()
+        saved += len(objects)
+        print(f"🔄 {endpoint}: получено {len(rows)}, сохранено {len(objects)}")
+
+        # Полная порция - за ней есть еще; следующую запрашиваем с lastChangeDate последней строки
+        # (паузу между запросами выдерживает общий реестр лимитов)
+        if finished:
+            return saved
+        date_from = cursor.last_change_date
+
+
+def sync_user(service, user, initial_days=None):
+    """Синхронизировать заказы и продажи пользователя: {эндпоинт: сохранено строк}"""
+    return {
+        endpoint: sync_endpoint(service, user, endpoint, initial_days)
+        for endpoint in SYNC_ENDPOINTS
+    }
+
+
+def schedule_retry(user, error, job='sync'):
+    """Поставить повтор в очередь (process_wb_queue): пауза растет вдвое с каждой неудачей"""
+    task, _ = WBRetryTask.objects.get_or_create(
+        user=user, job=job, defaults={'next_attempt_at': timezone.now()}
+    )
+    delay = min(settings.WB_RETRY_BASE_DELAY * 2 ** task.attempts, settings.WB_RETRY_MAX_DELAY)
+    task.attempts += 1
+    task.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+    task.last_error = str(error)[:500]
+    task.save()
+    print(f"🕒 Синхронизация {user.username} отложена на {delay} сек (попытка {task.attempts})")
+    return task
+
+
+def sync_or_schedule(service, user, initial_days=None):
+    """Синхронизация; при ошибке WB - повтор через очередь, а не в запросе пользователя"""
+    try:
+        saved = sync_user(service, user, initial_days)
+    except WBSyncError as e:
+        schedule_retry(user, e)
+        raise
+    WBRetryTask.objects.filter(user=user, job='sync').delete()
+    return saved
+
+
+def ensure_synced(service, user):
+    """Запустить фоновую синхронизацию, если данные старше settings.WB_SYNC_MAX_AGE
+
+    Возвращает True, если синхронизация запущена или уже идет.
+    """
+    synced_at = [
+        cursor.synced_at for cursor in WBSyncCursor.objects.filter(user=user)
+    ]
+    fresh_since = timezone.now() - timedelta(seconds=settings.WB_SYNC_MAX_AGE)
+    if len(synced_at) == len(SYNC_ENDPOINTS) and all(value and value >= fresh_since for value in synced_at):
+        return False
+    # Неудавшуюся синхронизацию повторяет очередь - не дергаем WB с каждого просмотра
+    if WBRetryTask.objects.filter(user=user, job='sync').exists():
+        return False
+    # Блокировка общего кэша гарантирует, что синхронизация пользователя идет в одном месте
+    refresh_in_background(
+        f"wb_sync_{user.id}",
+        lambda: (sync_or_schedule(service, user), settings.WB_SYNC_MAX_AGE)
+    )
+    return True
@@ -119,8 +119,75 @@ CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'unique-snowflake',
-    }
+    },
+    # Общий для всех воркеров кэш аналитики WB. Нужен атомарный add()
+    # для блокировок: подходят DatabaseCache (таблица создается миграцией), Redis, Memcached
+    'wb_shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'wb_shared_cache',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
+# Отслеживание позиций
+POSITION_LEADERBOARD_DAYS = 30  # За сколько дней считать топ товаров
+POSITION_HISTORY_DAYS = 30  # Период графика истории по умолчанию
+POSITION_HISTORY_MAX_POINTS = 500  # Максимум точек в ответе API истории
+POSITION_CHECK_MAX_PAGES = 10  # Сколько страниц выдачи проверять автоматически
+POSITION_CHECK_PAGE_SLACK = 2  # Запас страниц сверх самой глубокой прошлой находки
+POSITION_RUN_LENGTH = True  # Хранить одинаковые позиции подряд одной строкой (серией)
+POSITION_CHECK_RATE = 5  # Лимит запросов к поиску WB в секунду
+POSITION_CHECK_CONCURRENCY = 8  # Сколько запросов к поиску держать одновременно
+POSITION_REGIONS = ['Москва']  # Регионы автоматической проверки (названия из stock.regions.REGIONS)
+# Правила уведомлений об изменении позиций для пользователей без своих правил
+POSITION_ALERT_DEFAULT_RULES = [
+    ('left_top', 10),  # выпал из топ-10
+    ('drop', 30),  # упал больше чем на 30 позиций
+]
+
+# Свертка старой истории (команда apply_retention)
+POSITION_RAW_RETENTION_DAYS = 90  # Серии позиций старше - в агрегаты по дням (не меньше POSITION_LEADERBOARD_DAYS)
+CAMPAIGN_DAILY_RETENTION_DAYS = 365  # Дневная статистика рекламы старше - в агрегаты по месяцам
+RETENTION_CHUNK_SIZE = 50  # Ключевых слов / кампаний в одной транзакции
+
+# Клиент API Wildberries (статистика)
+WB_API_POOL_HOSTS = 4  # Сколько хостов держать в пуле соединений
+WB_API_POOL_SIZE = 20  # Максимум соединений к одному хосту на процесс
+WB_API_TIMEOUT = (5, 30)  # Таймауты подключения и чтения ответа (сек)
+WB_API_FETCH_WORKERS = 8  # Потоков для параллельной загрузки эндпоинтов
+# Минимальный интервал между запросами одним токеном к эндпоинту (сек) - квоты WB
+WB_API_RATE_LIMITS = {
+    'orders': 60,
+    'sales': 60,
+    'stocks': 60,
+    'incomes': 60,
 }
+WB_API_DEFAULT_INTERVAL = 60  # Для эндпоинтов, которых нет в WB_API_RATE_LIMITS
+WB_CIRCUIT_FAILURES = 5  # Ошибок подряд, после которых эндпоинт отключается
+WB_CIRCUIT_COOLDOWN = 120  # Пауза до первой пробы отключенного эндпоинта (сек), дальше растет вдвое
+WB_RETRY_BASE_DELAY = 60  # Первая пауза перед повтором неудавшейся синхронизации (сек)
+WB_RETRY_MAX_DELAY = 60 * 60  # Максимальная пауза между повторами (сек)
+WB_TODAY_DEADLINE = 25  # Общий лимит времени на загрузку данных за сегодня (сек)
+WB_SHARED_CACHE = 'wb_shared'  # Алиас CACHES для общего кэша аналитики
+WB_STALE_TTL = 60 * 60 * 24  # Сколько хранить устаревшие данные, пока идет пересчет (сек)
+WB_LOCK_TTL = 60  # Блокировка пересчета (сек), должна быть больше WB_TODAY_DEADLINE
+WB_REFRESH_INTERVAL = 60  # Ручное обновление аналитики не чаще (сек)
+WB_BACKGROUND_WORKERS = 2  # Потоков для фонового обновления аналитики в процессе
+WB_REFRESH_AHEAD = 60 * 2  # Страница запускает обновление, если до устаревания меньше (сек)
+WB_REWARM_AHEAD = 60 * 10  # Прогрев по расписанию обновляет данные, устаревающие раньше (сек)
+WB_REWARM_ACTIVE_HOURS = 24  # Прогреваются пользователи, смотревшие аналитику за это время
+
+# Локальная копия заказов и продаж WB
+WB_SYNC_INITIAL_DAYS = 90  # Первая синхронизация забирает столько дней истории
+WB_SYNC_PAGE_ROWS = 80000  # Максимум строк в одном ответе WB - полная порция значит, что есть еще
+WB_SYNC_MAX_AGE = 60 * 30  # Отчет запускает фоновую синхронизацию, если данные старше (сек)
+WB_REPORT_MAX_DAYS = 90  # Максимальный период отчета по продажам (дней)
+
+# Кэш страниц поисковой выдачи
+SEARCH_CACHE_TTL = 60 * 30  # Время жизни страницы (сек)
+SEARCH_CACHE_MAX_PAGES = 2000  # Сколько страниц держать в памяти
+# Файл SQLite второго уровня (общий между процессами), например '/var/cache/wb/search_cache.sqlite3'; None - только память
+SEARCH_CACHE_PATH = os.environ.get('SEARCH_CACHE_PATH') or None
 
 handler400 = 'stock.views.bad_request'
 handler403 = 'stock.views.permission_denied'